@@ -0,0 +1,104 @@
+"""
+Count commits and database round-trips per chat turn.
+
+Compares the previous write path (add/commit/refresh per row) with the
+unit-of-work path in services/chat_service.py, plus a bulk import. The LLM
+is replaced by a canned reply so only database work is measured.
+
+Run against a disposable Postgres database from the repo root:
+
+    python -m benchmarks.chat_write_path --turns 50
+"""
+import argparse
+import time
+from collections import Counter
+
+from sqlalchemy import event
+
+from core.database import SessionLocal, engine, init_db
+from models.chat import Chat, Message
+from models.user import User
+import services.chat_service as chat_service
+
+counters = Counter()
+
+
+@event.listens_for(engine, "before_cursor_execute")
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    counters["round_trips"] += 1
+
+
+@event.listens_for(engine, "commit")
+def _count_commit(conn):
+    counters["commits"] += 1
+
+
+def fake_llm_response(chat):
+    return "This is a canned assistant reply."
+
+
+def legacy_create_chat(db, user, message):
+    """The write sequence create_chat used before the unit-of-work path."""
+    chat = Chat(title="New Chat", user_id=user.id, context=[])
+    db.add(chat)
+    db.commit()
+    db.refresh(chat)
+    user_msg = Message(chat_id=chat.id, sender="user", message=message)
+    db.add(user_msg)
+    db.commit()
+    db.refresh(user_msg)
+    llm_text = fake_llm_response(chat)
+    assistant_msg = Message(chat_id=chat.id, sender="assistant", message=llm_text)
+    db.add(assistant_msg)
+    db.commit()
+    db.refresh(assistant_msg)
+    db.query(Message).filter(Message.chat_id == chat.id, Message.sender == 'user').order_by(Message.created_at).all()
+    return chat
+
+
+def measure(label, turns, fn):
+    counters.clear()
+    start = time.perf_counter()
+    for i in range(turns):
+        fn(i)
+    elapsed = time.perf_counter() - start
+    print(
+        f"{label:<28} commits/turn={counters['commits'] / turns:5.2f} "
+        f"round-trips/turn={counters['round_trips'] / turns:5.2f} "
+        f"ms/turn={elapsed * 1000 / turns:7.2f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=50)
+    args = parser.parse_args()
+
+    init_db()
+    chat_service.generate_llm_response = fake_llm_response
+
+    db = SessionLocal()
+    try:
+        user = User(email=f"bench-{time.time_ns()}@example.com", hashed_password="x", interests=[])
+        db.add(user)
+        db.commit()
+        db.refresh(user)
+
+        measure("legacy create_chat", args.turns, lambda i: legacy_create_chat(db, user, f"hello {i}"))
+        measure("unit-of-work create_chat", args.turns, lambda i: chat_service.create_chat(user, f"hello {i}"))
+
+        chat, _ = chat_service.create_chat(user, "warm up")
+        measure("unit-of-work create_message", args.turns, lambda i: chat_service.create_message(chat.id, user, f"again {i}"))
+
+        history = [{"sender": "user", "message": f"m{i}"} for i in range(20)]
+        measure(
+            "import_chats (10 chats/turn)",
+            args.turns,
+            lambda i: chat_service.import_chats(db, user, [{"title": f"c{i}", "messages": history}] * 10),
+        )
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
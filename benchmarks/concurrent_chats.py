@@ -0,0 +1,114 @@
+"""
+Load test: concurrent chat turns versus the database pool size.
+
+Fires many POST /chat/message requests at once while the LLM is replaced by
+a blocking sleep. Because connections are only checked out for the short
+read and write phases around generation, the number of chats in flight is
+bounded by the threadpool and admission limits, not by the pool size, and
+the peak number of checked-out connections stays near the pool size.
+
+Run against a disposable Postgres database from the repo root:
+
+    python -m benchmarks.concurrent_chats --concurrency 200 --llm-latency 2
+"""
+import argparse
+import asyncio
+import os
+import threading
+import time
+
+# Lift the admission limits so the test measures the pipeline, not the limiter
+os.environ.setdefault("LLM_MAX_CONCURRENT", "10000")
+os.environ.setdefault("LLM_MAX_QUEUED", "10000")
+os.environ.setdefault("USER_LLM_BURST", "10000")
+os.environ.setdefault("GLOBAL_LLM_BURST", "10000")
+os.environ.setdefault("THREADPOOL_SIZE", "1000")
+
+import httpx
+from anyio import to_thread
+from fastapi import FastAPI, Request
+from sqlalchemy import event
+
+from core.config import settings
+from core.database import SessionLocal, engine, init_db
+from models.user import User
+from routes import chat as chat_routes
+import services.chat_service as chat_service
+
+checked_out = 0
+peak_checked_out = 0
+_lock = threading.Lock()
+
+
+@event.listens_for(engine, "checkout")
+def _on_checkout(dbapi_conn, record, proxy):
+    global checked_out, peak_checked_out
+    with _lock:
+        checked_out += 1
+        peak_checked_out = max(peak_checked_out, checked_out)
+
+
+@event.listens_for(engine, "checkin")
+def _on_checkin(dbapi_conn, record):
+    global checked_out
+    with _lock:
+        checked_out -= 1
+
+
+def build_app(user: User) -> FastAPI:
+    app = FastAPI()
+
+    @app.middleware("http")
+    async def fixed_user(request: Request, call_next):
+        request.state.user = user
+        return await call_next(request)
+
+    app.include_router(chat_routes.router)
+    return app
+
+
+async def run(concurrency: int, llm_latency: float) -> None:
+    to_thread.current_default_thread_limiter().total_tokens = settings.THREADPOOL_SIZE
+
+    def slow_llm(chat):
+        time.sleep(llm_latency)
+        return "canned reply"
+
+    chat_service.generate_llm_response = slow_llm
+
+    with SessionLocal() as db:
+        user = User(email=f"load-{time.time_ns()}@example.com", hashed_password="x", interests=[])
+        db.add(user)
+        db.commit()
+        db.refresh(user)
+        db.expunge(user)
+
+    chat, _ = chat_service.create_chat(user, "warm up")
+    transport = httpx.ASGITransport(app=build_app(user))
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        start = time.perf_counter()
+        responses = await asyncio.gather(*[
+            client.post("/chat/message", json={"chat_id": chat.id, "message": f"hi {i}"})
+            for i in range(concurrency)
+        ])
+        elapsed = time.perf_counter() - start
+
+    ok = sum(1 for r in responses if r.status_code == 200)
+    pool = engine.pool
+    print(f"pool size={pool.size()} max overflow={getattr(pool, '_max_overflow', 'n/a')}")
+    print(f"concurrent chats={concurrency} ok={ok} llm latency={llm_latency:.2f}s")
+    print(f"wall time={elapsed:.2f}s (serialised on the pool would be ~{concurrency * llm_latency / max(pool.size(), 1):.1f}s)")
+    print(f"peak checked-out connections={peak_checked_out}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--llm-latency", type=float, default=2.0)
+    args = parser.parse_args()
+    init_db()
+    asyncio.run(run(args.concurrency, args.llm_latency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,388 @@
+"""
+End-to-end benchmark of the API flows in commmongrounds-bruno/.
+
+Each virtual user runs the collection's flow against the real app (main.app
+under uvicorn, with its middleware and lifespan): signup, login, me, create
+chat, send message and stream message (--messages times), get chat, logout.
+LLM calls go to a fake OpenAI server (benchmarks/fake_openai.py) started
+in its own process, with configurable latency and token rate.
+
+Reports, per step, p50/p95/p99 latency and database queries per request,
+plus time-to-first-token of the streamed replies and overall throughput.
+Results are written as JSON named after the current commit, and --compare
+prints the change against an earlier result file:
+
+    python -m benchmarks.e2e --users 100 --concurrency 20 --llm-latency 0.3 --token-rate 50
+    python -m benchmarks.e2e --compare benchmarks/results/e2e-<commit>.json
+
+A reference run with the default options, on 1 CPU against a local
+Postgres, is kept in benchmarks/baselines/e2e.json.
+
+The database is settings.database_url unless --database-url is given. With
+--embedded-postgres DIR a throwaway local Postgres is started there instead
+(needs `pip install pgserver`). SQLite cannot stand in: the models use
+Postgres-only types (ARRAY, TSVECTOR) and a partitioned messages table.
+Use a disposable database; every run signs up new users.
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+
+# Lift the admission limits so the test measures the app, not the limiter
+os.environ.setdefault("LLM_MAX_CONCURRENT", "10000")
+os.environ.setdefault("LLM_MAX_QUEUED", "10000")
+os.environ.setdefault("USER_LLM_BURST", "10000")
+os.environ.setdefault("GLOBAL_LLM_BURST", "10000")
+os.environ.setdefault("THREADPOOL_SIZE", "1000")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import httpx
+
+from benchmarks.worker_scaling import REPO_ROOT, free_port, percentile
+
+STEPS = ("signup", "login", "me", "create_chat", "send_message", "stream_message", "get_chat", "logout")
+
+# Queries issued while serving the current request, keyed by X-Bench-Request
+_request_queries = contextvars.ContextVar("bench_request_queries", default=None)
+query_counts = {}
+
+
+def count_queries(app):
+    """
+    Wrap the ASGI app so every statement run on behalf of a request (in
+    middleware, the threadpool, or a stream's producer task, which all
+    inherit the request's context) is counted against it.
+    """
+    async def counted(scope, receive, send):
+        if scope["type"] != "http":
+            return await app(scope, receive, send)
+        counter = [0]
+        request_id = dict(scope["headers"]).get(b"x-bench-request")
+        if request_id:
+            query_counts[request_id.decode()] = counter
+        token = _request_queries.set(counter)
+        try:
+            await app(scope, receive, send)
+        finally:
+            _request_queries.reset(token)
+    return counted
+
+
+def _on_execute(conn, cursor, statement, parameters, context, executemany):
+    counter = _request_queries.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.queries = defaultdict(list)
+        self.errors = Counter()
+        self.ttft = []
+
+    async def call(self, client, step, method, url, **kwargs):
+        request_id = uuid.uuid4().hex
+        headers = {**kwargs.pop("headers", {}), "X-Bench-Request": request_id}
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, headers=headers, **kwargs)
+        except httpx.HTTPError:
+            self.errors[step] += 1
+            return None
+        elapsed = time.perf_counter() - start
+        counter = query_counts.pop(request_id, [0])
+        if response.status_code >= 400:
+            self.errors[step] += 1
+            return None
+        self.latencies[step].append(elapsed)
+        self.queries[step].append(counter[0])
+        return response
+
+    async def stream(self, client, step, url, **kwargs):
+        request_id = uuid.uuid4().hex
+        headers = {**kwargs.pop("headers", {}), "X-Bench-Request": request_id}
+        start = time.perf_counter()
+        first_token = None
+        try:
+            async with client.stream("POST", url, headers=headers, **kwargs) as response:
+                if response.status_code >= 400:
+                    await response.aread()
+                    self.errors[step] += 1
+                    query_counts.pop(request_id, None)
+                    return
+                async for line in response.aiter_lines():
+                    if first_token is None and line.startswith("data:") and line[5:].strip():
+                        first_token = time.perf_counter()
+        except httpx.HTTPError:
+            self.errors[step] += 1
+            query_counts.pop(request_id, None)
+            return
+        self.latencies[step].append(time.perf_counter() - start)
+        self.queries[step].append(query_counts.pop(request_id, [0])[0])
+        if first_token is not None:
+            self.ttft.append(first_token - start)
+
+
+async def user_flow(client, recorder, email, messages):
+    password = "SuperSecret123!"
+    signup = await recorder.call(client, "signup", "POST", "/auth/signup", json={
+        "email": email,
+        "password": password,
+        "username": email.split("@")[0],
+        "interests": ["music", "coding", "travel"],
+        "location": "San Francisco",
+    })
+    if signup is None:
+        return
+    login = await recorder.call(client, "login", "POST", "/auth/login", json={"email": email, "password": password})
+    if login is None:
+        return
+    auth = {"Authorization": f"Bearer {login.json()['access_token']}"}
+    await recorder.call(client, "me", "GET", "/auth/me", headers=auth)
+    chat = await recorder.call(client, "create_chat", "POST", "/chat/", headers=auth, json={
+        "message": "Hi, I need help with my project.",
+    })
+    if chat is not None:
+        chat_id = chat.json()["id"]
+        for _ in range(messages):
+            body = {"chat_id": chat_id, "message": "Can you provide more details on that?"}
+            await recorder.call(client, "send_message", "POST", "/chat/message", headers=auth, json=body)
+            await recorder.stream(client, "stream_message", "/chat/message/stream", headers=auth, json=body)
+        await recorder.call(client, "get_chat", "GET", f"/chat/{chat_id}", headers=auth)
+    await recorder.call(client, "logout", "POST", "/auth/logout", headers=auth)
+
+
+def start_fake_openai(args):
+    port = free_port()
+    process = subprocess.Popen(
+        [
+            sys.executable, "-m", "benchmarks.fake_openai", "--port", str(port),
+            "--latency", str(args.llm_latency),
+            "--token-rate", str(args.token_rate),
+            "--reply-tokens", str(args.reply_tokens),
+        ],
+        cwd=REPO_ROOT,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return process, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise SystemExit("Fake OpenAI server did not start")
+
+
+def prepare_schema():
+    from sqlalchemy.exc import DBAPIError
+    from core.database import Base, engine, init_db
+    from models.user import User
+    try:
+        init_db()
+    except DBAPIError as e:
+        # Minimal Postgres builds (pgserver's among them) ship without
+        # contrib; only the location index of hybrid user search needs it
+        if "pg_trgm" not in str(e):
+            raise
+        print("pg_trgm is not available; creating the schema without the location trigram index")
+        User.__table__.indexes = {index for index in User.__table__.indexes if index.name != "ix_users_location_trgm"}
+        Base.metadata.create_all(engine)
+
+
+def summarize(recorder, wall_time):
+    steps = {}
+    for step in STEPS:
+        latencies = recorder.latencies.get(step, [])
+        queries = recorder.queries.get(step, [])
+        steps[step] = {
+            "count": len(latencies),
+            "errors": recorder.errors[step],
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "mean_ms": sum(latencies) / len(latencies) * 1000 if latencies else float("nan"),
+            "db_queries_per_request": sum(queries) / len(queries) if queries else float("nan"),
+        }
+    requests = sum(len(values) for values in recorder.latencies.values())
+    return {
+        "wall_time_s": wall_time,
+        "requests": requests,
+        "errors": sum(recorder.errors.values()),
+        "throughput_rps": requests / wall_time if wall_time else 0.0,
+        "steps": steps,
+        "ttft_ms": {
+            "p50": percentile(recorder.ttft, 50) * 1000,
+            "p95": percentile(recorder.ttft, 95) * 1000,
+            "p99": percentile(recorder.ttft, 99) * 1000,
+        },
+    }
+
+
+def print_report(summary):
+    print(f"{'step':<16}{'ok':>7}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries/req':>13}")
+    for step, stats in summary["steps"].items():
+        print(
+            f"{step:<16}{stats['count']:>7}{stats['errors']:>8}{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}"
+            f"{stats['p99_ms']:>10.1f}{stats['db_queries_per_request']:>13.1f}"
+        )
+    ttft = summary["ttft_ms"]
+    print(f"time to first token  p50={ttft['p50']:.1f} ms  p95={ttft['p95']:.1f} ms  p99={ttft['p99']:.1f} ms")
+    print(
+        f"{summary['requests']} requests, {summary['errors']} errors in {summary['wall_time_s']:.1f}s"
+        f" = {summary['throughput_rps']:.1f} requests/s"
+    )
+
+
+def print_comparison(summary, baseline):
+    def change(new, old):
+        if not old or old != old or new != new:  # missing or NaN
+            return "      n/a"
+        return f"{(new - old) / old * 100:>+8.1f}%"
+
+    print(f"\nchange against {baseline.get('commit', '?')} ({baseline.get('timestamp', '?')})")
+    print(f"{'step':<16}{'p50':>10}{'p95':>10}{'p99':>10}{'queries':>10}")
+    for step, stats in summary["steps"].items():
+        old = baseline.get("steps", {}).get(step, {})
+        print(
+            f"{step:<16}{change(stats['p50_ms'], old.get('p50_ms')):>10}{change(stats['p95_ms'], old.get('p95_ms')):>10}"
+            f"{change(stats['p99_ms'], old.get('p99_ms')):>10}"
+            f"{change(stats['db_queries_per_request'], old.get('db_queries_per_request')):>10}"
+        )
+    print(f"{'ttft':<16}{change(summary['ttft_ms']['p50'], baseline.get('ttft_ms', {}).get('p50')):>10}"
+          f"{change(summary['ttft_ms']['p95'], baseline.get('ttft_ms', {}).get('p95')):>10}"
+          f"{change(summary['ttft_ms']['p99'], baseline.get('ttft_ms', {}).get('p99')):>10}")
+    print(f"{'throughput':<16}{change(summary['throughput_rps'], baseline.get('throughput_rps')):>10}")
+
+
+def git_commit():
+    def git(*args):
+        return subprocess.run(["git", *args], cwd=REPO_ROOT, capture_output=True, text=True).stdout.strip()
+    try:
+        return git("rev-parse", "--short=12", "HEAD") or "unknown", bool(git("status", "--porcelain", "--untracked-files=no"))
+    except OSError:
+        return "unknown", False
+
+
+async def run(args):
+    import uvicorn
+    from sqlalchemy import event
+
+    import utils.chat
+    from benchmarks.fake_openai import fake_openai_client
+    from core.config import settings
+    from core.database import engine
+
+    prepare_schema()
+    fake_process, fake_url = start_fake_openai(args)
+    utils.chat._openai_client = fake_openai_client(fake_url)
+    event.listen(engine, "before_cursor_execute", _on_execute)
+
+    from main import app
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(
+        count_queries(app), host="127.0.0.1", port=port, log_level="warning", access_log=False, lifespan="on",
+    ))
+    serve_task = asyncio.create_task(server.serve())
+    try:
+        while not server.started:
+            if serve_task.done():
+                raise SystemExit("App server failed to start")
+            await asyncio.sleep(0.05)
+
+        run_id = uuid.uuid4().hex[:8]
+        limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency * 2)
+        base_url = f"http://127.0.0.1:{port}{settings.prefix}"
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+            # One unrecorded flow to warm connections, caches and the LLM client
+            await user_flow(client, Recorder(), f"bench-{run_id}-warmup@example.com", 1)
+
+            recorder = Recorder()
+            slots = asyncio.Semaphore(args.concurrency)
+
+            async def one_user(i):
+                async with slots:
+                    await user_flow(client, recorder, f"bench-{run_id}-{i}@example.com", args.messages)
+
+            start = time.perf_counter()
+            await asyncio.gather(*(one_user(i) for i in range(args.users)))
+            wall_time = time.perf_counter() - start
+    finally:
+        server.should_exit = True
+        await serve_task
+        fake_process.terminate()
+        fake_process.wait()
+    return summarize(recorder, wall_time), engine.dialect.name
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50, help="Virtual users, each running the whole flow once")
+    parser.add_argument("--concurrency", type=int, default=10, help="Virtual users in flight at once")
+    parser.add_argument("--messages", type=int, default=2, help="Send/stream message pairs per user")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="Fake OpenAI seconds to first token")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="Fake OpenAI tokens per second")
+    parser.add_argument("--reply-tokens", type=int, default=40, help="Fake OpenAI tokens per reply")
+    parser.add_argument("--database-url", help="Overrides settings.database_url")
+    parser.add_argument("--embedded-postgres", metavar="DIR", help="Start a throwaway Postgres in DIR with pgserver")
+    parser.add_argument("--output", help="Result file (default: benchmarks/results/e2e-<commit>.json)")
+    parser.add_argument("--compare", metavar="FILE", help="Earlier result file to compare against")
+    args = parser.parse_args()
+
+    # Must be set before core.database creates the engine
+    from core.config import settings
+    pg_server = None
+    if args.embedded_postgres:
+        import pgserver
+        pg_server = pgserver.get_server(args.embedded_postgres, cleanup_mode="stop")
+        settings.database_url = pg_server.get_uri()
+    elif args.database_url:
+        settings.database_url = args.database_url
+
+    try:
+        summary, dialect = asyncio.run(run(args))
+    finally:
+        if pg_server is not None:
+            pg_server.cleanup()
+
+    commit, dirty = git_commit()
+    result = {
+        "benchmark": "e2e",
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {
+            "users": args.users,
+            "concurrency": args.concurrency,
+            "messages": args.messages,
+            "llm_latency_s": args.llm_latency,
+            "token_rate": args.token_rate,
+            "reply_tokens": args.reply_tokens,
+            "database": dialect,
+        },
+        **summary,
+    }
+    print_report(summary)
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(summary, json.load(f))
+
+    output = args.output or os.path.join(REPO_ROOT, "benchmarks", "results", f"e2e-{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Local stand-in for the OpenAI API, for load tests and benchmarks.
+
+Serves /v1/chat/completions (plain and streamed) and /v1/embeddings. Every
+completion waits `latency` seconds before its first token, then produces
+`reply-tokens` tokens at `token-rate` tokens per second, so time-to-first-
+token and generation time can be set independently of the app under test.
+Requests are counted per path.
+
+As a standalone server, usually in its own process so it does not compete
+with the app for the GIL:
+
+    python -m benchmarks.fake_openai --port 9200 --latency 0.3 --token-rate 50
+
+Point the app's OpenAI client at it with fake_openai_client:
+
+    utils.chat._openai_client = fake_openai_client("http://127.0.0.1:9200")
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from collections import Counter
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+WORDS = "the quick brown fox jumps over a lazy dog while we talk about common interests".split()
+EMBEDDING_DIM = 1536  # models.user.VECTOR_DIM
+
+
+class FakeOpenAI:
+    def __init__(self, latency: float = 0.0, token_rate: float = 50.0, reply_tokens: int = 40):
+        self.latency = latency
+        self.token_rate = token_rate
+        self.reply_tokens = reply_tokens
+        self.hits = Counter()
+        self.app = Starlette(routes=[
+            Route("/v1/chat/completions", self.chat_completions, methods=["POST"]),
+            Route("/v1/embeddings", self.embeddings, methods=["POST"]),
+        ])
+
+    def _tokens(self, max_tokens: int):
+        count = min(self.reply_tokens, max_tokens or self.reply_tokens)
+        return [WORDS[i % len(WORDS)] + " " for i in range(count)]
+
+    async def chat_completions(self, request):
+        self.hits[request.url.path] += 1
+        body = await request.json()
+        tokens = self._tokens(body.get("max_tokens"))
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        interval = 1 / self.token_rate if self.token_rate > 0 else 0.0
+
+        if not body.get("stream"):
+            await asyncio.sleep(self.latency + interval * len(tokens))
+            return JSONResponse({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": body.get("model"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(tokens)},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)},
+            })
+
+        async def events():
+            def chunk(delta, finish_reason=None):
+                data = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": body.get("model"),
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                }
+                return f"data: {json.dumps(data)}\n\n"
+
+            await asyncio.sleep(self.latency)
+            yield chunk({"role": "assistant"})
+            for i, token in enumerate(tokens):
+                if i:
+                    await asyncio.sleep(interval)
+                yield chunk({"content": token})
+            yield chunk({}, "stop")
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    async def embeddings(self, request):
+        self.hits[request.url.path] += 1
+        body = await request.json()
+        inputs = body.get("input")
+        inputs = inputs if isinstance(inputs, list) else [inputs]
+        await asyncio.sleep(self.latency)
+        return JSONResponse({
+            "object": "list",
+            "data": [
+                {"object": "embedding", "index": i, "embedding": [((i + j) % 7) / 7 for j in range(EMBEDDING_DIM)]}
+                for i in range(len(inputs))
+            ],
+            "model": body.get("model"),
+        })
+
+
+def fake_openai_client(base_url: str, max_connections: int = 1000):
+    """
+    The OpenAI client utils/chat.py and services/auth_service.py use,
+    pointed at a FakeOpenAI server, so the app runs its real client code
+    against it. Retries are off so a failing fake server shows up as errors.
+    """
+    import httpx
+    from openai import OpenAI
+    return OpenAI(
+        api_key="fake",
+        base_url=f"{base_url}/v1",
+        max_retries=0,
+        http_client=httpx.Client(
+            timeout=120,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        ),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=9200)
+    parser.add_argument("--latency", type=float, default=0.3, help="Seconds before the first token")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="Tokens per second after the first")
+    parser.add_argument("--reply-tokens", type=int, default=40, help="Tokens per completion (capped by max_tokens)")
+    args = parser.parse_args()
+
+    import uvicorn
+    fake = FakeOpenAI(args.latency, args.token_rate, args.reply_tokens)
+    uvicorn.run(fake.app, host="127.0.0.1", port=args.port, log_level="warning", access_log=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Per-request logging overhead before and after the queue-based logging setup.
+
+Replays the log calls a typical authenticated request used to make
+(session open/close in get_db and the middleware, token decode, the
+authenticated-user line) under three configurations:
+
+* before: synchronous StreamHandler at INFO, f-string messages
+* after: QueueHandler/QueueListener with JSON output, hot-path calls at DEBUG
+* after, DEBUG enabled with 1% sampling on the hot-path loggers
+
+Output goes to os.devnull so only the logging cost is measured. The timed
+section includes draining the queue, so work moved to the listener thread
+is still counted. Needs no database:
+
+    python -m benchmarks.logging_overhead --requests 50000
+"""
+import argparse
+import logging
+import logging.handlers
+import os
+import queue
+import time
+
+from core.config import JsonFormatter, SamplingFilter
+
+db_log = logging.getLogger("core.database")
+auth_log = logging.getLogger("core.middleware")
+sec_log = logging.getLogger("core.security")
+EMAIL = "jane.doe@example.com"
+
+
+def request_before():
+    db_log.info("Opening new database session")
+    sec_log.info("JWT token decoded successfully")
+    db_log.info("Opening new database session")
+    auth_log.info(f"Authenticated user: {EMAIL}")
+    db_log.info("Database session closed")
+    db_log.info("Opening new database session")
+    db_log.info("Database session closed")
+
+
+def request_after():
+    db_log.debug("Opening new database session")
+    sec_log.debug("JWT token decoded successfully")
+    db_log.debug("Opening new database session")
+    auth_log.debug("Authenticated user: %s", EMAIL)
+    db_log.debug("Database session closed")
+    db_log.debug("Opening new database session")
+    db_log.debug("Database session closed")
+
+
+def install(handler, level):
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+    # Loggers cache their effective level, so clear it after changing the root level
+    logging.getLogger().manager._clear_cache()
+
+
+def measure(label, requests, fn, listener=None):
+    if listener:
+        listener.start()
+    start = time.perf_counter()
+    for _ in range(requests):
+        fn()
+    if listener:
+        listener.stop()  # Drain the queue inside the timed section
+    elapsed = time.perf_counter() - start
+    print(f"{label:<40} {elapsed * 1e6 / requests:8.2f} us/request")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=50_000)
+    args = parser.parse_args()
+
+    with open(os.devnull, "w") as devnull:
+        sync_handler = logging.StreamHandler(devnull)
+        sync_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+        install(sync_handler, logging.INFO)
+        measure("before (sync, INFO, f-strings)", args.requests, request_before)
+
+        json_handler = logging.StreamHandler(devnull)
+        json_handler.setFormatter(JsonFormatter())
+
+        log_queue = queue.SimpleQueue()
+        install(logging.handlers.QueueHandler(log_queue), logging.INFO)
+        listener = logging.handlers.QueueListener(log_queue, json_handler)
+        measure("after (queue, hot paths at DEBUG)", args.requests, request_after, listener)
+
+        sampled = logging.handlers.QueueHandler(log_queue)
+        sampled.addFilter(SamplingFilter({"core": 0.01}))
+        install(sampled, logging.DEBUG)
+        listener = logging.handlers.QueueListener(log_queue, json_handler)
+        measure("after (queue, DEBUG on, 1% sampled)", args.requests, request_after, listener)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Provider round-trips and latency of the OAuth callback's user-info step.
+
+Runs against the in-process stub provider (benchmarks/oauth_stub.py) with
+a simulated network latency and reports:
+
+* ID token verification (Google/Apple path): the first call, which fills
+  the discovery and JWKS cache, and warm calls, which must make no
+  requests to the provider and cost only the local signature check
+* GitHub user info: the /user and /user/emails fetches issued sequentially
+  versus concurrently, as fetch_github_user_info does
+
+Needs no database:
+
+    python -m benchmarks.oauth_login --latency 0.05 --rounds 200
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+from benchmarks.oauth_stub import STUB_URL, StubProvider
+from core import oidc
+from core.config import settings
+from services.oauth_service import fetch_github_user_info
+
+AUDIENCE = "benchmark-client"
+
+
+async def sequential_github_fetch(access_token: str) -> dict:
+    headers = {"Authorization": f"Bearer {access_token}"}
+    client = oidc.http_client()
+    user = (await client.get(f"{STUB_URL}/user", headers=headers)).json()
+    emails = (await client.get(f"{STUB_URL}/user/emails", headers=headers)).json()
+    user["email"] = emails[0]["email"] if emails else None
+    return user
+
+
+async def timed(fn, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        await fn()
+    return (time.perf_counter() - start) / rounds
+
+
+async def run(args):
+    stub = StubProvider(latency=args.latency)
+    settings.GITHUB_API_URL = STUB_URL
+    oidc.set_http_client(httpx.AsyncClient(transport=httpx.ASGITransport(app=stub.app)))
+    id_token = stub.mint_id_token("someone@example.com", AUDIENCE)
+
+    async def verify():
+        return await oidc.verify_id_token(id_token, stub.discovery_url, AUDIENCE)
+
+    cold = await timed(verify, 1)
+    cold_hits = sum(stub.hits.values())
+    stub.hits.clear()
+    warm = await timed(verify, args.rounds)
+    print(f"ID token verification, cold   {cold * 1000:9.3f} ms  {cold_hits} provider requests")
+    print(f"ID token verification, warm   {warm * 1000:9.3f} ms  "
+          f"{sum(stub.hits.values()) / args.rounds:.2f} provider requests/login")
+
+    github_rounds = max(args.rounds // 20, 5)
+    sequential = await timed(lambda: sequential_github_fetch("token"), github_rounds)
+    concurrent = await timed(lambda: fetch_github_user_info("token"), github_rounds)
+    print(f"GitHub user info, sequential  {sequential * 1000:9.3f} ms")
+    print(f"GitHub user info, concurrent  {concurrent * 1000:9.3f} ms")
+    await oidc.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.05, help="Simulated provider latency in seconds")
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
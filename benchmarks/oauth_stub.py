@@ -0,0 +1,112 @@
+"""
+Local stub OAuth provider for tests and latency benchmarks.
+
+Serves an OpenID discovery document, a JWKS with a freshly generated RSA
+key, and GitHub-style /user and /user/emails endpoints. Every response can
+be delayed by a fixed latency to mimic a remote provider, and requests are
+counted per path, which shows how many provider round-trips a login costs.
+
+In process, bind the app's OAuth HTTP client to the stub:
+
+    stub = StubProvider(latency=0.05)
+    oidc.set_http_client(httpx.AsyncClient(transport=httpx.ASGITransport(app=stub.app), base_url=STUB_URL))
+
+As a standalone server, for clients in another process:
+
+    python -m benchmarks.oauth_stub --port 9100 --latency 0.05
+
+The stub has no authorization or token endpoint; tokens are minted
+directly with StubProvider.mint_id_token.
+"""
+import argparse
+import asyncio
+import time
+import uuid
+from collections import Counter
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+STUB_URL = "http://oauth-stub"
+
+
+class StubProvider:
+    def __init__(self, issuer: str = STUB_URL, latency: float = 0.0):
+        self.issuer = issuer
+        self.latency = latency
+        self.hits = Counter()
+        self.kid = uuid.uuid4().hex[:8]
+        self._private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self.app = Starlette(routes=[
+            Route("/.well-known/openid-configuration", self.discovery),
+            Route("/jwks", self.jwks),
+            Route("/user", self.github_user),
+            Route("/user/emails", self.github_emails),
+        ])
+
+    @property
+    def discovery_url(self) -> str:
+        return f"{self.issuer}/.well-known/openid-configuration"
+
+    def mint_id_token(self, email: str, audience: str, nonce: str = None, expires_in: int = 3600) -> str:
+        now = int(time.time())
+        claims = {
+            "iss": self.issuer,
+            "sub": uuid.uuid5(uuid.NAMESPACE_URL, email).hex,
+            "aud": audience,
+            "email": email,
+            "email_verified": True,
+            "name": email.split("@")[0],
+            "iat": now,
+            "exp": now + expires_in,
+        }
+        if nonce:
+            claims["nonce"] = nonce
+        return jwt.encode(claims, self._private_key, algorithm="RS256", headers={"kid": self.kid})
+
+    async def _respond(self, request, body):
+        self.hits[request.url.path] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return JSONResponse(body)
+
+    async def discovery(self, request):
+        return await self._respond(request, {
+            "issuer": self.issuer,
+            "authorization_endpoint": f"{self.issuer}/authorize",
+            "token_endpoint": f"{self.issuer}/token",
+            "jwks_uri": f"{self.issuer}/jwks",
+            "id_token_signing_alg_values_supported": ["RS256"],
+        })
+
+    async def jwks(self, request):
+        key = jwt.algorithms.RSAAlgorithm.to_jwk(self._private_key.public_key(), as_dict=True)
+        key.update({"kid": self.kid, "use": "sig", "alg": "RS256"})
+        return await self._respond(request, {"keys": [key]})
+
+    async def github_user(self, request):
+        return await self._respond(request, {"id": 1, "login": "stub-user", "name": "Stub User", "avatar_url": None})
+
+    async def github_emails(self, request):
+        return await self._respond(request, [
+            {"email": "secondary@example.com", "primary": False, "verified": True},
+            {"email": "stub-user@example.com", "primary": True, "verified": True},
+        ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to delay every response")
+    args = parser.parse_args()
+
+    import uvicorn
+    stub = StubProvider(issuer=f"http://127.0.0.1:{args.port}", latency=args.latency)
+    uvicorn.run(stub.app, host="127.0.0.1", port=args.port)
+
+
+if __name__ == "__main__":
+    main()
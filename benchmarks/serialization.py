@@ -0,0 +1,75 @@
+"""
+Serialization cost of a ChatResponse with 1,000 messages.
+
+Compares the generic FastAPI path (validate the ORM-like object, then
+jsonable_encoder + json.dumps, as the default JSONResponse does) with the
+ORJSONResponse default and with rendering straight to bytes through the
+precompiled TypeAdapter used by core.responses.render_model. Needs no
+database:
+
+    python -m benchmarks.serialization --messages 1000 --rounds 200
+"""
+import argparse
+import json
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+
+from schemas.chat import ChatResponse, chat_response_adapter
+
+
+def build_chat(n_messages: int) -> SimpleNamespace:
+    now = datetime.now(timezone.utc)
+    messages = [
+        SimpleNamespace(
+            id=i,
+            chat_id=1,
+            sender="user" if i % 2 == 0 else "assistant",
+            message=f"Message number {i} with a little bit of text to make it realistic.",
+            created_at=now,
+        )
+        for i in range(n_messages)
+    ]
+    return SimpleNamespace(id=1, title="Benchmark chat", user_id=1, context=[], expanded_context=[], messages=messages)
+
+
+def generic_path(chat) -> bytes:
+    model = ChatResponse.model_validate(chat)
+    return json.dumps(jsonable_encoder(model), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def orjson_path(chat) -> bytes:
+    model = ChatResponse.model_validate(chat)
+    return orjson.dumps(model.model_dump(mode="json"))
+
+
+def adapter_path(chat) -> bytes:
+    return chat_response_adapter.dump_json(chat_response_adapter.validate_python(chat, from_attributes=True))
+
+
+def measure(label, rounds, fn, chat):
+    fn(chat)  # Warm up
+    start = time.perf_counter()
+    for _ in range(rounds):
+        body = fn(chat)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<42} {elapsed * 1000 / rounds:8.3f} ms/response  {len(body):>8} bytes")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    chat = build_chat(args.messages)
+    measure("validate + jsonable_encoder + json.dumps", args.rounds, generic_path, chat)
+    measure("validate + model_dump + orjson", args.rounds, orjson_path, chat)
+    measure("TypeAdapter validate + dump_json", args.rounds, adapter_path, chat)
+
+
+if __name__ == "__main__":
+    main()
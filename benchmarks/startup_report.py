@@ -0,0 +1,108 @@
+"""
+Import-time and time-to-ready report for a worker.
+
+Runs two fresh interpreters from the repo root:
+
+* `python -X importtime -c "import main"`, to list the slowest imports and
+  confirm that openai, authlib and numpy are no longer loaded at import
+* a script that imports main and enters the app lifespan, to time import,
+  startup, and the total time until the worker is ready
+
+The database does not have to be reachable (the startup ping only logs), but
+the numbers are more realistic when it is:
+
+    python -m benchmarks.startup_report --top 15 --output startup.md
+
+A reference run is kept in benchmarks/baselines/startup.md.
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAZY_MODULES = ("openai", "authlib", "numpy")
+
+_IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+_READY_SCRIPT = """
+import asyncio, json, sys, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+
+async def enter_lifespan():
+    async with main.lifespan(main.app):
+        return time.perf_counter()
+
+ready = asyncio.run(enter_lifespan())
+print(json.dumps({
+    "import_s": imported - start,
+    "startup_s": ready - imported,
+    "time_to_ready_s": ready - start,
+    "lazy_modules_loaded": [m for m in %r if m in sys.modules],
+}))
+""" % (LAZY_MODULES,)
+
+
+def import_times():
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=REPO_ROOT, capture_output=True, text=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            rows.append((module, int(self_us), int(cumulative_us), len(indent) // 2))
+    return rows
+
+
+def time_to_ready():
+    result = subprocess.run([sys.executable, "-c", _READY_SCRIPT], cwd=REPO_ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise SystemExit(f"Startup failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--output", help="Also write the report to this markdown file")
+    args = parser.parse_args()
+
+    rows = import_times()
+    ready = time_to_ready()
+    # Top-level entries of -X importtime carry the full cost of everything they import
+    top_level_total = sum(cumulative for _, _, cumulative, depth in rows if depth == 0)
+    loaded_lazy = sorted({m.split(".")[0] for m, *_ in rows if m.split(".")[0] in LAZY_MODULES})
+
+    lines = [
+        "# Worker startup report",
+        "",
+        f"- `import main`: {top_level_total / 1e6:.3f} s (-X importtime), {ready['import_s']:.3f} s (wall)",
+        f"- lifespan startup: {ready['startup_s']:.3f} s",
+        f"- time to ready: {ready['time_to_ready_s']:.3f} s",
+        f"- heavy modules loaded at import: {', '.join(loaded_lazy) or 'none'}",
+        f"- heavy modules loaded once ready: {', '.join(ready['lazy_modules_loaded']) or 'none'}",
+        "",
+        f"## Slowest {args.top} imports (cumulative)",
+        "",
+        "| module | self (ms) | cumulative (ms) |",
+        "| --- | ---: | ---: |",
+    ]
+    for module, self_us, cumulative_us, _ in sorted(rows, key=lambda row: row[2], reverse=True)[:args.top]:
+        lines.append(f"| {module} | {self_us / 1000:.1f} | {cumulative_us / 1000:.1f} |")
+    report = "\n".join(lines) + "\n"
+
+    print(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+
+
+if __name__ == "__main__":
+    main()
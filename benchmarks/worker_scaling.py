@@ -0,0 +1,132 @@
+"""
+Load-test profile: throughput versus number of workers.
+
+Starts `serve.py` with 1, 2, 4, ... workers on a free port, waits for the
+liveness probe, then drives a fixed number of keep-alive connections at an
+endpoint for a fixed duration and reports requests/s and latency
+percentiles. The defaults hit GET /health/live, which touches neither the
+database nor the LLM, so the numbers show the per-worker ceiling of the
+HTTP stack (loop, parser, middleware) and how it scales with processes:
+
+    python -m benchmarks.worker_scaling --workers 1 2 4 8 --connections 256 --duration 15
+
+Run the load generator on a different machine (or pin it with taskset) for
+numbers above a handful of workers; otherwise it competes for the same cores.
+"""
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_until_live(base_url: str, timeout: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(f"{base_url}/health/live")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise SystemExit(f"Server at {base_url} did not become live within {timeout}s")
+
+
+async def drive(url: str, connections: int, duration: float):
+    latencies = []
+    errors = 0
+    limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        deadline = time.monotonic() + duration
+
+        async def worker():
+            nonlocal errors
+            while time.monotonic() < deadline:
+                start = time.perf_counter()
+                try:
+                    response = await client.get(url)
+                    if response.status_code != 200:
+                        errors += 1
+                        continue
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(connections)))
+        elapsed = time.perf_counter() - start
+    return latencies, errors, elapsed
+
+
+def percentile(values, q):
+    if not values:
+        return float("nan")
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1] if len(values) > 1 else values[0]
+
+
+async def run_profile(workers: int, args) -> dict:
+    port = free_port()
+    env = dict(os.environ, LOG_LEVEL=os.getenv("LOG_LEVEL", "WARNING"))
+    server = subprocess.Popen(
+        [sys.executable, "serve.py", "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers)],
+        cwd=REPO_ROOT, env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        await wait_until_live(base_url)
+        await drive(base_url + args.path, args.connections, min(args.duration, 2.0))  # Warm up every worker
+        latencies, errors, elapsed = await drive(base_url + args.path, args.connections, args.duration)
+    finally:
+        server.terminate()
+        server.wait(timeout=60)
+    return {
+        "workers": workers,
+        "rps": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "errors": errors,
+    }
+
+
+async def main_async(args):
+    results = []
+    for workers in args.workers:
+        result = await run_profile(workers, args)
+        results.append(result)
+        print(
+            f"{result['workers']:>3} workers  {result['rps']:>10.0f} req/s  "
+            f"p50 {result['p50_ms']:7.2f} ms  p99 {result['p99_ms']:7.2f} ms  errors {result['errors']}"
+        )
+    baseline = results[0]["rps"] / results[0]["workers"]
+    print("\nScaling efficiency (req/s per worker relative to the first run):")
+    for result in results:
+        print(f"{result['workers']:>3} workers  {result['rps'] / result['workers'] / baseline:6.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--connections", type=int, default=128)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--path", default="/health/live")
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+import hashlib
+import os
+import re
+import tempfile
+from abc import ABC, abstractmethod
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+from core.config import settings, logger
+
+# "<32 hex chars of sha256>[_<thumbnail size>].<ext>", e.g. "9f86d081884c7d659a2feaa0c55ad015_256.jpg"
+KEY_PATTERN = re.compile(r"^[0-9a-f]{32}(?:_\d{1,4})?\.(?:jpg|png|webp|gif)$")
+
+CONTENT_TYPES = {
+    "jpg": "image/jpeg",
+    "png": "image/png",
+    "webp": "image/webp",
+    "gif": "image/gif",
+}
+
+
+def content_key(data: bytes, extension: str) -> str:
+    """
+    Key for a blob, derived from its content. Identical uploads share one
+    key (and one stored copy), and a key's content never changes.
+    """
+    return f"{hashlib.sha256(data).hexdigest()[:32]}.{extension}"
+
+
+def derived_key(key: str, size: int, extension: str = "jpg") -> str:
+    """
+    Key of a thumbnail of `key`. Derived from the original's key, so it is
+    just as immutable.
+    """
+    return f"{key.split('.', 1)[0]}_{size}.{extension}"
+
+
+def content_type_for(key: str) -> str:
+    return CONTENT_TYPES.get(key.rsplit(".", 1)[-1], "application/octet-stream")
+
+
+def is_blob_key(value: Optional[str]) -> bool:
+    return bool(value) and KEY_PATTERN.match(value) is not None
+
+
+def media_url(key: str) -> str:
+    return f"{settings.MEDIA_URL_PREFIX}/{key}"
+
+
+class BlobStorage(ABC):
+    """
+    Storage interface for immutable, content-addressed blobs.
+    """
+
+    @abstractmethod
+    def put(self, key: str, data: bytes, content_type: str) -> None:
+        """
+        Store `data` under `key`. Writing an existing key is a no-op, since
+        the key determines the content.
+        """
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        :return: The blob's bytes, or None if there is no such key.
+        """
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        """
+        :return: True if a blob is stored under `key`.
+        """
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """
+        Remove the blob if it exists.
+        """
+
+    def local_path(self, key: str) -> Optional[str]:
+        """
+        Filesystem path of the blob if the backend is local, so it can be
+        served with sendfile instead of being read into memory.
+        """
+        return None
+
+
+class LocalBlobStorage(BlobStorage):
+    """
+    Blobs as files under `root`, sharded by the first two key characters so
+    no directory grows too large. Writes go to a temp file that is renamed
+    into place, so readers never see a partial blob.
+    """
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    def put(self, key: str, data: bytes, content_type: str) -> None:
+        path = self._path(key)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def delete(self, key: str) -> None:
+        try:
+            os.unlink(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def local_path(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        return path if os.path.exists(path) else None
+
+
+class S3BlobStorage(BlobStorage):
+    """
+    Blobs in an S3-compatible bucket (AWS S3, MinIO, R2, ...). boto3 is
+    only imported when this backend is configured.
+    """
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None):
+        import boto3
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self._client = boto3.client("s3", endpoint_url=endpoint_url or None)
+
+    def _object_key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def put(self, key: str, data: bytes, content_type: str) -> None:
+        if self.exists(key):
+            return
+        self._client.put_object(
+            Bucket=self.bucket,
+            Key=self._object_key(key),
+            Body=data,
+            ContentType=content_type,
+            CacheControl="public, max-age=31536000, immutable",
+        )
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            response = self._client.get_object(Bucket=self.bucket, Key=self._object_key(key))
+        except self._client.exceptions.NoSuchKey:
+            return None
+        return response["Body"].read()
+
+    def exists(self, key: str) -> bool:
+        try:
+            self._client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+            return True
+        except self._client.exceptions.ClientError:
+            return False
+
+    def delete(self, key: str) -> None:
+        self._client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+
+
+def create_storage(url: str) -> BlobStorage:
+    """
+    Build the backend named by a storage URL: a filesystem path (or
+    file:// URL), or s3://bucket/prefix.
+    """
+    parsed = urlparse(url)
+    if parsed.scheme == "s3":
+        logger.info("Using S3 blob storage (bucket %s)", parsed.netloc)
+        return S3BlobStorage(parsed.netloc, parsed.path, settings.S3_ENDPOINT_URL)
+    root = parsed.netloc + parsed.path if parsed.scheme == "file" else url
+    logger.info("Using local blob storage at %s", os.path.abspath(root))
+    return LocalBlobStorage(root)
+
+
+_storages: Dict[str, BlobStorage] = {}
+
+
+def get_storage(url: Optional[str] = None) -> BlobStorage:
+    """
+    Return the shared backend for `url`, by default BLOB_STORAGE_URL (profile
+    pictures). Chat archives use ARCHIVE_STORAGE_URL.
+    """
+    url = url or settings.BLOB_STORAGE_URL
+    if url not in _storages:
+        _storages[url] = create_storage(url)
+    return _storages[url]
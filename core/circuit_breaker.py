@@ -0,0 +1,108 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+from core.config import settings, logger
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Stops calling a failing dependency for a while instead of waiting on
+    every request for it to time out.
+
+    After `failure_threshold` consecutive failures the breaker opens and
+    allow() returns False for `reset_timeout` seconds. After that one trial
+    call is let through (half-open); its outcome closes or re-opens the breaker.
+    A trial that reports no outcome within `reset_timeout` (e.g. its task was
+    cancelled) is replaced by a new one, so the breaker never stays half-open.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_started_at = 0.0
+        self._state = CLOSED
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self._reset_timeout:
+                return HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN and now - self._opened_at >= self._reset_timeout:
+                # Let exactly one trial call through
+                self._state = HALF_OPEN
+                self._trial_started_at = now
+                return True
+            if self._state == HALF_OPEN and now - self._trial_started_at >= self._reset_timeout:
+                # The trial never reported back; let another one through
+                self._trial_started_at = now
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state != CLOSED:
+                logger.info("Circuit %s closed", self.name)
+            self._state = CLOSED
+            self._failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self._failure_threshold:
+                if self._state != OPEN:
+                    logger.warning("Circuit %s opened after %d failures", self.name, self._failures)
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+
+    def release_trial(self) -> None:
+        """
+        Report that an allowed call ended without showing whether the
+        dependency works (e.g. it was cancelled, or failed for an unrelated
+        reason). A pending trial is given up so the next call can try again.
+        """
+        with self._lock:
+            if self._state == HALF_OPEN:
+                # _opened_at is already past the reset timeout, so allow() starts a new trial
+                self._state = OPEN
+
+    @contextmanager
+    def guard(self, is_failure: Callable[[BaseException], bool] = lambda exc: True):
+        """
+        Record the outcome of one call that allow() let through: success if
+        the block completes, failure if it raises an exception `is_failure`
+        accepts. Any other exception, and cancellation or a generator being
+        closed mid-block, releases the trial instead.
+        """
+        try:
+            yield
+        except Exception as e:
+            if is_failure(e):
+                self.record_failure()
+            else:
+                self.release_trial()
+            raise
+        except BaseException:
+            self.release_trial()
+            raise
+        else:
+            self.record_success()
+
+
+llm_breaker = CircuitBreaker("llm", settings.LLM_BREAKER_FAILURES, settings.LLM_BREAKER_RESET_TIMEOUT)
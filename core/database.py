@@ -1,25 +1,86 @@
-from sqlalchemy import create_engine
+import logging
+from contextvars import ContextVar
+from typing import Optional
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import sessionmaker, declarative_base
-from core.config import settings, logger
+from core.config import settings
+from core.metrics import install_db_metrics
+from core.replicas import ReplicaRouter, create_writer_tracker
 from contextlib import contextmanager
 
-# Initialize the database connection
-engine = create_engine(settings.database_url, echo=True)
+logger = logging.getLogger(__name__)
+
+# Initialize the database connection. SQL echo goes through the logging
+# queue and is enabled with DB_ECHO (see core.config.configure_logging).
+# pool_pre_ping replaces connections dropped during a DB blip instead of failing requests.
+engine = create_engine(settings.database_url, pool_pre_ping=True)
+install_db_metrics(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# Read-only work can go to streaming replicas (DATABASE_REPLICA_URLS); see
+# get_read_db. Without replicas every read session uses the primary.
+replica_engines = []
+for replica_url in settings.DATABASE_REPLICA_URLS:
+    replica_engine = create_engine(replica_url, pool_pre_ping=True)
+    install_db_metrics(replica_engine)
+    replica_engines.append(replica_engine)
+replicas = ReplicaRouter(
+    engine,
+    replica_engines,
+    max_lag=settings.REPLICA_MAX_LAG,
+    lag_check_interval=settings.REPLICA_LAG_CHECK_INTERVAL,
+    sticky_window=settings.READ_YOUR_WRITES_WINDOW,
+    retry_after=settings.REPLICA_RETRY_AFTER,
+    writers=create_writer_tracker(settings.READ_YOUR_WRITES_BACKEND_URL) if replica_engines else None,
+)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# The authenticated user of the current request, set by AuthMiddleware. A
+# commit that wrote pins them to the primary for READ_YOUR_WRITES_WINDOW.
+request_user_id: ContextVar[Optional[int]] = ContextVar("request_user_id", default=None)
+
+@event.listens_for(SessionLocal, "after_flush")
+def _mark_flush_write(session, flush_context):
+    session.info["wrote"] = True
+
+@event.listens_for(SessionLocal, "do_orm_execute")
+def _mark_statement_write(orm_execute_state):
+    # Bulk INSERT/UPDATE/DELETE statements run through Session.execute bypass the flush
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info["wrote"] = True
+
+@event.listens_for(SessionLocal, "after_commit")
+def _note_committed_write(session):
+    if session.info.pop("wrote", False):
+        replicas.note_write(request_user_id.get())
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _discard_write(session):
+    session.info.pop("wrote", None)
+
+@event.listens_for(ReadSessionLocal, "before_flush")
+def _reject_flush(session, flush_context, instances):
+    raise RuntimeError("Read sessions are read-only; write through get_db instead")
+
+@event.listens_for(ReadSessionLocal, "do_orm_execute")
+def _reject_write_statement(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        raise RuntimeError("Read sessions are read-only; write through get_db instead")
+
 def get_db():
     """
     Dependency generator that yields a SQLAlchemy SessionLocal instance.
     Be sure to close the session after the request is finished.
     """
-    logger.info("Opening new database session")
+    logger.debug("Opening new database session")
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
-        logger.info("Database session closed")
+        logger.debug("Database session closed")
 
 @contextmanager
 def get_db_context():
@@ -29,13 +90,91 @@ def get_db_context():
     This context manager yields a session that should be used within a
     with-statement block to ensure proper opening and closing.
     """
-    logger.info("Opening new database session (context manager)")
+    logger.debug("Opening new database session (context manager)")
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
-        logger.info("Database session closed (context manager)")
+        logger.debug("Database session closed (context manager)")
+
+@contextmanager
+def get_read_db_context():
+    """
+    A session for read-only work, bound to a replica (see ReplicaRouter for
+    how it is chosen) or to the primary. A replica that refuses the
+    connection is taken out of rotation and the session falls back to the
+    primary, so a replica outage never fails the request.
+
+    Reads from a replica may be up to REPLICA_MAX_LAG seconds old, except
+    for the request's own user right after they wrote.
+    """
+    bind = replicas.engine_for(request_user_id.get())
+    db = ReadSessionLocal(bind=bind)
+    if bind is not engine:
+        try:
+            # Check out the connection now, while falling back is still possible
+            db.connection()
+        except OperationalError as e:
+            logger.warning("Replica unavailable, reading from the primary: %s", e)
+            replicas.mark_failed(bind)
+            db.close()
+            db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+def get_read_db():
+    """
+    Dependency generator that yields a read-only session (see get_read_db_context).
+    """
+    with get_read_db_context() as db:
+        yield db
+
+@contextmanager
+def unit_of_work(db):
+    """
+    Run a block of writes as a single transaction on an existing session.
+
+    Objects are not expired on commit, so primary keys and server defaults
+    fetched via INSERT ... RETURNING during flush stay usable without the
+    extra refresh SELECT per object. Rolls back if the block raises.
+    """
+    expire_on_commit = db.expire_on_commit
+    db.expire_on_commit = False
+    try:
+        yield db
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.expire_on_commit = expire_on_commit
+
+def ping_db() -> bool:
+    """
+    Run a trivial query on a pooled connection. Used to warm the pool at
+    startup and by the readiness probe.
+
+    Never raises: if the database is briefly unreachable at startup the
+    worker still starts and connects on first use, instead of crash-looping.
+    """
+    try:
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+        return True
+    except Exception as e:
+        logger.warning("Database not reachable: %s", e)
+        return False
+
+def pool_saturation() -> float:
+    """
+    Fraction of the pool's connections (including overflow) currently checked out.
+    """
+    pool = engine.pool
+    capacity = pool.size() + max(getattr(pool, "_max_overflow", 0), 0)
+    return pool.checkedout() / capacity if capacity else 0.0
 
 def init_db():
     """
@@ -45,10 +184,14 @@ def init_db():
     registered with the Base metadata and then creates all tables
     according to the metadata.
 
-    This should be called during application startup.
+    Run it from the migration command (python migrate.py), not from worker
+    startup, so workers don't each run DDL against the database.
     """
     logger.info("Initializing database")
     # Import models to register them on the Base metadata
     from models import user, oauth, chat  # Add additional model imports if necessary
+    with engine.begin() as conn:
+        # Trigram operator class used by the users.location index
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
     Base.metadata.create_all(bind=engine)
     logger.info("Database initialized")
@@ -0,0 +1,62 @@
+import asyncio
+import time
+from typing import Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from core.circuit_breaker import OPEN, llm_breaker
+from core.config import settings
+from core.database import ping_db, pool_saturation
+
+
+class ReadinessProbe:
+    """
+    Readiness check with a short result cache.
+
+    Concurrent and repeated probes within READINESS_CACHE_TTL share one
+    result, so probe traffic never adds DB load proportional to how often
+    the load balancer polls.
+    """
+
+    def __init__(self, ttl: float):
+        self.draining = False
+        self._ttl = ttl
+        self._result: Optional[Tuple[bool, dict]] = None
+        self._checked_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def _cached(self) -> Optional[Tuple[bool, dict]]:
+        if self._result is not None and time.monotonic() - self._checked_at < self._ttl:
+            return self._result
+        return None
+
+    async def check(self) -> Tuple[bool, dict]:
+        if self.draining:
+            return False, {"draining": True}
+        cached = self._cached()
+        if cached:
+            return cached
+        async with self._lock:
+            cached = self._cached()
+            if cached:
+                return cached
+            self._result = await self._run_checks()
+            self._checked_at = time.monotonic()
+            return self._result
+
+    async def _run_checks(self) -> Tuple[bool, dict]:
+        saturation = pool_saturation()
+        pool_ok = saturation < settings.READINESS_POOL_SATURATION
+        # A saturated pool would make the ping wait for a connection, so skip it
+        db_ok = await run_in_threadpool(ping_db) if pool_ok else False
+        llm_state = llm_breaker.state
+        checks = {
+            "database": db_ok,
+            "pool_saturation": round(saturation, 3),
+            "pool_ok": pool_ok,
+            "llm_circuit": llm_state,
+        }
+        return db_ok and pool_ok and llm_state != OPEN, checks
+
+
+readiness_probe = ReadinessProbe(settings.READINESS_CACHE_TTL)
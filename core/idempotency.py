@@ -0,0 +1,351 @@
+import asyncio
+import base64
+import hashlib
+import json
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+from fastapi import HTTPException, Request, Response, status
+from starlette.concurrency import run_in_threadpool
+from core.config import settings, logger
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+MAX_TRACKED_KEYS = 100_000
+BACKEND_TIMEOUT = 1.0  # Seconds; a hung shared backend must not hold requests
+POLL_INTERVAL = 0.1  # Seconds between checks on a request running in another worker
+
+_FAILED = object()
+
+
+class IdempotencyEntry:
+    """
+    The stored outcome of one idempotent request.
+
+    While the request is running, duplicates await `future`; once it
+    completes the future holds the response (or the exception) until the
+    entry expires.
+    """
+
+    def __init__(self, fingerprint: str, ttl: float):
+        self.fingerprint = fingerprint
+        self.expires_at = time.monotonic() + ttl
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    async def wait(self) -> Any:
+        # Shield so a disconnecting duplicate cannot cancel the shared future
+        return await asyncio.shield(self.future)
+
+    def complete(self, result: Any) -> None:
+        if not self.future.done():
+            self.future.set_result(result)
+
+
+class IdempotencyStore:
+    """
+    In-memory, per-worker map of Idempotency-Key to request outcome.
+    Entries expire after `ttl` seconds and the oldest are evicted once
+    `max_keys` is reached.
+    """
+
+    def __init__(self, ttl: float, max_keys: int = MAX_TRACKED_KEYS):
+        self._entries: "OrderedDict[str, IdempotencyEntry]" = OrderedDict()
+        self._ttl = ttl
+        self._max_keys = max_keys
+
+    def begin(self, key: str, fingerprint: str, ttl: Optional[float] = None) -> Tuple[IdempotencyEntry, bool]:
+        """
+        Look up `key`, creating a new in-flight entry if there is none.
+
+        :param key: Idempotency key, already scoped to the user.
+        :param fingerprint: Hash of the request the key was sent with.
+        :param ttl: Lifetime of a new entry in seconds; defaults to the store's.
+        :return: (entry, True if the caller owns the entry and must run the request).
+        """
+        entry = self._entries.get(key)
+        if entry is not None and entry.expired:
+            del self._entries[key]
+            entry = None
+        if entry is not None:
+            if entry.fingerprint != fingerprint:
+                raise _key_reused()
+            return entry, False
+
+        entry = IdempotencyEntry(fingerprint, ttl or self._ttl)
+        self._entries[key] = entry
+        while len(self._entries) > self._max_keys:
+            self._entries.popitem(last=False)
+        return entry, True
+
+    def fail(self, key: str, entry: IdempotencyEntry, exc: BaseException) -> None:
+        """
+        Propagate a failure to waiting duplicates and forget the key so the
+        client can retry the request.
+        """
+        if self._entries.get(key) is entry:
+            del self._entries[key]
+        if not entry.future.done():
+            entry.future.set_exception(exc)
+            # Mark the exception as retrieved in case no duplicate is waiting
+            entry.future.exception()
+
+
+class SharedIdempotencyBackend(ABC):
+    """
+    Records Idempotency-Keys across workers, so a retry that reaches another
+    worker does not run the request again. Results are stored serialized;
+    the per-worker IdempotencyStore still coalesces duplicates in front of it.
+    """
+
+    @abstractmethod
+    def claim(self, key: str, fingerprint: str, owner: str, ttl: float) -> Optional[Tuple[str, Optional[str]]]:
+        """
+        Claim `key` for a new run unless it is already recorded.
+
+        :param key: Idempotency key, already scoped to the user.
+        :param fingerprint: Hash of the request the key was sent with.
+        :param owner: Token identifying this run, checked by complete() and release().
+        :param ttl: Seconds the claim is held if the run never completes (e.g. its worker dies).
+        :return: None if the caller now owns the key, else the recorded
+            (fingerprint, serialized result, or None while still running).
+        """
+
+    @abstractmethod
+    def complete(self, key: str, owner: str, result: str, ttl: float) -> None:
+        """
+        Store the serialized `result` of the run owning `key` for `ttl` seconds.
+        """
+
+    @abstractmethod
+    def release(self, key: str, owner: str) -> None:
+        """
+        Forget `key` if `owner` still holds it, so the request can be retried.
+        """
+
+
+class RedisIdempotencyBackend(SharedIdempotencyBackend):
+    """
+    One hash per key holding the fingerprint, the owner token and, once
+    done, the result. Claims are a single SET-if-absent script; complete
+    and release only act while the caller's owner token is still stored.
+
+    A Redis failure is logged and the request runs with only the per-worker
+    check, rather than failing.
+    """
+
+    _CLAIM_SCRIPT = """
+    if redis.call('EXISTS', KEYS[1]) == 1 then
+        return redis.call('HMGET', KEYS[1], 'fingerprint', 'result')
+    end
+    redis.call('HSET', KEYS[1], 'fingerprint', ARGV[1], 'owner', ARGV[2])
+    redis.call('PEXPIRE', KEYS[1], ARGV[3])
+    return false
+    """
+
+    _COMPLETE_SCRIPT = """
+    if redis.call('HGET', KEYS[1], 'owner') == ARGV[1] then
+        redis.call('HSET', KEYS[1], 'result', ARGV[2])
+        redis.call('PEXPIRE', KEYS[1], ARGV[3])
+    end
+    return 0
+    """
+
+    _RELEASE_SCRIPT = """
+    if redis.call('HGET', KEYS[1], 'owner') == ARGV[1] then
+        redis.call('DEL', KEYS[1])
+    end
+    return 0
+    """
+
+    def __init__(self, url: str, prefix: str = "idempotency:"):
+        import redis  # Imported here so single-worker deployments do not load it
+
+        self._client = redis.Redis.from_url(
+            url, socket_connect_timeout=BACKEND_TIMEOUT, socket_timeout=BACKEND_TIMEOUT
+        )
+        self._errors = redis.RedisError
+        self._prefix = prefix
+        self._claim = self._client.register_script(self._CLAIM_SCRIPT)
+        self._complete = self._client.register_script(self._COMPLETE_SCRIPT)
+        self._release = self._client.register_script(self._RELEASE_SCRIPT)
+        self._failing = False
+
+    def _run(self, script, key: str, args: list):
+        try:
+            result = script(keys=[self._prefix + key], args=args)
+        except self._errors as e:
+            if not self._failing:
+                self._failing = True
+                logger.error("Shared idempotency backend failed, checking keys per worker until it recovers: %s", e)
+            return _FAILED
+        if self._failing:
+            self._failing = False
+            logger.warning("Shared idempotency backend recovered")
+        return result
+
+    def claim(self, key: str, fingerprint: str, owner: str, ttl: float) -> Optional[Tuple[str, Optional[str]]]:
+        record = self._run(self._claim, key, [fingerprint, owner, _milliseconds(ttl)])
+        if record is _FAILED or record is None:
+            return None
+        recorded_fingerprint, result = record
+        return recorded_fingerprint.decode(), None if result is None else result.decode()
+
+    def complete(self, key: str, owner: str, result: str, ttl: float) -> None:
+        self._run(self._complete, key, [owner, result, _milliseconds(ttl)])
+
+    def release(self, key: str, owner: str) -> None:
+        self._run(self._release, key, [owner])
+
+
+def _milliseconds(seconds: float) -> int:
+    return max(1, int(seconds * 1000))
+
+
+def create_shared_backend(url: str) -> Optional[SharedIdempotencyBackend]:
+    """
+    Build the configured shared backend. Without one (or if it cannot be
+    created) keys are only checked per worker, which is enough for a single worker.
+    """
+    if url:
+        try:
+            return RedisIdempotencyBackend(url)
+        except Exception as e:
+            logger.error("Shared idempotency backend unavailable, checking keys per worker: %s", e)
+    return None
+
+
+store = IdempotencyStore(settings.IDEMPOTENCY_TTL)
+shared_backend = create_shared_backend(settings.IDEMPOTENCY_BACKEND_URL)
+
+
+def _key_reused() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        detail="Idempotency-Key was already used with a different request",
+    )
+
+
+def encode_result(result: Any) -> str:
+    """
+    Serialize a handler result for the shared backend: a Response is kept
+    with its status, headers and body, anything else must be JSON.
+    """
+    if isinstance(result, Response):
+        return json.dumps({
+            "status": result.status_code,
+            "headers": [[name.decode("latin-1"), value.decode("latin-1")] for name, value in result.raw_headers],
+            "body": base64.b64encode(result.body).decode(),
+        })
+    return json.dumps({"value": result})
+
+
+def decode_result(data: str) -> Any:
+    record = json.loads(data)
+    if "value" in record:
+        return record["value"]
+    response = Response(content=base64.b64decode(record["body"]), status_code=record["status"])
+    response.raw_headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in record["headers"]]
+    return response
+
+
+def request_fingerprint(path: str, payload: dict) -> str:
+    body = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(f"{path}\n{body}".encode()).hexdigest()
+
+
+def get_idempotency_key(request: Request, user_id: int) -> Optional[str]:
+    """
+    Read the Idempotency-Key header and scope it to the user, so keys from
+    different users can never collide.
+    """
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    if not key:
+        return None
+    if len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Idempotency-Key is too long")
+    return f"{user_id}:{key}"
+
+
+async def run_idempotent(request: Request, user_id: int, payload: dict, handler, ttl: Optional[float] = None):
+    """
+    Run `handler` at most once per Idempotency-Key.
+
+    Without the header the handler simply runs. With it, a duplicate of an
+    in-flight request waits for the original to finish and a duplicate of a
+    completed request gets the stored response, so neither writes messages
+    or calls the LLM again. Responses must be detached from the DB session
+    (e.g. rendered Responses or Pydantic models) since they outlive it.
+
+    Checks that should not apply to replays, such as rate limits, belong in
+    `handler`. If it raises, the key is forgotten and the client can retry.
+    Pass a `ttl` shorter than IDEMPOTENCY_TTL when the stored response refers
+    to something that expires sooner.
+
+    With a shared backend configured the key is also claimed there, so a
+    duplicate reaching another worker waits for the original's stored
+    result instead of running the request again.
+    """
+    key = get_idempotency_key(request, user_id)
+    if key is None:
+        return await handler()
+
+    fingerprint = request_fingerprint(request.url.path, payload)
+    entry, owner = store.begin(key, fingerprint, ttl)
+    if not owner:
+        logger.info("Replaying idempotent request %s", key)
+        return await entry.wait()
+
+    try:
+        result = await _run_shared(key, fingerprint, handler, ttl or settings.IDEMPOTENCY_TTL)
+    except BaseException as e:
+        store.fail(key, entry, e)
+        raise
+    entry.complete(result)
+    return result
+
+
+async def _run_shared(key: str, fingerprint: str, handler, ttl: float):
+    """
+    Run `handler` once across workers: claim `key` in the shared backend,
+    or wait for the worker holding it and return its stored result. A run
+    that raises releases the key, and a waiting duplicate then claims it.
+    """
+    if shared_backend is None:
+        return await handler()
+
+    run_id = uuid.uuid4().hex
+    deadline = time.monotonic() + settings.IDEMPOTENCY_PENDING_TTL
+    while True:
+        record = await run_in_threadpool(
+            shared_backend.claim, key, fingerprint, run_id, settings.IDEMPOTENCY_PENDING_TTL
+        )
+        if record is None:
+            break
+        recorded_fingerprint, result = record
+        if recorded_fingerprint != fingerprint:
+            raise _key_reused()
+        if result is not None:
+            logger.info("Replaying idempotent request %s from another worker", key)
+            return decode_result(result)
+        if time.monotonic() >= deadline:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="A request with this Idempotency-Key is still in progress",
+            )
+        await asyncio.sleep(POLL_INTERVAL)
+
+    try:
+        result = await handler()
+    except BaseException:
+        # Not awaited, so a cancelled request still releases its key
+        asyncio.get_running_loop().run_in_executor(None, shared_backend.release, key, run_id)
+        raise
+    await run_in_threadpool(shared_backend.complete, key, run_id, encode_result(result), ttl)
+    return result
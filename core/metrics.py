@@ -0,0 +1,303 @@
+import asyncio
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from core.config import settings, logger
+
+# Default buckets in seconds, from sub-millisecond DB work up to slow LLM calls
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class _HistogramChild:
+    """
+    One labelled series. Buckets are stored non-cumulatively and summed at
+    export time, so an observation is one bisect and two additions under an
+    uncontended lock.
+    """
+    __slots__ = ("_bounds", "_counts", "_sum", "_lock")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self._bounds = bounds
+        self._counts = [0] * (len(bounds) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self._bounds, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def snapshot(self) -> Tuple[List[int], float]:
+        with self._lock:
+            return list(self._counts), self._sum
+
+
+class _NullChild:
+    __slots__ = ()
+
+    def observe(self, value: float) -> None:
+        pass
+
+
+_NULL_CHILD = _NullChild()
+
+
+class Histogram:
+    """
+    Minimal Prometheus-style histogram.
+
+    Children are created once per label combination and cached, so steady
+    state observations do not allocate. When metrics are disabled every
+    label lookup returns a shared no-op child.
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._bounds = tuple(sorted(buckets))
+        self._children: Dict[Tuple[str, ...], _HistogramChild] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def labels(self, *values: str):
+        if not settings.METRICS_ENABLED:
+            return _NULL_CHILD
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, _HistogramChild(self._bounds))
+        return child
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def state(self) -> Dict[Tuple[str, ...], Tuple[List[int], float]]:
+        """
+        This process's (non-cumulative bucket counts, sum) per label combination.
+        """
+        return {values: child.snapshot() for values, child in list(self._children.items())}
+
+    def expose(self, series: Optional[Dict[Tuple[str, ...], Tuple[List[int], float]]] = None) -> List[str]:
+        """
+        Render `series` (by default this process's state) as exposition lines.
+        """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for values, (counts, total) in (self.state() if series is None else series).items():
+            labels = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, values))
+            prefix = labels + "," if labels else ""
+            cumulative = 0
+            for bound, count in zip(self._bounds, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            cumulative += counts[-1]
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {cumulative}')
+            suffix = "{" + labels + "}" if labels else ""
+            lines.append(f"{self.name}_sum{suffix} {total}")
+            lines.append(f"{self.name}_count{suffix} {cumulative}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+REGISTRY: List[Histogram] = []
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template.", ("method", "route", "status")
+)
+DB_CHECKOUT_WAIT = Histogram("db_pool_checkout_wait_seconds", "Time spent waiting for a pooled DB connection.")
+DB_QUERY_TIME = Histogram("db_query_duration_seconds", "Time spent executing a single SQL statement.")
+LLM_TIME_TO_FIRST_TOKEN = Histogram(
+    "llm_time_to_first_token_seconds", "Time from request to first streamed token, per call site.", ("call_site",)
+)
+LLM_DURATION = Histogram("llm_call_duration_seconds", "Total LLM call duration, per call site.", ("call_site",))
+EMBEDDING_SEARCH_TIME = Histogram("embedding_search_duration_seconds", "Latency of embedding-ranked user search.")
+BCRYPT_TIME = Histogram("bcrypt_duration_seconds", "Time spent hashing or verifying a password.", ("operation",))
+
+
+# Unique per process, so a worker reusing a dead worker's pid does not overwrite its totals
+SNAPSHOT_FILE = f"metrics-{os.getpid()}-{uuid.uuid4().hex[:8]}.json"
+
+
+def render_metrics() -> str:
+    """
+    Render every registered metric in the Prometheus text exposition format.
+
+    With METRICS_MULTIPROC_DIR set, the series of every worker that has
+    written a snapshot there are added up, so counters do not depend on the
+    worker that answers the scrape. Snapshots of workers that have exited
+    stay in the sum, so totals never go backwards across worker restarts.
+    The answering worker's own numbers are current; the others' are up to
+    METRICS_FLUSH_INTERVAL seconds old.
+    """
+    directory = settings.METRICS_MULTIPROC_DIR
+    lines: List[str] = []
+    if directory:
+        write_snapshot(directory)
+        merged = _read_snapshots(directory)
+        for metric in REGISTRY:
+            lines.extend(metric.expose(merged[metric.name]))
+    else:
+        for metric in REGISTRY:
+            lines.extend(metric.expose())
+    return "\n".join(lines) + "\n"
+
+
+def write_snapshot(directory: str) -> None:
+    """
+    Write this process's metrics to its file in `directory`. The file is
+    replaced atomically, so readers never see a partial snapshot.
+    """
+    document = {
+        metric.name: [[list(values), counts, total] for values, (counts, total) in metric.state().items()]
+        for metric in REGISTRY
+    }
+    path = os.path.join(directory, SNAPSHOT_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(document, f, separators=(",", ":"))
+    os.replace(path + ".tmp", path)
+
+
+def _read_snapshots(directory: str) -> Dict[str, Dict[Tuple[str, ...], Tuple[List[int], float]]]:
+    merged: Dict[str, Dict[Tuple[str, ...], Tuple[List[int], float]]] = {metric.name: {} for metric in REGISTRY}
+    for path in glob.glob(os.path.join(directory, "metrics-*.json")):
+        try:
+            with open(path) as f:
+                document = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Skipping unreadable metrics snapshot %s: %s", path, e)
+            continue
+        for name, series in document.items():
+            target = merged.get(name)
+            if target is None:
+                continue
+            for values, counts, total in series:
+                key = tuple(values)
+                if key not in target:
+                    target[key] = (counts, total)
+                elif len(target[key][0]) == len(counts):
+                    merged_counts, merged_total = target[key]
+                    target[key] = ([a + b for a, b in zip(merged_counts, counts)], merged_total + total)
+    return merged
+
+
+def reset_snapshot_dir(directory: str) -> None:
+    """
+    Create `directory` if needed and remove snapshots left by an earlier
+    run, so a new deployment starts counting from zero.
+    """
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, "metrics-*.json*")):
+        os.remove(path)
+
+
+async def run_snapshot_writer() -> None:
+    """
+    Write this worker's snapshot every METRICS_FLUSH_INTERVAL seconds until
+    cancelled. Does nothing without METRICS_MULTIPROC_DIR.
+    """
+    if not settings.METRICS_ENABLED or not settings.METRICS_MULTIPROC_DIR:
+        return
+    while True:
+        await asyncio.sleep(settings.METRICS_FLUSH_INTERVAL)
+        try:
+            await run_in_threadpool(write_snapshot, settings.METRICS_MULTIPROC_DIR)
+        except OSError as e:
+            logger.error("Writing metrics snapshot failed: %s", e)
+
+
+def flush_snapshot() -> None:
+    """
+    Write this worker's final snapshot on shutdown, so its numbers stay in
+    the totals after it exits.
+    """
+    if settings.METRICS_ENABLED and settings.METRICS_MULTIPROC_DIR:
+        try:
+            write_snapshot(settings.METRICS_MULTIPROC_DIR)
+        except OSError as e:
+            logger.error("Writing metrics snapshot failed: %s", e)
+
+
+def install_db_metrics(engine) -> None:
+    """
+    Record pool checkout wait and per-statement query time for an engine.
+    Does nothing when metrics are disabled.
+    """
+    if not settings.METRICS_ENABLED:
+        return
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._metrics_query_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, "_metrics_query_start", None)
+        if start is not None:
+            DB_QUERY_TIME.observe(time.perf_counter() - start)
+
+    # The pool has no "before checkout" event, so time the checkout call itself
+    pool = engine.pool
+    connect = pool.connect
+
+    def timed_connect():
+        start = time.perf_counter()
+        try:
+            return connect()
+        finally:
+            DB_CHECKOUT_WAIT.observe(time.perf_counter() - start)
+
+    pool.connect = timed_connect
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware recording request latency by route template (not
+    raw path, so label cardinality stays bounded). Streaming responses are
+    timed until their last body chunk is sent.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            REQUEST_LATENCY.labels(scope["method"], path, _status_class(status_code)).observe(
+                time.perf_counter() - start
+            )
+
+
+def _status_class(status_code: int) -> str:
+    return _STATUS_CLASSES.get(status_code // 100, "5xx")
+
+
+_STATUS_CLASSES = {1: "1xx", 2: "2xx", 3: "3xx", 4: "4xx", 5: "5xx"}
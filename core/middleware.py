@@ -1,10 +1,14 @@
+import logging
 from fastapi import Request, Response
+from starlette.concurrency import run_in_threadpool
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.responses import JSONResponse
-from core.config import EXCLUDED_ROUTES, logger
+from core.config import EXCLUDED_ROUTES
 from core.security import decode_access_token
 from models.user import User
-from core.database import SessionLocal
+from core.database import SessionLocal, engine, get_read_db_context, replicas, request_user_id
+
+logger = logging.getLogger(__name__)
 
 class AuthMiddleware(BaseHTTPMiddleware):
     """
@@ -23,9 +27,9 @@ class AuthMiddleware(BaseHTTPMiddleware):
                 token = parts[1]
                 token_payload = decode_access_token(token)
                 if token_payload and "sub" in token_payload:
-                    db_session = SessionLocal()
                     try:
-                        user = db_session.query(User).filter(User.email == token_payload["sub"]).first()
+                        # Up to two queries and a read-your-writes lookup; keep them off the event loop
+                        user = await run_in_threadpool(self._load_user, token_payload["sub"], token)
                         if user:
                             if user.active_token != token:
                                 logger.warning("Active token mismatch. Session expired.")
@@ -34,15 +38,14 @@ class AuthMiddleware(BaseHTTPMiddleware):
                                     content={"detail": "Session expired or invalid token."}
                                 )
                             request.state.user = user
-                            logger.info(f"Authenticated user: {user.email}")
+                            request_user_id.set(user.id)
+                            logger.debug("Authenticated user: %s", user.email)
                         else:
                             logger.warning("User not found for token payload")
                             request.state.user = None
                     except Exception as e:
-                        logger.error(f"Error retrieving user: {e}")
+                        logger.error("Error retrieving user: %s", e)
                         request.state.user = None
-                    finally:
-                        db_session.close()
                 else:
                     logger.warning("Token payload invalid or missing 'sub' claim")
                     request.state.user = None
@@ -54,3 +57,21 @@ class AuthMiddleware(BaseHTTPMiddleware):
 
         response = await call_next(request)
         return response
+
+    @staticmethod
+    def _load_user(email: str, token: str):
+        """
+        Look the user up on a replica. A replica may not have seen a login
+        yet, so a missing user or a token mismatch is rechecked on the
+        primary, as is any user who wrote recently (e.g. just logged out).
+        """
+        with get_read_db_context() as db_session:
+            user = db_session.query(User).filter(User.email == email).first()
+            from_replica = db_session.get_bind() is not engine
+        if from_replica and (user is None or user.active_token != token or replicas.is_sticky(user.id)):
+            db_session = SessionLocal()
+            try:
+                user = db_session.query(User).filter(User.email == email).first()
+            finally:
+                db_session.close()
+        return user
@@ -0,0 +1,223 @@
+import asyncio
+import time
+from typing import Dict, Optional, Sequence, Set, Tuple
+
+import jwt
+
+from core.config import settings, logger
+
+_client = None
+
+
+def http_client():
+    """
+    Return the worker's shared httpx client for OAuth provider calls.
+
+    Reusing one client keeps TLS connections to the providers alive between
+    logins. httpx is imported on first use so it is not loaded at startup.
+    """
+    global _client
+    if _client is None:
+        import httpx
+        _client = httpx.AsyncClient(timeout=settings.OAUTH_HTTP_TIMEOUT)
+    return _client
+
+
+def set_http_client(client) -> None:
+    """
+    Replace the shared client, e.g. with one bound to a stub provider's
+    ASGI app in benchmarks (see benchmarks/oauth_stub.py).
+    """
+    global _client
+    _client = client
+    metadata_cache.clear()
+
+
+async def aclose() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+class MetadataCache:
+    """
+    TTL cache for provider JSON documents (OpenID discovery, JWKS).
+
+    A document is served from memory for OAUTH_METADATA_TTL seconds. Within
+    OAUTH_METADATA_REFRESH_AHEAD of expiry it is still served, and a
+    background task fetches a fresh copy, so a login never waits on
+    the provider once the cache is warm. Concurrent misses for one URL
+    share a single fetch. If a refresh fails, the expired copy is kept and
+    served rather than failing logins while the provider is unreachable,
+    and the provider is retried at most every OAUTH_JWKS_MIN_REFRESH_INTERVAL.
+    """
+
+    def __init__(self, ttl: float, refresh_ahead: float, min_refresh_interval: float):
+        self._ttl = ttl
+        self._refresh_ahead = min(refresh_ahead, ttl)
+        self._min_refresh_interval = min_refresh_interval
+        self._entries: Dict[str, Tuple[dict, float]] = {}  # url -> (document, fetched_at)
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._refreshing: Set[str] = set()
+        self._retry_at: Dict[str, float] = {}  # url -> earliest retry after a failed refresh
+        self._tasks: Set[asyncio.Task] = set()
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._locks.clear()
+        self._retry_at.clear()
+
+    async def get(self, url: str, force: bool = False) -> dict:
+        """
+        Return the document at `url`.
+
+        :param force: Refetch even if the cached copy has not expired, unless
+                      it is younger than OAUTH_JWKS_MIN_REFRESH_INTERVAL.
+                      Used when a token names a key the cached JWKS lacks.
+        """
+        entry = self._entries.get(url)
+        if entry is not None and not force:
+            age = time.monotonic() - entry[1]
+            if age < self._ttl:
+                if age >= self._ttl - self._refresh_ahead:
+                    self._refresh_in_background(url)
+                return entry[0]
+        return await self._fetch(url, force)
+
+    async def _fetch(self, url: str, force: bool = False) -> dict:
+        requested_at = time.monotonic()
+        lock = self._locks.setdefault(url, asyncio.Lock())
+        async with lock:
+            entry = self._entries.get(url)
+            if entry is not None:
+                # Another coroutine fetched it while we waited for the lock
+                if entry[1] >= requested_at:
+                    return entry[0]
+                age = time.monotonic() - entry[1]
+                if force and age < self._min_refresh_interval:
+                    return entry[0]
+                if not force and age < self._ttl - self._refresh_ahead:
+                    return entry[0]
+                if time.monotonic() < self._retry_at.get(url, 0.0):
+                    return entry[0]
+            try:
+                response = await http_client().get(url)
+                response.raise_for_status()
+                document = response.json()
+            except Exception as e:
+                if entry is None:
+                    raise
+                logger.warning("Refreshing %s failed, serving the cached copy: %s", url, e)
+                self._retry_at[url] = time.monotonic() + self._min_refresh_interval
+                return entry[0]
+            self._entries[url] = (document, time.monotonic())
+            self._retry_at.pop(url, None)
+            logger.debug("Fetched provider metadata %s", url)
+            return document
+
+    def _refresh_in_background(self, url: str) -> None:
+        if url in self._refreshing:
+            return
+        self._refreshing.add(url)
+
+        async def refresh():
+            try:
+                await self._fetch(url)
+            except Exception as e:
+                logger.warning("Background refresh of %s failed: %s", url, e)
+            finally:
+                self._refreshing.discard(url)
+
+        task = asyncio.create_task(refresh())
+        # Keep a reference so the task is not garbage collected mid-flight
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+
+metadata_cache = MetadataCache(
+    settings.OAUTH_METADATA_TTL,
+    settings.OAUTH_METADATA_REFRESH_AHEAD,
+    settings.OAUTH_JWKS_MIN_REFRESH_INTERVAL,
+)
+
+# Parsed signing keys per JWKS URL, rebuilt only when the cached document changes
+_keysets: Dict[str, Tuple[dict, Dict[str, jwt.PyJWK]]] = {}
+
+
+def _parse_jwks(jwks_uri: str, document: dict) -> Dict[str, jwt.PyJWK]:
+    cached = _keysets.get(jwks_uri)
+    if cached is not None and cached[0] is document:
+        return cached[1]
+    keys = {}
+    for data in document.get("keys", []):
+        if data.get("use", "sig") != "sig" or "kid" not in data:
+            continue
+        try:
+            keys[data["kid"]] = jwt.PyJWK(data)
+        except jwt.PyJWKError as e:
+            logger.warning("Skipping unusable key %s from %s: %s", data.get("kid"), jwks_uri, e)
+    _keysets[jwks_uri] = (document, keys)
+    return keys
+
+
+async def signing_key(jwks_uri: str, kid: Optional[str]) -> jwt.PyJWK:
+    """
+    Return the provider key with id `kid`. If it is not in the cached
+    JWKS, the provider has probably rotated its keys, so refetch once.
+    """
+    keys = _parse_jwks(jwks_uri, await metadata_cache.get(jwks_uri))
+    if kid not in keys:
+        keys = _parse_jwks(jwks_uri, await metadata_cache.get(jwks_uri, force=True))
+    if kid not in keys:
+        raise jwt.InvalidTokenError(f"Unknown signing key {kid!r}")
+    return keys[kid]
+
+
+async def verify_id_token(
+    id_token: str,
+    discovery_url: str,
+    audience: str,
+    issuers: Sequence[str] = (),
+    nonce: Optional[str] = None,
+) -> dict:
+    """
+    Verify an OpenID Connect ID token locally against the provider's JWKS.
+
+    :param id_token: The compact JWT returned by the token endpoint.
+    :param discovery_url: The provider's .well-known/openid-configuration URL.
+    :param audience: Our client id at the provider.
+    :param issuers: Accepted issuers besides the one in the discovery document.
+    :param nonce: Expected nonce claim, if one was sent with the authorization request.
+    :return: The verified claims.
+    :raises jwt.InvalidTokenError: If the token is malformed, expired or not signed by the provider.
+    """
+    metadata = await metadata_cache.get(discovery_url)
+    header = jwt.get_unverified_header(id_token)
+    key = await signing_key(metadata["jwks_uri"], header.get("kid"))
+    claims = jwt.decode(
+        id_token,
+        key,
+        algorithms=[key.algorithm_name],
+        audience=audience,
+        issuer=[metadata["issuer"], *issuers],
+        leeway=60,  # Allow for clock skew between us and the provider
+    )
+    if nonce is not None and claims.get("nonce") != nonce:
+        raise jwt.InvalidTokenError("Nonce mismatch")
+    return claims
+
+
+async def warm(discovery_urls: Sequence[str]) -> None:
+    """
+    Fetch discovery documents and their JWKS ahead of the first login.
+    Failures are only logged; the cache fills on demand instead.
+    """
+    async def warm_one(url):
+        metadata = await metadata_cache.get(url)
+        await metadata_cache.get(metadata["jwks_uri"])
+
+    results = await asyncio.gather(*(warm_one(url) for url in discovery_urls), return_exceptions=True)
+    for url, result in zip(discovery_urls, results):
+        if isinstance(result, Exception):
+            logger.warning("Could not prefetch OAuth metadata from %s: %s", url, result)
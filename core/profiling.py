@@ -0,0 +1,203 @@
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional, Tuple
+
+from core.config import settings, logger
+
+PROFILE_HEADER = b"x-profile"
+PROFILE_ID_HEADER = b"x-profile-id"
+
+Frame = Tuple[str, str, int]  # (filename, function, first line)
+
+# Leaf frames of threads that are parked, not working; samples ending here are dropped
+_IDLE_LEAVES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+    ("handlers.py", "dequeue"),  # logging QueueListener
+}
+
+
+@dataclass
+class Profile:
+    id: str
+    method: str
+    path: str
+    started_at: float
+    duration: float = 0.0
+    interval: float = 0.0
+    samples: Counter = field(default_factory=Counter)
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "started_at": self.started_at,
+            "duration": self.duration,
+            "samples": sum(self.samples.values()),
+        }
+
+    def to_collapsed(self) -> str:
+        """
+        Render as collapsed stacks ("root;child;leaf count" per line), the
+        input format of flamegraph.pl and most flamegraph viewers.
+        """
+        lines = []
+        for stack, count in self.samples.most_common():
+            lines.append(";".join(_frame_name(frame) for frame in stack) + f" {count}")
+        return "\n".join(lines) + "\n"
+
+    def to_speedscope(self) -> dict:
+        """
+        Render in the speedscope file format (https://www.speedscope.app).
+        """
+        frame_index: Dict[Frame, int] = {}
+        frames = []
+        samples = []
+        weights = []
+        for stack, count in self.samples.items():
+            indexes = []
+            for frame in stack:
+                if frame not in frame_index:
+                    frame_index[frame] = len(frames)
+                    frames.append({"name": frame[1], "file": frame[0], "line": frame[2]})
+                indexes.append(frame_index[frame])
+            samples.append(indexes)
+            weights.append(count * self.interval)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": f"{self.method} {self.path}",
+            "exporter": "commongrounds",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": f"{self.method} {self.path}",
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": self.duration,
+                "samples": samples,
+                "weights": weights,
+            }],
+        }
+
+
+def _frame_name(frame: Frame) -> str:
+    if frame[0] == "<thread>":
+        return frame[1]
+    return f"{frame[1]} ({os.path.basename(frame[0])}:{frame[2]})"
+
+
+class _Sampler:
+    """
+    Samples the stacks of every thread in the worker at a fixed interval.
+
+    The event loop thread runs other requests concurrently and sync work
+    runs in threadpool threads, so the profile covers the whole worker
+    while the request is in flight; each stack is rooted at its thread name.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        own_ident = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                code = frame.f_code
+                if (os.path.basename(code.co_filename), code.co_name) in _IDLE_LEAVES:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_filename, code.co_name, code.co_firstlineno))
+                    frame = frame.f_back
+                stack.append(("<thread>", names.get(ident, str(ident)), 0))
+                stack.reverse()
+                self.samples[tuple(stack)] += 1
+
+
+# Completed profiles, newest last; bounded so memory use is fixed
+profiles: Deque[Profile] = deque(maxlen=settings.PROFILING_BUFFER_SIZE)
+
+# Only one request is profiled at a time so sampling overhead cannot compound
+_active = threading.Lock()
+
+
+def get_profile(profile_id: str) -> Optional[Profile]:
+    for profile in profiles:
+        if profile.id == profile_id:
+            return profile
+    return None
+
+
+def is_admin(user) -> bool:
+    return bool(user) and user.email in settings.ADMIN_EMAILS
+
+
+class ProfilingMiddleware:
+    """
+    Pure ASGI middleware that profiles selected requests.
+
+    A request is profiled if an admin sends the X-Profile header, or at
+    random with probability PROFILING_SAMPLE_RATE. It must sit inside
+    AuthMiddleware so the authenticated user is known. The middleware is
+    only installed when PROFILING_ENABLED is set, so there is no overhead
+    otherwise.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def _wants_profile(self, scope) -> bool:
+        user = scope.get("state", {}).get("user")
+        if is_admin(user) and any(name == PROFILE_HEADER for name, _ in scope["headers"]):
+            return True
+        return settings.PROFILING_SAMPLE_RATE > 0 and random.random() < settings.PROFILING_SAMPLE_RATE
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._wants_profile(scope) or not _active.acquire(blocking=False):
+            await self.app(scope, receive, send)
+            return
+
+        profile = Profile(id=uuid.uuid4().hex, method=scope["method"], path=scope["path"], started_at=time.time())
+        sampler = _Sampler(settings.PROFILING_INTERVAL)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(PROFILE_ID_HEADER, profile.id.encode())]
+            await send(message)
+
+        start = time.perf_counter()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            sampler.stop()
+            _active.release()
+            profile.duration = time.perf_counter() - start
+            profile.interval = sampler.interval
+            profile.samples = sampler.samples
+            profiles.append(profile)
+            logger.info("Profiled %s %s in %.3fs (id %s)", profile.method, profile.path, profile.duration, profile.id)
@@ -0,0 +1,362 @@
+import asyncio
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Callable, Tuple
+
+from fastapi import HTTPException, Request, status
+from starlette.concurrency import run_in_threadpool
+from core.config import settings, logger
+
+MAX_TRACKED_KEYS = 100_000
+STREAM_SLOT_TTL = 3600  # Safety net so a crashed worker cannot leak stream slots forever
+BACKEND_TIMEOUT = 1.0  # Seconds; a hung shared backend must not hold requests
+
+_FAILED = object()
+
+
+class RateLimitBackend(ABC):
+    """
+    Storage interface for token buckets and concurrency counters.
+
+    Every operation is O(1) and never touches the database. The in-memory
+    backend is per worker; use a shared backend when running several workers.
+    """
+
+    @abstractmethod
+    def take(self, key: str, rate: float, capacity: int, cost: float = 1.0) -> Tuple[bool, float]:
+        """
+        Try to take `cost` tokens from the bucket stored under `key`.
+
+        :param key: Bucket identifier.
+        :param rate: Refill rate in tokens per second.
+        :param capacity: Maximum number of tokens (burst size).
+        :param cost: Number of tokens to take.
+        :return: (allowed, seconds until enough tokens are available).
+        """
+
+    @abstractmethod
+    def refund(self, key: str, capacity: int, cost: float = 1.0) -> None:
+        """
+        Return `cost` tokens taken with take(), up to `capacity`.
+        """
+
+    @abstractmethod
+    def incr_slot(self, key: str, limit: int) -> bool:
+        """
+        Increment the counter under `key` unless it already reached `limit`.
+
+        :return: True if a slot was acquired, False otherwise.
+        """
+
+    @abstractmethod
+    def decr_slot(self, key: str) -> None:
+        """
+        Release a slot previously acquired with incr_slot.
+        """
+
+
+class InMemoryRateLimitBackend(RateLimitBackend):
+    """
+    Process-local backend. Idle buckets are evicted in LRU order once
+    MAX_TRACKED_KEYS is reached so memory stays bounded.
+    """
+
+    def __init__(self, max_keys: int = MAX_TRACKED_KEYS):
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._slots = {}
+        self._max_keys = max_keys
+        self._lock = threading.Lock()
+
+    def take(self, key: str, rate: float, capacity: int, cost: float = 1.0) -> Tuple[bool, float]:
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (float(capacity), now))
+            tokens = min(float(capacity), tokens + (now - last) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            if len(self._buckets) > self._max_keys:
+                self._buckets.popitem(last=False)
+        if allowed:
+            return True, 0.0
+        return False, (cost - tokens) / rate
+
+    def refund(self, key: str, capacity: int, cost: float = 1.0) -> None:
+        with self._lock:
+            if key in self._buckets:
+                tokens, last = self._buckets[key]
+                self._buckets[key] = (min(float(capacity), tokens + cost), last)
+
+    def incr_slot(self, key: str, limit: int) -> bool:
+        with self._lock:
+            current = self._slots.get(key, 0)
+            if current >= limit:
+                return False
+            self._slots[key] = current + 1
+            return True
+
+    def decr_slot(self, key: str) -> None:
+        with self._lock:
+            current = self._slots.get(key, 0) - 1
+            if current > 0:
+                self._slots[key] = current
+            else:
+                self._slots.pop(key, None)
+
+
+class RedisRateLimitBackend(RateLimitBackend):
+    """
+    Shared backend for multi-worker deployments. Each operation is a single
+    round-trip running a small Lua script, so the check stays atomic across workers.
+
+    Redis connects lazily, so an outage shows up on the first call rather
+    than at startup. While Redis is failing, operations go to a per-worker
+    in-memory backend instead of failing the request.
+    """
+
+    _TAKE_SCRIPT = """
+    local capacity = tonumber(ARGV[2])
+    local rate = tonumber(ARGV[1])
+    local cost = tonumber(ARGV[3])
+    local t = redis.call('TIME')
+    local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + (now - ts) * rate)
+    local allowed = 0
+    if tokens >= cost then
+        tokens = tokens - cost
+        allowed = 1
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+    return {allowed, tostring(tokens)}
+    """
+
+    _REFUND_SCRIPT = """
+    local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens'))
+    if tokens then
+        redis.call('HSET', KEYS[1], 'tokens', math.min(tonumber(ARGV[1]), tokens + tonumber(ARGV[2])))
+    end
+    return 0
+    """
+
+    _INCR_SCRIPT = """
+    local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+    if current >= tonumber(ARGV[1]) then
+        return 0
+    end
+    redis.call('INCR', KEYS[1])
+    redis.call('EXPIRE', KEYS[1], tonumber(ARGV[2]))
+    return 1
+    """
+
+    _DECR_SCRIPT = """
+    if redis.call('DECR', KEYS[1]) <= 0 then
+        redis.call('DEL', KEYS[1])
+    end
+    return 0
+    """
+
+    def __init__(self, url: str, prefix: str = "ratelimit:"):
+        import redis  # Imported here so the in-memory backend does not load it
+
+        self._client = redis.Redis.from_url(
+            url, socket_connect_timeout=BACKEND_TIMEOUT, socket_timeout=BACKEND_TIMEOUT
+        )
+        self._errors = redis.RedisError
+        self._prefix = prefix
+        self._take = self._client.register_script(self._TAKE_SCRIPT)
+        self._refund = self._client.register_script(self._REFUND_SCRIPT)
+        self._incr = self._client.register_script(self._INCR_SCRIPT)
+        self._decr = self._client.register_script(self._DECR_SCRIPT)
+        self._fallback = InMemoryRateLimitBackend()
+        self._failing = False
+
+    def _run(self, script, key: str, args: list):
+        """
+        Run `script` on `key`, returning _FAILED if Redis cannot be reached.
+        Only the transitions are logged, not every failed call.
+        """
+        try:
+            result = script(keys=[self._prefix + key], args=args)
+        except self._errors as e:
+            if not self._failing:
+                self._failing = True
+                logger.error("Shared rate limit backend failed, limiting per worker until it recovers: %s", e)
+            return _FAILED
+        if self._failing:
+            self._failing = False
+            logger.warning("Shared rate limit backend recovered")
+        return result
+
+    def take(self, key: str, rate: float, capacity: int, cost: float = 1.0) -> Tuple[bool, float]:
+        result = self._run(self._take, key, [rate, capacity, cost])
+        if result is _FAILED:
+            return self._fallback.take(key, rate, capacity, cost)
+        allowed, tokens = result
+        if allowed:
+            return True, 0.0
+        return False, (cost - float(tokens)) / rate
+
+    def refund(self, key: str, capacity: int, cost: float = 1.0) -> None:
+        if self._run(self._refund, key, [capacity, cost]) is _FAILED:
+            self._fallback.refund(key, capacity, cost)
+
+    def incr_slot(self, key: str, limit: int) -> bool:
+        result = self._run(self._incr, key, [limit, STREAM_SLOT_TTL])
+        if result is _FAILED:
+            return self._fallback.incr_slot(key, limit)
+        return bool(result)
+
+    def decr_slot(self, key: str) -> None:
+        # Decrement and delete in one script, so an incr_slot in between is never erased
+        if self._run(self._decr, key, []) is _FAILED:
+            self._fallback.decr_slot(key)
+
+
+def create_backend(url: str) -> RateLimitBackend:
+    """
+    Build the configured backend, falling back to in-memory if the shared one
+    cannot be created (e.g. redis is not installed or the URL is invalid).
+    """
+    if url:
+        try:
+            return RedisRateLimitBackend(url)
+        except Exception as e:
+            logger.error("Shared rate limit backend unavailable, using in-memory: %s", e)
+    return InMemoryRateLimitBackend()
+
+
+class AdmissionQueue:
+    """
+    Bounds the number of LLM calls running in this worker.
+
+    Up to `max_active` callers run at once and up to `max_waiting` more wait
+    for a slot. Anything beyond that is rejected immediately with a 429, and
+    waiters that do not get a slot within `timeout` seconds are rejected too.
+    """
+
+    def __init__(self, max_active: int, max_waiting: int, timeout: float):
+        self._semaphore = asyncio.Semaphore(max_active)
+        self._max_waiting = max_waiting
+        self._timeout = timeout
+        self._waiting = 0
+
+    @property
+    def waiting(self) -> int:
+        return self._waiting
+
+    async def acquire(self) -> None:
+        if not self._semaphore.locked():
+            await self._semaphore.acquire()
+            return
+        if self._waiting >= self._max_waiting:
+            raise _too_many_requests("Server is busy, please retry shortly", self._timeout)
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self._timeout)
+        except asyncio.TimeoutError:
+            raise _too_many_requests("Server is busy, please retry shortly", self._timeout)
+        finally:
+            self._waiting -= 1
+
+    def release(self) -> None:
+        self._semaphore.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+
+def _too_many_requests(detail: str, retry_after: float) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail=detail,
+        headers={"Retry-After": str(max(1, int(retry_after + 0.999)))},
+    )
+
+
+backend = create_backend(settings.RATE_LIMIT_BACKEND_URL)
+llm_queue = AdmissionQueue(settings.LLM_MAX_CONCURRENT, settings.LLM_MAX_QUEUED, settings.LLM_QUEUE_TIMEOUT)
+
+
+def check_llm_rate_limit(request: Request) -> None:
+    """
+    Enforce the per-user and global token buckets for endpoints that
+    trigger LLM calls. Routes call it from their idempotent handler, so a
+    replayed request is not charged. Raises a 429 with Retry-After when
+    either bucket is empty. A request rejected by the global bucket gets its
+    user token back, so server load does not use up the user's quota.
+    """
+    user = getattr(request.state, "user", None)
+    if not user:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
+
+    user_key = f"user:{user.id}"
+    allowed, retry_after = backend.take(user_key, settings.USER_LLM_RATE_PER_MIN / 60.0, settings.USER_LLM_BURST)
+    if not allowed:
+        logger.warning("User %s exceeded LLM rate limit", user.id)
+        raise _too_many_requests("Rate limit exceeded", retry_after)
+
+    allowed, retry_after = backend.take("global", settings.GLOBAL_LLM_RATE_PER_SEC, settings.GLOBAL_LLM_BURST)
+    if not allowed:
+        backend.refund(user_key, settings.USER_LLM_BURST)
+        logger.warning("Global LLM rate limit exceeded")
+        raise _too_many_requests("Server is busy, please retry shortly", retry_after)
+
+
+async def admit_stream(user_id: int) -> Callable[[], None]:
+    """
+    Reserve one of the user's concurrent stream slots and an LLM queue slot,
+    raising a 429 if either is unavailable.
+
+    The slots must outlive the route handler, so the caller gets back a
+    release callback that is safe to call more than once (e.g. from both the
+    stream generator's finally block and a response background task).
+    """
+    # The shared backend is a network round-trip, so keep it off the event loop
+    stream_key = f"streams:{user_id}"
+    loop = asyncio.get_running_loop()
+    if not await run_in_threadpool(backend.incr_slot, stream_key, settings.USER_MAX_STREAMS):
+        raise _too_many_requests("Too many concurrent streams", 1)
+    try:
+        await llm_queue.acquire()
+    except BaseException:
+        loop.run_in_executor(None, _decr_slot, stream_key, user_id)
+        raise
+
+    # Sync stream generators run in the threadpool, so hop back onto the loop to release
+    lock = threading.Lock()
+    released = False
+
+    def release_on_loop() -> None:
+        llm_queue.release()
+        loop.run_in_executor(None, _decr_slot, stream_key, user_id)
+
+    def release() -> None:
+        nonlocal released
+        with lock:
+            if released:
+                return
+            released = True
+        loop.call_soon_threadsafe(release_on_loop)
+
+    return release
+
+
+def _decr_slot(stream_key: str, user_id: int) -> None:
+    try:
+        backend.decr_slot(stream_key)
+    except Exception as e:
+        logger.error("Failed to release stream slot for user %s: %s", user_id, e)
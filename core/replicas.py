@@ -0,0 +1,248 @@
+import asyncio
+import itertools
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+MAX_TRACKED_WRITERS = 100_000
+# A lag reading older than this many check intervals (e.g. the refresher is
+# stuck behind a saturated threadpool) no longer counts as within max_lag
+STALE_AFTER_CHECKS = 3
+
+# Seconds the replica is behind the primary; 0 when it is streaming and has
+# replayed everything it received (an idle primary sends nothing, so the
+# replay timestamp ages without the replica being behind). NULL, i.e.
+# unusable, if no WAL receiver is streaming: a disconnected replica has also
+# replayed all it received, yet falls further behind every second. Without
+# pg_read_all_stats the receiver's status reads as NULL, and only the
+# presence of the receiver process is checked.
+PG_REPLICA_LAG = text(
+    "SELECT CASE"
+    " WHEN NOT pg_is_in_recovery() THEN 0"
+    " WHEN NOT EXISTS (SELECT 1 FROM pg_stat_wal_receiver"
+    "  WHERE status = 'streaming' OR status IS NULL) THEN NULL"
+    " WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0"
+    " ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+
+class WriterTracker(ABC):
+    """
+    Remembers which users committed a write recently, so their reads go to
+    the primary. The in-memory tracker is per worker; use a shared one when
+    running several workers, or a user's next request may land on a worker
+    that does not know they wrote.
+    """
+
+    @abstractmethod
+    def note_write(self, user_id: int, window: float) -> None:
+        """
+        Remember `user_id` as a writer for the next `window` seconds.
+        """
+
+    @abstractmethod
+    def wrote_recently(self, user_id: int) -> bool:
+        """
+        :return: True if `user_id` wrote within their last window.
+        """
+
+
+class InMemoryWriterTracker(WriterTracker):
+    """
+    Process-local tracker. Oldest entries are evicted once `max_writers` are
+    tracked; by then their windows have long expired.
+    """
+
+    def __init__(self, max_writers: int = MAX_TRACKED_WRITERS):
+        self._writers: "OrderedDict[int, float]" = OrderedDict()
+        self._max_writers = max_writers
+        self._lock = threading.Lock()
+
+    def note_write(self, user_id: int, window: float) -> None:
+        with self._lock:
+            self._writers[user_id] = time.monotonic() + window
+            self._writers.move_to_end(user_id)
+            if len(self._writers) > self._max_writers:
+                self._writers.popitem(last=False)
+
+    def wrote_recently(self, user_id: int) -> bool:
+        until = self._writers.get(user_id)
+        return until is not None and until > time.monotonic()
+
+
+class RedisWriterTracker(WriterTracker):
+    """
+    Shared tracker for multi-worker deployments: one key per recent writer,
+    expiring with its window.
+    """
+
+    def __init__(self, url: str, prefix: str = "wrote:"):
+        import redis  # Imported here so the in-memory tracker does not load it
+
+        self._client = redis.Redis.from_url(url)
+        self._prefix = prefix
+
+    def note_write(self, user_id: int, window: float) -> None:
+        self._client.set(f"{self._prefix}{user_id}", 1, px=max(1, int(window * 1000)))
+
+    def wrote_recently(self, user_id: int) -> bool:
+        return bool(self._client.exists(f"{self._prefix}{user_id}"))
+
+
+def create_writer_tracker(url: str) -> WriterTracker:
+    """
+    Build the configured tracker, falling back to in-memory if the shared one is unavailable.
+    """
+    if url:
+        try:
+            return RedisWriterTracker(url)
+        except Exception as e:
+            logger.error("Shared read-your-writes tracker unavailable, using in-memory: %s", e)
+    return InMemoryWriterTracker()
+
+
+class _Replica:
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        self.lag: Optional[float] = None
+        self.checked_at = float("-inf")
+        self.down_until = 0.0
+
+
+class ReplicaRouter:
+    """
+    Chooses the engine for read-only sessions.
+
+    Reads go round-robin to replicas that are up and within `max_lag`
+    seconds of the primary, and to the primary when none is. A user who
+    committed a write in the last `sticky_window` seconds reads from the
+    primary, so they see their own writes. Recent writers are kept in
+    `writers`, which must be shared (RedisWriterTracker) for this to hold
+    across workers; replica lag and health are tracked per worker.
+
+    Lag is measured by run_lag_checks in the background, never on the
+    request path. Until its first reading a replica is not used.
+    """
+
+    def __init__(
+        self,
+        primary: Engine,
+        replicas: List[Engine],
+        max_lag: float = 5.0,
+        lag_check_interval: float = 2.0,
+        sticky_window: float = 10.0,
+        retry_after: float = 10.0,
+        writers: Optional[WriterTracker] = None,
+    ):
+        self.primary = primary
+        self._replicas = [_Replica(engine) for engine in replicas]
+        self._cycle = itertools.cycle(self._replicas)
+        self.max_lag = max_lag
+        self.lag_check_interval = lag_check_interval
+        self.sticky_window = sticky_window
+        self.retry_after = retry_after
+        self.writers = writers or InMemoryWriterTracker()
+
+    def note_write(self, user_id: Optional[int]) -> None:
+        """
+        Pin `user_id` to the primary for the next `sticky_window` seconds.
+        Runs after the commit, so a tracker failure is logged, not raised.
+        """
+        if user_id is None or not self._replicas:
+            return
+        try:
+            self.writers.note_write(user_id, self.sticky_window)
+        except Exception as e:
+            logger.error("Could not record write by user %s: %s", user_id, e)
+
+    def is_sticky(self, user_id: Optional[int]) -> bool:
+        """
+        True if `user_id` must read from the primary. If the tracker cannot
+        be asked, the answer is yes: a read on the primary is never stale.
+        """
+        if user_id is None or not self._replicas:
+            return False
+        try:
+            return self.writers.wrote_recently(user_id)
+        except Exception as e:
+            logger.warning("Read-your-writes tracker unavailable, reading from the primary: %s", e)
+            return True
+
+    def engine_for(self, user_id: Optional[int] = None) -> Engine:
+        """
+        The engine a read-only session for `user_id` should use.
+        """
+        if not self._replicas or self.is_sticky(user_id):
+            return self.primary
+        for _ in range(len(self._replicas)):
+            replica = next(self._cycle)
+            if self._usable(replica):
+                return replica.engine
+        return self.primary
+
+    def mark_failed(self, engine: Engine) -> None:
+        """
+        Stop routing to `engine` for `retry_after` seconds, e.g. after it
+        refused a connection.
+        """
+        for replica in self._replicas:
+            if replica.engine is engine:
+                replica.down_until = time.monotonic() + self.retry_after
+                logger.warning("Replica %s failed; using other replicas or the primary for %.0fs",
+                               engine.url.render_as_string(hide_password=True), self.retry_after)
+
+    def refresh_lag(self) -> None:
+        """
+        Measure every replica's lag once. A replica whose check fails is
+        marked failed; one already marked is skipped until `retry_after` passes.
+        """
+        for replica in self._replicas:
+            if replica.down_until > time.monotonic():
+                continue
+            try:
+                replica.lag = self._measure_lag(replica.engine)
+            except Exception as e:
+                replica.lag = None
+                self.mark_failed(replica.engine)
+                logger.debug("Replica lag check failed: %s", e)
+            replica.checked_at = time.monotonic()
+
+    async def run_lag_checks(self) -> None:
+        """
+        Refresh replica lag every `lag_check_interval` seconds until cancelled.
+        Returns at once when there are no replicas.
+        """
+        if not self._replicas:
+            return
+        while True:
+            await run_in_threadpool(self.refresh_lag)
+            await asyncio.sleep(self.lag_check_interval)
+
+    def _usable(self, replica: _Replica) -> bool:
+        now = time.monotonic()
+        if replica.down_until > now or now - replica.checked_at > STALE_AFTER_CHECKS * self.lag_check_interval:
+            return False
+        return replica.lag is not None and replica.lag <= self.max_lag
+
+    @staticmethod
+    def _measure_lag(engine: Engine) -> Optional[float]:
+        with engine.connect() as connection:
+            # Other backends (e.g. a SQLite copy in tests) have no replication
+            # to measure; connecting still checks the replica is up
+            if engine.dialect.name != "postgresql":
+                return 0.0
+            lag = connection.execute(PG_REPLICA_LAG).scalar()
+        return None if lag is None else float(lag)
+
+    def dispose(self) -> None:
+        for replica in self._replicas:
+            replica.engine.dispose()
@@ -0,0 +1,39 @@
+from typing import Any, Mapping, Optional
+
+from pydantic import TypeAdapter
+from starlette.requests import Request
+from starlette.responses import Response
+
+# For per-user API resources: clients may keep a copy but must revalidate it
+REVALIDATE = "private, no-cache"
+
+
+def render_model(adapter: TypeAdapter, obj: Any, status_code: int = 200, headers: Optional[Mapping[str, str]] = None) -> Response:
+    """
+    Validate `obj` against a precompiled adapter (reading ORM objects by
+    attribute) and render it to JSON bytes in a single pydantic-core pass.
+
+    Returning the resulting Response from a route skips FastAPI's
+    response_model re-validation and generic encoding; keep response_model
+    on the route for the OpenAPI schema.
+    """
+    body = adapter.dump_json(adapter.validate_python(obj, from_attributes=True))
+    return Response(content=body, status_code=status_code, headers=headers, media_type="application/json")
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """
+    Whether the request's If-None-Match names `etag` (or is "*"), i.e. the
+    client's copy is current and a 304 can be sent instead of the body.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    return any(tag.strip() in (etag, "*") for tag in if_none_match.split(","))
+
+
+def not_modified(headers: Mapping[str, str]) -> Response:
+    """
+    A 304 carrying the ETag and Cache-Control the full response would have had.
+    """
+    return Response(status_code=304, headers=headers)
@@ -1,8 +1,17 @@
+import logging
+import time
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
 import jwt
 from jwt.exceptions import ExpiredSignatureError, InvalidTokenError
-from core.config import settings, logger, pwd_context
+from core.config import settings, pwd_context
+from core.metrics import BCRYPT_TIME
+
+logger = logging.getLogger(__name__)
+
+# Stored instead of a hash for accounts that sign in through an OAuth
+# provider. It is not a valid hash, so no password ever verifies against it.
+UNUSABLE_PASSWORD = "!"
 
 def create_access_token(data: Dict[str, Any], expires_delta: Optional[timedelta] = None) -> str:
     """
@@ -20,7 +29,7 @@ def create_access_token(data: Dict[str, Any], expires_delta: Optional[timedelta]
         expire = datetime.utcnow() + timedelta(days=settings.jwt_expiry_days)
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, settings.secret_key, algorithm=settings.ALGORITHM)
-    logger.info("JWT token created")
+    logger.debug("JWT token created")
     return encoded_jwt
 
 def decode_access_token(token: str) -> Optional[Dict[str, Any]]:
@@ -32,12 +41,12 @@ def decode_access_token(token: str) -> Optional[Dict[str, Any]]:
     """
     try:
         payload = jwt.decode(token, settings.secret_key, algorithms=[settings.ALGORITHM])
-        logger.info("JWT token decoded successfully")
+        logger.debug("JWT token decoded successfully")
         return payload
     except ExpiredSignatureError as e:
-        logger.error(f"Token expired: {e}")
+        logger.warning("Token expired: %s", e)
     except InvalidTokenError as e:
-        logger.error(f"Invalid token: {e}")
+        logger.warning("Invalid token: %s", e)
     return None
 
 def get_password_hash(password: str) -> str:
@@ -47,8 +56,10 @@ def get_password_hash(password: str) -> str:
     :param password: Plain text password.
     :return: Hashed password.
     """
+    start = time.perf_counter()
     hashed = pwd_context.hash(password)
-    logger.info("Password hashed")
+    BCRYPT_TIME.labels("hash").observe(time.perf_counter() - start)
+    logger.debug("Password hashed")
     return hashed
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -59,9 +70,14 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     :param hashed_password: Hashed password.
     :return: True if the password matches, False otherwise.
     """
+    if hashed_password == UNUSABLE_PASSWORD:
+        logger.warning("Password login attempted for an OAuth-only account")
+        return False
+    start = time.perf_counter()
     is_valid = pwd_context.verify(plain_password, hashed_password)
+    BCRYPT_TIME.labels("verify").observe(time.perf_counter() - start)
     if is_valid:
-        logger.info("Password verification succeeded")
+        logger.debug("Password verification succeeded")
     else:
         logger.warning("Password verification failed")
     return is_valid
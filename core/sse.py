@@ -0,0 +1,217 @@
+import asyncio
+import json
+import re
+import time
+import uuid
+from dataclasses import dataclass
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+from starlette.concurrency import iterate_in_threadpool
+from core.config import settings, logger
+
+HEARTBEAT_FRAME = ": keepalive\n\n"
+
+_LINE_BREAK = re.compile(r"\r\n|\r|\n")
+
+
+@dataclass
+class StreamDone:
+    """
+    Yielded by a chat stream as its final item, once the assistant message is persisted.
+    """
+    message_id: Optional[int]
+
+
+def format_event(data: str, event: Optional[str] = None, event_id: Optional[str] = None) -> str:
+    """
+    Encode a single server-sent event.
+
+    Multi-line data is split into one `data:` field per line so that newlines
+    inside a chunk survive the round-trip instead of terminating the event.
+    """
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event is not None:
+        lines.append(f"event: {event}")
+    for line in _LINE_BREAK.split(data):
+        lines.append(f"data: {line}")
+    return "\n".join(lines) + "\n\n"
+
+
+def parse_last_event_id(value: Optional[str]) -> Optional[Tuple[str, int]]:
+    """
+    Split a Last-Event-ID header of the form "<stream_id>:<seq>".
+    """
+    if not value:
+        return None
+    stream_id, _, seq = value.rpartition(":")
+    if not stream_id or not seq.isdigit():
+        return None
+    return stream_id, int(seq)
+
+
+class StreamBuffer:
+    """
+    Buffers the encoded frames of one chat stream.
+
+    The producer appends frames as the LLM generates them; any number of
+    readers can follow the buffer from a given sequence number, which is
+    what lets a client reconnect with Last-Event-ID and pick up where it left off.
+    """
+
+    def __init__(self, stream_id: str, user_id: int):
+        self.stream_id = stream_id
+        self.user_id = user_id
+        self.frames: List[str] = []
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+
+    def append(self, data: str, event: Optional[str] = None) -> None:
+        event_id = f"{self.stream_id}:{len(self.frames) + 1}"
+        self.frames.append(format_event(data, event=event, event_id=event_id))
+        self._notify()
+
+    def finish(self) -> None:
+        self.finished_at = time.monotonic()
+        self._notify()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def follow(self, after: int = 0, heartbeat: float = settings.SSE_HEARTBEAT_INTERVAL) -> AsyncIterator[str]:
+        """
+        Yield every frame with a sequence number above `after`, then keep
+        tailing until the stream finishes. A comment frame is sent whenever
+        the stream is idle for `heartbeat` seconds to keep proxies from
+        closing the connection.
+        """
+        while True:
+            while after < len(self.frames):
+                after += 1
+                yield self.frames[after - 1]
+            if self.finished:
+                return
+            changed = self._changed
+            try:
+                await asyncio.wait_for(changed.wait(), timeout=heartbeat)
+            except asyncio.TimeoutError:
+                yield HEARTBEAT_FRAME
+
+
+# Buffers are per worker, so resuming only works against the worker that started the stream
+_streams: Dict[str, StreamBuffer] = {}
+
+
+def get_stream(stream_id: str) -> Optional[StreamBuffer]:
+    return _streams.get(stream_id)
+
+
+async def drain_streams(timeout: float) -> int:
+    """
+    Wait up to `timeout` seconds for every running stream to finish
+    producing, e.g. during graceful shutdown.
+
+    :return: The number of streams still running when the timeout expired.
+    """
+    tasks = [buf.task for buf in _streams.values() if buf.task and not buf.task.done()]
+    if not tasks:
+        return 0
+    _, pending = await asyncio.wait(tasks, timeout=timeout)
+    return len(pending)
+
+
+async def _coalesce(
+    source: Iterator[Union[str, StreamDone]],
+    buffer: StreamBuffer,
+    window: float,
+    max_chars: int,
+) -> None:
+    """
+    Drain `source` in the threadpool and append coalesced frames to `buffer`.
+
+    Chunks are merged until `max_chars` characters are pending or `window`
+    seconds have passed since the first pending chunk, whichever comes first.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    end = object()
+
+    async def read() -> None:
+        try:
+            async for item in iterate_in_threadpool(source):
+                await queue.put(item)
+        except Exception as e:
+            logger.error("Chat stream %s failed: %s", buffer.stream_id, e)
+            await queue.put(e)
+        finally:
+            await queue.put(end)
+
+    reader = asyncio.create_task(read())
+    pending: List[str] = []
+    pending_len = 0
+    deadline = None
+    try:
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout=timeout)
+            except asyncio.TimeoutError:
+                item = None
+
+            if isinstance(item, str):
+                # Empty deltas (e.g. a role-only first chunk) must not flush early
+                if item:
+                    pending.append(item)
+                    pending_len += len(item)
+                    if deadline is None:
+                        deadline = time.monotonic() + window
+                if pending_len < max_chars and (deadline is None or time.monotonic() < deadline):
+                    continue
+
+            if pending:
+                buffer.append("".join(pending))
+                pending, pending_len, deadline = [], 0, None
+
+            if isinstance(item, StreamDone):
+                buffer.append(json.dumps({"message_id": item.message_id}), event="done")
+            elif isinstance(item, Exception):
+                buffer.append(json.dumps({"detail": "Stream failed"}), event="error")
+            elif item is end:
+                break
+    finally:
+        await reader
+        buffer.finish()
+
+
+def start_stream(
+    user_id: int,
+    source: Iterator[Union[str, StreamDone]],
+    on_finish: Optional[Callable[[], None]] = None,
+) -> StreamBuffer:
+    """
+    Start producing a buffered SSE stream from a chat chunk iterator.
+
+    Production runs as its own task so the assistant reply is still fully
+    generated and persisted if the client disconnects, and so a reconnecting
+    client can resume from the buffer. The finished buffer is dropped
+    SSE_RESUME_TTL seconds later.
+    """
+    buffer = StreamBuffer(uuid.uuid4().hex, user_id)
+    _streams[buffer.stream_id] = buffer
+
+    async def produce() -> None:
+        try:
+            await _coalesce(source, buffer, settings.SSE_COALESCE_WINDOW, settings.SSE_COALESCE_MAX_CHARS)
+        finally:
+            asyncio.get_running_loop().call_later(settings.SSE_RESUME_TTL, _streams.pop, buffer.stream_id, None)
+            if on_finish:
+                on_finish()
+
+    buffer.task = asyncio.create_task(produce())
+    return buffer
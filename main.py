@@ -1,17 +1,69 @@
+import asyncio
+from contextlib import asynccontextmanager
+from anyio import to_thread
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
+from starlette.middleware.sessions import SessionMiddleware
+from starlette.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from core.config import settings
 from core.config import logger
 from core.middleware import AuthMiddleware
-from core.database import init_db
-from routes import auth, chat
+from core.metrics import MetricsMiddleware, flush_snapshot, render_metrics, run_snapshot_writer
+from core.profiling import ProfilingMiddleware
+from core.database import engine, ping_db, replicas
+from core.health import readiness_probe
+from core import oidc
+from core.sse import drain_streams
+from routes import admin, auth, chat, health, media, oauth
+from services.archive_service import run_archiver
+from services.oauth_service import load_providers
 
-init_db()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Startup and shutdown for each worker.
+
+    Schema creation is not done here; run `python migrate.py` once per
+    deploy instead. The DB warm-up runs in a thread so it does not block the
+    event loop. The OpenAI client is not built here: it is created, and
+    openai imported, on the first LLM call (see utils.chat.get_openai_client).
+    """
+    # Blocking chat turns run in the threadpool, so size it for concurrent LLM calls
+    to_thread.current_default_thread_limiter().total_tokens = settings.THREADPOOL_SIZE
+    await to_thread.run_sync(ping_db)
+    # Prefetch OAuth provider keys in the background; readiness does not wait for it
+    discovery_urls = [provider.discovery_url for provider in load_providers().values() if provider.discovery_url]
+    oidc_warmup = asyncio.create_task(oidc.warm(discovery_urls))
+    archiver = asyncio.create_task(run_archiver()) if settings.ARCHIVE_ENABLED else None
+    # Replica lag is measured here, off the request path
+    lag_checks = asyncio.create_task(replicas.run_lag_checks())
+    metrics_writer = asyncio.create_task(run_snapshot_writer())
+    logger.info("Worker ready")
+    yield
+    oidc_warmup.cancel()
+    if archiver:
+        archiver.cancel()
+    lag_checks.cancel()
+    # serve.py fails readiness as soon as SIGTERM arrives, while requests are
+    # still accepted; this covers servers started some other way. Then let
+    # in-flight chat streams finish generating and persisting their replies.
+    readiness_probe.draining = True
+    unfinished = await drain_streams(settings.SHUTDOWN_DRAIN_TIMEOUT)
+    if unfinished:
+        logger.warning("Shutting down with %d chat streams still running", unfinished)
+    await oidc.aclose()
+    engine.dispose()
+    replicas.dispose()
+    metrics_writer.cancel()
+    flush_snapshot()
 
 app = FastAPI(
     title="Commongrounds Backend",
     description="Backend for the Commongrounds MVP",
     version="0.1.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
 )
 
 # Setup CORS middleware (adjust origins as needed)
@@ -22,13 +74,37 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+if settings.PROFILING_ENABLED:
+    # Added before AuthMiddleware so it runs inside it and can see the user
+    app.add_middleware(ProfilingMiddleware)
 app.add_middleware(AuthMiddleware)
+oauth_providers = load_providers()
+if oauth_providers:
+    # Holds only the short-lived OAuth state and nonce. SameSite=None because
+    # Apple posts its callback cross-site (response_mode=form_post).
+    app.add_middleware(
+        SessionMiddleware, secret_key=settings.secret_key, max_age=600, same_site="none", https_only=True
+    )
+if settings.METRICS_ENABLED:
+    # Added last so it is outermost and times the whole request
+    app.add_middleware(MetricsMiddleware)
 
 # Routes
+app.include_router(health.router)
 app.include_router(auth.router, prefix=settings.prefix)
 app.include_router(chat.router, prefix=settings.prefix)
+app.include_router(media.router)
+if oauth_providers:
+    app.include_router(oauth.router)
+if settings.PROFILING_ENABLED:
+    app.include_router(admin.router, prefix=settings.prefix)
+
+if settings.METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    def metrics():
+        return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
 
-# Health check endpoint using HEAD method
+# Legacy health check endpoint using HEAD method; prefer /health/live and /health/ready
 @app.head("/")
 def health_check():
     return None
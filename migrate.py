@@ -0,0 +1,113 @@
+import base64
+import binascii
+
+from fastapi import HTTPException
+from sqlalchemy import select, text, update
+
+from core.config import logger
+from core.database import engine, get_db_context, init_db, unit_of_work
+from models.chat import CHAT_VERSION_FUNCTION, CHAT_VERSION_TRIGGER, Message
+from models.user import User
+from services.media_service import generate_thumbnails, store_profile_pic
+
+# Idempotent changes for databases created before the models declared them;
+# create_all only creates missing tables and never alters existing ones.
+UPGRADES = [
+    # Conflict target of the OAuth login upsert (utils/oauth.py)
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_oauth_provider_user ON oauth_accounts (provider, provider_user_id)",
+    # Hybrid user search prefilters (services/auth_service.py)
+    "CREATE INDEX IF NOT EXISTS ix_users_interests_gin ON users USING gin (interests)",
+    "CREATE INDEX IF NOT EXISTS ix_users_location_trgm ON users USING gin (lower(location) gin_trgm_ops)",
+    # Message search (services/chat_service.py); adding the generated column rewrites messages once
+    "CREATE INDEX IF NOT EXISTS ix_chats_user_id ON chats (user_id)",
+    "ALTER TABLE messages ADD COLUMN IF NOT EXISTS search_vector tsvector"
+    " GENERATED ALWAYS AS (to_tsvector('english', message)) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_messages_search_vector ON messages USING gin (search_vector) WITH (fastupdate = on)",
+    # Chat archival (services/archive_service.py)
+    "ALTER TABLE chats ADD COLUMN IF NOT EXISTS archive_key VARCHAR",
+    "ALTER TABLE chats ADD COLUMN IF NOT EXISTS archived_at TIMESTAMP WITH TIME ZONE",
+    "ALTER TABLE chats ADD COLUMN IF NOT EXISTS rehydrated_at TIMESTAMP WITH TIME ZONE",
+    "CREATE INDEX IF NOT EXISTS ix_messages_chat_id_created_at ON messages (chat_id, created_at)",
+    # Conditional GET versions (models/chat.py, models/user.py)
+    "ALTER TABLE chats ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1",
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS profile_version INTEGER NOT NULL DEFAULT 1",
+    CHAT_VERSION_FUNCTION,
+    "DROP TRIGGER IF EXISTS messages_bump_chat_version ON messages",
+    CHAT_VERSION_TRIGGER,
+]
+
+
+def upgrade():
+    with engine.begin() as conn:
+        for statement in UPGRADES:
+            conn.execute(text(statement))
+    logger.info("Applied %d schema upgrades", len(UPGRADES))
+
+
+def partition_messages():
+    """
+    Convert a plain messages table into the hash-partitioned one declared in
+    models/chat.py, copying every row, in one transaction. Writes to
+    messages block until it commits, so run it in a maintenance window on
+    large tables. Does nothing if messages is already partitioned.
+    """
+    with engine.begin() as conn:
+        kind = conn.execute(text("SELECT relkind FROM pg_class WHERE relname = 'messages'")).scalar()
+        if kind != "r":
+            return
+        # Move the old table and everything named after it out of the way
+        conn.execute(text("ALTER TABLE messages RENAME TO messages_unpartitioned"))
+        for (index,) in conn.execute(text("SELECT indexname FROM pg_indexes WHERE tablename = 'messages_unpartitioned'")).all():
+            conn.execute(text(f'ALTER INDEX "{index}" RENAME TO "{index}_unpartitioned"'))
+        conn.execute(text("ALTER SEQUENCE messages_id_seq RENAME TO messages_unpartitioned_id_seq"))
+
+        Message.__table__.create(conn)  # Creates the partitions too
+        copied = conn.execute(text(
+            "INSERT INTO messages (id, chat_id, sender, message, created_at)"
+            " SELECT id, chat_id, sender, message, created_at FROM messages_unpartitioned"
+        )).rowcount
+        conn.execute(text("SELECT setval('messages_id_seq', COALESCE((SELECT max(id) FROM messages), 0) + 1, false)"))
+        conn.execute(text("DROP TABLE messages_unpartitioned"))
+    logger.info("Partitioned messages, %d rows copied", copied)
+
+
+def migrate_profile_pics(batch_size: int = 100):
+    """
+    Move profile pictures stored inline as data URIs into blob storage,
+    leaving only the storage key on the user row. Images that cannot be
+    decoded or are not a supported type are dropped. Safe to rerun.
+    """
+    moved = dropped = 0
+    with get_db_context() as db:
+        while True:
+            rows = db.execute(
+                select(User.id, User.profile_pic).where(User.profile_pic.like("data:%")).limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            with unit_of_work(db):
+                for user_id, data_uri in rows:
+                    try:
+                        key = store_profile_pic(base64.b64decode(data_uri.split(",", 1)[1], validate=True))
+                    except (IndexError, binascii.Error, HTTPException) as e:
+                        logger.warning("Dropping unreadable profile picture of user %s: %s", user_id, e)
+                        key = None
+                        dropped += 1
+                    else:
+                        generate_thumbnails(key)
+                        moved += 1
+                    db.execute(
+                        update(User)
+                        .where(User.id == user_id)
+                        .values(profile_pic=key, profile_version=User.profile_version + 1)
+                    )
+    logger.info("Moved %d profile pictures to blob storage, dropped %d", moved, dropped)
+
+
+# Create the database schema. Run once per deploy, before starting workers:
+#   python migrate.py
+if __name__ == "__main__":
+    init_db()
+    upgrade()
+    partition_messages()
+    migrate_profile_pics()
@@ -1,10 +1,14 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey
+from sqlalchemy import Column, Computed, Index, Integer, String, Text, DateTime, ForeignKey, event, inspect, text
 from sqlalchemy.sql import func
-from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.dialects.postgresql import ARRAY, TSVECTOR
 from sqlalchemy.orm import relationship
-from core.database import Base, SessionLocal
+from core.config import settings
+from core.database import Base, get_read_db_context
 from models.user import User
 
+# Text search configuration of messages.search_vector; queries must use the same one
+SEARCH_CONFIG = "english"
+
 class Chat(Base):
     __tablename__ = "chats"
     
@@ -12,14 +16,25 @@ class Chat(Base):
     title = Column(String, nullable=False)
     
     # The single user who is having the chat (e.g., with an LLM assistant)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
     user = relationship("User", backref="chats")
     
     # Context: an array of user IDs (as strings or integers) representing additional users
     context = Column(ARRAY(String), nullable=True)
     
-    # One-to-many relationship with messages
-    messages = relationship("Message", back_populates="chat", cascade="all, delete-orphan")
+    # One-to-many relationship with messages. Ordered explicitly: rows of a
+    # rehydrated chat are not stored in insertion order.
+    messages = relationship("Message", back_populates="chat", cascade="all, delete-orphan", order_by="Message.id")
+
+    # Set while the chat's messages are in cold storage (services/archive_service.py)
+    archive_key = Column(String, nullable=True)
+    archived_at = Column(DateTime(timezone=True), nullable=True)
+    # Restored messages keep their old timestamps, so this keeps a reopened chat out of the archiver
+    rehydrated_at = Column(DateTime(timezone=True), nullable=True)
+
+    # Bumped whenever GET /chat/{id} would return something new: a message is
+    # added or the title or context changes. Drives the chat's ETag.
+    version = Column(Integer, nullable=False, default=1, server_default="1")
 
     @property
     def expanded_context(self):
@@ -28,23 +43,75 @@ class Chat(Base):
         """
         if not self.context:
             return []
-        session = SessionLocal()
-        try:
+        # Profiles of other users; a replica may serve them
+        with get_read_db_context() as session:
             # Assuming context stores user IDs as strings that can be converted to int
             user_ids = [int(uid) for uid in self.context]
             users = session.query(User).filter(User.id.in_(user_ids)).all()
-        finally:
-            session.close()
         return users
 
 class Message(Base):
     __tablename__ = "messages"
+    # Fetch created_at with INSERT ... RETURNING instead of a follow-up SELECT.
+    # search_vector is left unmapped so it is never loaded or returned by the ORM.
+    __mapper_args__ = {"eager_defaults": True, "exclude_properties": ["search_vector"]}
+    # Hash-partitioned by chat_id: a chat's messages live in one partition, so
+    # loading or archiving a chat touches one partition, and vacuum and index
+    # maintenance work on partitions a fraction of the table's size.
+    # fastupdate queues new entries in the GIN pending list, so inserting a
+    # reply does not pay for a full index update (see services/chat_service.search_messages)
+    __table_args__ = (
+        Index("ix_messages_search_vector", "search_vector", postgresql_using="gin", postgresql_with={"fastupdate": "on"}),
+        # Loading a chat's messages, and the archiver's last-activity check
+        Index("ix_messages_chat_id_created_at", "chat_id", "created_at"),
+        {"postgresql_partition_by": "HASH (chat_id)"},
+    )
     
-    id = Column(Integer, primary_key=True, index=True)
-    chat_id = Column(Integer, ForeignKey("chats.id"), nullable=False)
+    # The partition key has to be part of the primary key
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
+    chat_id = Column(Integer, ForeignKey("chats.id"), primary_key=True)
     chat = relationship("Chat", back_populates="messages")
     
     # Sender is a simple field: either "user" or "assistant"
     sender = Column(String, nullable=False)
     message = Column(Text, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Maintained by Postgres on insert; read through Message.__table__.c.search_vector
+    search_vector = Column(TSVECTOR, Computed(f"to_tsvector('{SEARCH_CONFIG}', message)", persisted=True))
+
+
+@event.listens_for(Chat, "before_update")
+def bump_chat_version(mapper, connection, target):
+    state = inspect(target)
+    if state.attrs.title.history.has_changes() or state.attrs.context.history.has_changes():
+        target.version = Chat.version + 1
+
+
+# Adding messages bumps their chats' versions in the database, once per
+# INSERT statement rather than with an extra UPDATE round-trip per message.
+# Covers ORM and Core INSERTs alike (import_chats, rehydration).
+CHAT_VERSION_FUNCTION = """
+CREATE OR REPLACE FUNCTION bump_chat_version() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE chats SET version = version + 1 WHERE id IN (SELECT chat_id FROM new_messages);
+    RETURN NULL;
+END
+$$
+"""
+CHAT_VERSION_TRIGGER = (
+    "CREATE TRIGGER messages_bump_chat_version AFTER INSERT ON messages"
+    " REFERENCING NEW TABLE AS new_messages FOR EACH STATEMENT EXECUTE FUNCTION bump_chat_version()"
+)
+
+
+@event.listens_for(Message.__table__, "after_create")
+def create_message_partitions(target, connection, **kw):
+    if connection.dialect.name != "postgresql":
+        return
+    for remainder in range(settings.MESSAGE_PARTITIONS):
+        connection.execute(text(
+            f"CREATE TABLE IF NOT EXISTS messages_p{remainder} PARTITION OF messages"
+            f" FOR VALUES WITH (MODULUS {settings.MESSAGE_PARTITIONS}, REMAINDER {remainder})"
+        ))
+    connection.execute(text(CHAT_VERSION_FUNCTION))
+    connection.execute(text(CHAT_VERSION_TRIGGER))
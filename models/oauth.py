@@ -1,10 +1,12 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, UniqueConstraint
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from core.database import Base
 
 class OAuth(Base):
     __tablename__ = "oauth_accounts"
+    # One link per provider identity; also the conflict target of the login upsert
+    __table_args__ = (UniqueConstraint("provider", "provider_user_id", name="uq_oauth_provider_user"),)
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -12,4 +14,4 @@ class OAuth(Base):
     provider_user_id = Column(String, nullable=False, index=True)
 
     # Relationship to the main User model
-    user = relationship("User", back_populates="oauth_accounts")
\ No newline at end of file
+    user = relationship("User", back_populates="oauth_accounts")
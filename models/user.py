@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, Float
+from sqlalchemy import Column, Integer, String, DateTime, Text, Float, Index, event, inspect, text
 from sqlalchemy.orm import relationship, validates
 from sqlalchemy.sql import func
 from sqlalchemy.dialects.postgresql import ARRAY
@@ -8,6 +8,9 @@ MAX_WORDS = 500
 
 VECTOR_DIM = 1536  # Example dimension for embedding vector
 
+# Fields returned by GET /auth/me; changing any of them bumps profile_version
+PROFILE_FIELDS = ("email", "username", "profile_pic", "location", "interests", "bio", "profession")
+
 def count_words(text: str) -> int:
     if not text:
         return 0
@@ -15,6 +18,12 @@ def count_words(text: str) -> int:
 
 class User(Base):
     __tablename__ = "users"
+    # Candidate prefilters for hybrid search (services/auth_service.py): interest
+    # overlap (&&) and fuzzy location matching on lower(location) via pg_trgm
+    __table_args__ = (
+        Index("ix_users_interests_gin", "interests", postgresql_using="gin"),
+        Index("ix_users_location_trgm", text("lower(location) gin_trgm_ops"), postgresql_using="gin"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     email = Column(String, unique=True, index=True, nullable=False)
@@ -23,7 +32,7 @@ class User(Base):
     
     # Profile fields
     username = Column(String, nullable=True)
-    profile_pic = Column(Text, nullable=True)
+    profile_pic = Column(String, nullable=True)  # Blob storage key (core/blob_storage.py) or an external URL
     location = Column(String, nullable=True)
     interests = Column(ARRAY(String), nullable=True)
     bio = Column(Text, nullable=True)  # User biography, max 500 words
@@ -31,6 +40,8 @@ class User(Base):
     bio_embedding = Column(ARRAY(Float), nullable=True)  # Embedding vector for bio
     profession_embedding = Column(ARRAY(Float), nullable=True)  # Embedding vector for profession
     oauth_accounts = relationship("OAuth", back_populates="user")
+    # Drives the ETag of GET /auth/me; the token columns do not affect it
+    profile_version = Column(Integer, nullable=False, default=1, server_default="1")
 
     @validates('bio')
     def validate_bio(self, key, value):
@@ -43,3 +54,11 @@ class User(Base):
         if value and count_words(value) > MAX_WORDS:
             raise ValueError(f"Profession exceeds maximum word limit of {MAX_WORDS}.")
         return value
+
+
+@event.listens_for(User, "before_update")
+def bump_profile_version(mapper, connection, target):
+    # Core UPDATE statements that touch PROFILE_FIELDS bump it explicitly
+    state = inspect(target)
+    if any(state.attrs[field].history.has_changes() for field in PROFILE_FIELDS):
+        target.profile_version = User.profile_version + 1
@@ -0,0 +1,49 @@
+from fastapi import APIRouter, HTTPException, Request, status
+from starlette.responses import JSONResponse, PlainTextResponse
+
+from core.profiling import get_profile, is_admin, profiles
+
+router = APIRouter(
+    prefix="/admin",
+    tags=["Admin"]
+)
+
+
+def _require_admin(request: Request) -> None:
+    current_user = request.state.user
+    if not current_user:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
+    if not is_admin(current_user):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+
+
+@router.get("/profiles")
+def list_profiles(request: Request):
+    """
+    List the captured request profiles, newest first.
+    """
+    _require_admin(request)
+    return [profile.summary() for profile in reversed(profiles)]
+
+
+@router.get("/profiles/{profile_id}")
+def download_profile(profile_id: str, request: Request, format: str = "speedscope"):
+    """
+    Download a captured profile as speedscope JSON (default) or collapsed
+    stacks (format=collapsed) for flamegraph tools.
+    """
+    _require_admin(request)
+    profile = get_profile(profile_id)
+    if not profile:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found or evicted")
+    if format == "collapsed":
+        return PlainTextResponse(
+            profile.to_collapsed(),
+            headers={"Content-Disposition": f'attachment; filename="{profile_id}.collapsed.txt"'},
+        )
+    if format != "speedscope":
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="format must be speedscope or collapsed")
+    return JSONResponse(
+        profile.to_speedscope(),
+        headers={"Content-Disposition": f'attachment; filename="{profile_id}.speedscope.json"'},
+    )
@@ -1,10 +1,14 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Request
+from fastapi import APIRouter, BackgroundTasks, Depends, File, HTTPException, status, Request, UploadFile
+from sqlalchemy import update
 from sqlalchemy.orm import Session
+from core.config import settings
 from pydantic import BaseModel, EmailStr
 from core.database import get_db
 from models.user import User
-from schemas.user import PasswordReset, UserCreate, UserResponse, TokenResponse, LoginCredentials
+from schemas.user import PasswordReset, UserCreate, UserResponse, TokenResponse, LoginCredentials, user_response_adapter
+from core.responses import REVALIDATE, etag_matches, not_modified, render_model
 from services.auth_service import create_user, generate_password_reset_token, reset_password
+from services.media_service import generate_thumbnails, store_profile_pic
 from core.security import verify_password, create_access_token
 
 router = APIRouter(
@@ -53,11 +57,45 @@ def read_current_user(request: Request):
     """
     Return the current authenticated user.
     Expects that the authentication middleware has stored the user in request.state.user.
+    Answers 304 when If-None-Match carries the current profile version, which
+    the middleware has already loaded, so no extra query or serialization is done.
     """
     current_user: User = request.state.user
     if not current_user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
-    return current_user
+    headers = {"ETag": f'"{current_user.id}-{current_user.profile_version}"', "Cache-Control": REVALIDATE}
+    if etag_matches(request, headers["ETag"]):
+        return not_modified(headers)
+    return render_model(user_response_adapter, current_user, headers=headers)
+
+@router.put("/me/profile-pic", response_model=UserResponse)
+def upload_profile_pic(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db),
+):
+    """
+    Upload a new profile picture for the current user.
+    The image goes to blob storage and only its key is kept on the user row;
+    thumbnails are generated after the response is sent.
+    """
+    current_user: User = request.state.user
+    if not current_user:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
+
+    # Read one byte past the limit so oversized uploads are rejected without reading them whole
+    key = store_profile_pic(file.file.read(settings.PROFILE_PIC_MAX_BYTES + 1))
+    db.execute(
+        update(User)
+        .where(User.id == current_user.id)
+        .values(profile_pic=key, profile_version=User.profile_version + 1)
+    )
+    db.commit()
+    background_tasks.add_task(generate_thumbnails, key)
+
+    current_user.profile_pic = key
+    return render_model(user_response_adapter, current_user)
 
 @router.post("/logout")
 def logout(request: Request, db: Session = Depends(get_db)):
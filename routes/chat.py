@@ -1,14 +1,21 @@
-from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Request, status
 from sqlalchemy.orm import Session
 from starlette.responses import JSONResponse
 from starlette.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from typing import List, Optional
 import json
 
-from core.database import get_db
+from core.config import settings
+from core.database import get_db, get_read_db
+from core.responses import REVALIDATE, etag_matches, not_modified, render_model
+from core.rate_limit import check_llm_rate_limit, llm_queue, admit_stream
+from core.idempotency import run_idempotent
+from core.sse import StreamBuffer, get_stream, parse_last_event_id, start_stream
 from models.chat import Chat
 from models.user import User
-from schemas.chat import ChatCreate, ChatResponse, MessageCreate, MessageResponse
-from services.chat_service import create_chat, get_chat, create_message, stream_message_response
+from schemas.chat import ChatCreate, ChatImport, ChatResponse, MessageCreate, MessageResponse, MessageSearchResponse, chat_response_adapter, message_response_adapter, message_search_response_adapter
+from services.chat_service import create_chat, get_chat, get_chat_etag, create_message, start_turn, stream_message_response, import_chats, search_messages
 
 router = APIRouter(
     prefix="/chat",
@@ -20,46 +27,168 @@ async def test_route():
     return JSONResponse({"message": "Chat router is working"})
 
 @router.post("/", response_model=ChatResponse)
-async def create_chat_route(chat_create: ChatCreate, request: Request, db: Session = Depends(get_db)):
+async def create_chat_route(chat_create: ChatCreate, request: Request):
     current_user = request.state.user
     if not current_user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
-    chat, llm_response = create_chat(db, current_user, chat_create.message)
-    return chat
+
+    # The chat pipeline opens its own short-lived sessions around the LLM call,
+    # so no pooled connection is held while the reply is generated. Replays of
+    # an idempotent request skip the handler, so they are not rate limited.
+    async def handler():
+        await run_in_threadpool(check_llm_rate_limit, request)
+        async with llm_queue.slot():
+            chat, llm_response = await run_in_threadpool(create_chat, current_user, chat_create.message)
+        return render_model(chat_response_adapter, chat)
+
+    return await run_idempotent(request, current_user.id, chat_create.model_dump(), handler)
+
+@router.post("/import")
+def import_chats_route(
+    request: Request,
+    chats: List[ChatImport] = Body(..., max_length=settings.CHAT_IMPORT_MAX_CHATS),
+    db: Session = Depends(get_db),
+):
+    current_user = request.state.user
+    if not current_user:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
+    if sum(len(chat.messages) for chat in chats) > settings.CHAT_IMPORT_MAX_MESSAGES:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"At most {settings.CHAT_IMPORT_MAX_MESSAGES} messages can be imported per request",
+        )
+    chat_ids = import_chats(db, current_user, [chat.model_dump() for chat in chats])
+    return {"chat_ids": chat_ids}
+
+# Declared before /{chat_id} so "search" is not parsed as a chat id
+@router.get("/search", response_model=MessageSearchResponse)
+def search_messages_route(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=256),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_read_db),
+):
+    """
+    Search the current user's messages. Pass the returned next_cursor as
+    `cursor` to fetch the next page.
+    """
+    current_user = request.state.user
+    if not current_user:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
+    try:
+        results, next_cursor = search_messages(db, current_user, q, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return render_model(message_search_response_adapter, {"results": results, "next_cursor": next_cursor})
 
 @router.get("/{chat_id}", response_model=ChatResponse)
-async def get_chat_route(chat_id: int, request: Request, db: Session = Depends(get_db)):
+async def get_chat_route(
+    chat_id: int,
+    request: Request,
+    db: Session = Depends(get_db),
+    read_db: Session = Depends(get_read_db),
+):
     current_user = request.state.user
     if not current_user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
-    chat = get_chat(db, chat_id, current_user)
-    return chat
+    # Polls for an unchanged chat are answered from the version lookup alone,
+    # on a replica; the primary session only connects if the chat is loaded
+    etag = await run_in_threadpool(get_chat_etag, read_db, chat_id, current_user)
+    # Return the read connection to its pool now rather than after the
+    # response, so loading the chat never holds two connections at once
+    read_db.close()
+    if etag is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Chat not found")
+    headers = {"ETag": etag, "Cache-Control": REVALIDATE}
+    if etag_matches(request, etag):
+        return not_modified(headers)
+    # The ETag is read first, so a chat that changes in between is sent with the
+    # older tag and refetched on the next poll rather than cached stale. Loaded
+    # from the primary and off the event loop: loading may set the title or
+    # read an archived chat back from cold storage.
+    chat = await run_in_threadpool(get_chat, db, chat_id, current_user)
+    return render_model(chat_response_adapter, chat, headers=headers)
 
 @router.post("/message", response_model=MessageResponse)
-async def create_message_route(message_create: MessageCreate, request: Request, db: Session = Depends(get_db)):
+async def create_message_route(message_create: MessageCreate, request: Request):
     current_user: User = request.state.user
     if not current_user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
-    chat = db.query(Chat).filter(Chat.id == message_create.chat_id, Chat.user_id == current_user.id).first()
-    if not chat:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Chat not found")
-    user_msg, assistant_msg = create_message(db, chat, message_create.message)
-    return assistant_msg
+
+    async def handler():
+        await run_in_threadpool(check_llm_rate_limit, request)
+        async with llm_queue.slot():
+            result = await run_in_threadpool(create_message, message_create.chat_id, current_user, message_create.message)
+        if not result:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Chat not found")
+        user_msg, assistant_msg = result
+        return render_model(message_response_adapter, assistant_msg)
+
+    return await run_idempotent(request, current_user.id, message_create.model_dump(), handler)
 
 
 @router.post("/message/stream")
-async def stream_message_route(message_create: MessageCreate, request: Request, db: Session = Depends(get_db)):
+async def stream_message_route(message_create: MessageCreate, request: Request):
     current_user: User = request.state.user
     if not current_user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
-    chat = db.query(Chat).filter(Chat.id == message_create.chat_id, Chat.user_id == current_user.id).first()
-    if not chat:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Chat not found")
 
-    def event_generator():
-        for chunk in stream_message_response(db, chat, message_create.message):
-            if chunk == "[DONE]":
-                break
-            yield f"data: {chunk}\n\n"
+    async def handler():
+        await run_in_threadpool(check_llm_rate_limit, request)
+        release = await admit_stream(current_user.id)
+        try:
+            chat = await run_in_threadpool(start_turn, message_create.chat_id, current_user, message_create.message)
+        except BaseException:
+            release()
+            raise
+        if not chat:
+            release()
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Chat not found")
+        stream = start_stream(current_user.id, stream_message_response(chat), on_finish=release)
+        return stream.stream_id
+
+    # A retried request with the same Idempotency-Key attaches to the stream already running.
+    # The key lives no longer than the stream's buffer (kept SSE_RESUME_TTL after it
+    # finishes), so it never resolves to a stream that is gone. Buffers are per worker:
+    # a retry reaching another worker gets a 410 rather than a second LLM turn.
+    stream_id = await run_idempotent(
+        request, current_user.id, message_create.model_dump(), handler, ttl=settings.SSE_RESUME_TTL
+    )
+    stream = get_stream(stream_id)
+    if not stream:
+        raise HTTPException(status_code=status.HTTP_410_GONE, detail="Stream expired")
+    return _sse_response(stream, after=_resume_after(request, stream_id))
+
+
+@router.get("/message/stream/{stream_id}")
+async def resume_stream_route(stream_id: str, request: Request):
+    """
+    Resume a stream started by POST /chat/message/stream.
+    Frames after the sequence number in the Last-Event-ID header are replayed
+    from the buffer, then the live stream is followed until it finishes.
+    """
+    current_user: User = request.state.user
+    if not current_user:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
+    stream = get_stream(stream_id)
+    if not stream or stream.user_id != current_user.id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Stream not found or expired")
+    return _sse_response(stream, after=_resume_after(request, stream_id))
+
+
+def _resume_after(request: Request, stream_id: str) -> int:
+    last_event = parse_last_event_id(request.headers.get("Last-Event-ID"))
+    return last_event[1] if last_event and last_event[0] == stream_id else 0
+
 
-    return StreamingResponse(event_generator(), media_type="text/event-stream")
+def _sse_response(stream: StreamBuffer, after: int) -> StreamingResponse:
+    return StreamingResponse(
+        stream.follow(after),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",  # Stop nginx from buffering the stream
+            "X-Stream-Id": stream.stream_id,
+        },
+    )
@@ -0,0 +1,32 @@
+from fastapi import APIRouter, status
+from starlette.responses import JSONResponse
+
+from core.health import readiness_probe
+
+router = APIRouter(
+    prefix="/health",
+    tags=["Health"]
+)
+
+
+@router.get("/live")
+async def liveness():
+    """
+    Liveness probe: the worker's event loop is responsive. Checks no
+    dependencies, so a DB or LLM outage never gets the worker restarted.
+    """
+    return {"status": "alive"}
+
+
+@router.get("/ready")
+async def readiness():
+    """
+    Readiness probe: the DB is reachable, the pool is not saturated, the
+    LLM circuit is not open and the worker is not draining. Returns 503
+    otherwise so the load balancer routes elsewhere.
+    """
+    ready, checks = await readiness_probe.check()
+    return JSONResponse(
+        status_code=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"status": "ready" if ready else "unavailable", "checks": checks},
+    )
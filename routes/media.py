@@ -0,0 +1,51 @@
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import FileResponse
+
+from core.blob_storage import BlobStorage, CONTENT_TYPES, content_type_for, get_storage, is_blob_key
+from core.responses import etag_matches, not_modified
+
+router = APIRouter(
+    prefix="/media",
+    tags=["Media"]
+)
+
+# Keys are content hashes, so a key's bytes never change
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def _original_of(storage: BlobStorage, thumbnail_key: str) -> Optional[str]:
+    digest = thumbnail_key.split("_", 1)[0]
+    return next((key for key in (f"{digest}.{ext}" for ext in CONTENT_TYPES) if storage.exists(key)), None)
+
+
+@router.api_route("/{key}", methods=["GET", "HEAD"])
+def get_media(key: str, request: Request):
+    """
+    Serve a stored image with a strong ETag and a one-year immutable
+    Cache-Control. A thumbnail that has not been generated yet is answered
+    with the original image and no-cache, so clients pick up the thumbnail
+    on their next revalidation.
+    """
+    if not is_blob_key(key):
+        raise HTTPException(status_code=404, detail="Not found")
+    storage = get_storage()
+    cache_control = IMMUTABLE
+    if "_" in key and not storage.exists(key):
+        key = _original_of(storage, key)
+        if key is None:
+            raise HTTPException(status_code=404, detail="Not found")
+        cache_control = "no-cache"
+
+    headers = {"ETag": f'"{key.split(".", 1)[0]}"', "Cache-Control": cache_control}
+    if etag_matches(request, headers["ETag"]):
+        return not_modified(headers)
+
+    path = storage.local_path(key)
+    if path is not None:
+        return FileResponse(path, media_type=content_type_for(key), headers=headers)
+    data = storage.get(key)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    return Response(data, media_type=content_type_for(key), headers=headers)
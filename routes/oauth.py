@@ -1,15 +1,11 @@
 from fastapi import APIRouter, Depends, Request, HTTPException, status
 from starlette.responses import JSONResponse
 from sqlalchemy.orm import Session
-import jwt
 
-from core.config import settings, logger
 from core.database import get_db
-from authlib.integrations.starlette_client import OAuth
 
 from schemas.oauth import OAuthSetupProfile, OAuthUserResponse
 from models.user import User
-from utils.oauth import get_or_create_user_with_oauth
 from services.oauth_service import create_authorization_url, handle_oauth_callback
 
 router = APIRouter(
@@ -17,41 +13,20 @@ router = APIRouter(
     tags=["OAuth"]
 )
 
-# Initialize OAuth client
-oauth = OAuth()
 
-
-@router.get("/google/login")
-async def google_login_url(request: Request):
-    authorization_url = create_authorization_url(oauth, "google")
-    return JSONResponse({"authorization_url": authorization_url})
-
-
-@router.get("/apple/login")
-async def apple_login_url(request: Request):
-    authorization_url = create_authorization_url(oauth, "apple")
-    return JSONResponse({"authorization_url": authorization_url})
-
-
-@router.get("/github/login")
-async def github_login_url(request: Request):
-    authorization_url = create_authorization_url(oauth, "github")
+@router.get("/{provider}/login")
+async def oauth_login_url(provider: str, request: Request):
+    """
+    Return the authorization URL of an enabled provider (google, apple, github).
+    """
+    authorization_url = await create_authorization_url(request, provider)
     return JSONResponse({"authorization_url": authorization_url})
 
 
-@router.get("/google/callback")
-async def google_callback(request: Request, db: Session = Depends(get_db)):
-    return await handle_oauth_callback(oauth, request, db, "google")
-
-
-@router.get("/apple/callback")
-async def apple_callback(request: Request, db: Session = Depends(get_db)):
-    return await handle_oauth_callback(oauth, request, db, "apple")
-
-
-@router.get("/github/callback")
-async def github_callback(request: Request, db: Session = Depends(get_db)):
-    return await handle_oauth_callback(oauth, request, db, "github")
+# Apple returns with a POST (response_mode=form_post), the others with a GET
+@router.api_route("/{provider}/callback", methods=["GET", "POST"])
+async def oauth_callback(provider: str, request: Request):
+    return await handle_oauth_callback(request, provider)
 
 
 @router.put("/setup-profile", response_model=OAuthUserResponse)
@@ -60,10 +35,15 @@ def setup_profile(profile: OAuthSetupProfile, request: Request, db: Session = De
     if not current_user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
 
-    update_data = profile.dict(exclude_unset=True)
+    # The middleware's user is detached; re-query it using the current session
+    user_in_db = db.get(User, current_user.id)
+    if not user_in_db:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+
+    update_data = profile.model_dump(exclude_unset=True)
     for key, value in update_data.items():
-        setattr(current_user, key, value)
+        setattr(user_in_db, key, value)
     db.commit()
-    db.refresh(current_user)
+    db.refresh(user_in_db)
     
-    return current_user
+    return user_in_db
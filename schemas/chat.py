@@ -1,6 +1,7 @@
 from datetime import datetime
-from typing import List, Optional
-from pydantic import BaseModel
+from typing import List, Literal, Optional
+from pydantic import BaseModel, ConfigDict, TypeAdapter
+from schemas.user import PublicUserResponse
 
 # Request schema for creating a new chat (using the first message)
 class ChatCreate(BaseModel):
@@ -14,8 +15,7 @@ class MessageResponse(BaseModel):
     message: str
     created_at: datetime
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 # Response schema for a chat
 class ChatResponse(BaseModel):
@@ -23,18 +23,52 @@ class ChatResponse(BaseModel):
     title: str
     user_id: int
     context: Optional[List[str]] = None
-    # Expanded context: full user data for each user in context
-    expanded_context: Optional[List] = []  
+    # Expanded context: the public profile of each user in context
+    # Typed so pydantic-core can serialize it without falling back to generic encoding
+    expanded_context: Optional[List[PublicUserResponse]] = []
     messages: List[MessageResponse] = []
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 # Request schema for creating a new message
 class MessageCreate(BaseModel):
     chat_id: int
     message: str
 
+# Request schemas for bulk-importing chats with their history
+class MessageImport(BaseModel):
+    sender: Literal["user", "assistant"]
+    message: str
+    created_at: Optional[datetime] = None
+
+# Context is not imported: it holds ids of other users' profiles, which
+# only the user_search tool may add
+class ChatImport(BaseModel):
+    title: str = "New Chat"
+    messages: List[MessageImport] = []
+
+# Response schemas for message search
+class MessageSearchResult(BaseModel):
+    message_id: int
+    chat_id: int
+    chat_title: str
+    sender: str
+    snippet: str
+    created_at: datetime
+    rank: float
+
+    model_config = ConfigDict(from_attributes=True)
+
+class MessageSearchResponse(BaseModel):
+    results: List[MessageSearchResult] = []
+    # Opaque cursor for the next page; None on the last page
+    next_cursor: Optional[str] = None
+
 # Schema for returning a placeholder LLM response
 class LLMResponse(BaseModel):
     response: str
+
+# Precompiled adapters for rendering responses straight to JSON bytes
+chat_response_adapter = TypeAdapter(ChatResponse)
+message_response_adapter = TypeAdapter(MessageResponse)
+message_search_response_adapter = TypeAdapter(MessageSearchResponse)
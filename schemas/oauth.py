@@ -1,5 +1,6 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, ConfigDict, EmailStr, Field
 from typing import Optional, List
+from schemas.user import PROFILE_PIC_MAX_LENGTH
 
 class OAuthSetupProfile(BaseModel):
     """
@@ -7,12 +8,11 @@ class OAuthSetupProfile(BaseModel):
     All fields are optional so that users can provide only the fields they want to update.
     """
     username: Optional[str] = None
-    profile_pic: Optional[str] = None
+    profile_pic: Optional[str] = Field(None, max_length=PROFILE_PIC_MAX_LENGTH)
     location: Optional[str] = None
     interests: Optional[List[str]] = None
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 class OAuthUserResponse(BaseModel):
     """
@@ -26,5 +26,4 @@ class OAuthUserResponse(BaseModel):
     location: Optional[str] = None
     interests: Optional[List[str]] = None
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
@@ -1,43 +1,62 @@
-from pydantic import BaseModel, EmailStr
-from typing import List, Optional
+from pydantic import BaseModel, ConfigDict, EmailStr, Field, TypeAdapter, computed_field, field_serializer
+from typing import Dict, List, Optional
+from core.blob_storage import derived_key, is_blob_key, media_url
+from core.config import settings
+
+# Images are uploaded to PUT /auth/me/profile-pic; profile_pic fields only
+# accept a URL or storage key, not inline data URIs
+PROFILE_PIC_MAX_LENGTH = 2048
 
 class UserCreate(BaseModel):
     email: EmailStr
     password: str
     username: str
     interests: List[str]
-    profile_pic: Optional[str] = None
+    profile_pic: Optional[str] = Field(None, max_length=PROFILE_PIC_MAX_LENGTH)
     location: Optional[str] = None
     bio: Optional[str] = None  # Max ~500 words
     profession: Optional[str] = None  # Max ~500 words
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
-class UserResponse(BaseModel):
+# The profile other users may see, e.g. in a chat's expanded_context
+class PublicUserResponse(BaseModel):
     id: int
-    email: EmailStr
     username: Optional[str] = None
     profile_pic: Optional[str] = None
     location: Optional[str] = None
     interests: Optional[List[str]] = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+    @field_serializer("profile_pic")
+    def serialize_profile_pic(self, profile_pic: Optional[str]) -> Optional[str]:
+        # Uploaded images are stored as a key; OAuth pictures and older rows hold a URL
+        return media_url(profile_pic) if is_blob_key(profile_pic) else profile_pic
+
+    @computed_field
+    @property
+    def profile_pic_thumbnails(self) -> Optional[Dict[int, str]]:
+        if not is_blob_key(self.profile_pic):
+            return None
+        return {size: media_url(derived_key(self.profile_pic, size)) for size in settings.THUMBNAIL_SIZES}
+
+# The authenticated user's own profile, including private fields
+class UserResponse(PublicUserResponse):
+    email: EmailStr
     bio: Optional[str] = None
     profession: Optional[str] = None
 
-    class Config:
-        from_attributes = True
-
 class UserUpdate(BaseModel):
     email: Optional[EmailStr] = None
     username: Optional[str] = None
-    profile_pic: Optional[str] = None
+    profile_pic: Optional[str] = Field(None, max_length=PROFILE_PIC_MAX_LENGTH)
     location: Optional[str] = None
     interests: Optional[List[str]] = None
     bio: Optional[str] = None  # Max ~500 words
     profession: Optional[str] = None  # Max ~500 words
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class PasswordReset(BaseModel):
     password: str
@@ -46,9 +65,11 @@ class TokenResponse(BaseModel):
     access_token: str
     token_type: str = "bearer"
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class LoginCredentials(BaseModel):
     email: EmailStr
     password: str
+
+# Precompiled adapter for rendering responses straight to JSON bytes
+user_response_adapter = TypeAdapter(UserResponse)
@@ -0,0 +1,168 @@
+"""
+Production entry point.
+
+    python serve.py                 # one worker per core
+    python serve.py --workers 4
+
+Runs uvicorn's multi-process supervisor with uvloop and httptools when
+they are installed. Send SIGHUP to the supervisor to restart workers one
+at a time (zero-downtime reload, e.g. after a deploy), and SIGTTIN/SIGTTOU
+to add or remove a worker. `main.py` still runs a single development server.
+
+On SIGTERM the readiness probe fails at once, but requests are still served
+for SHUTDOWN_READINESS_GRACE seconds so the load balancer can notice and
+stop routing here. After that uvicorn stops accepting connections and the
+lifespan drains the running chat streams.
+
+With several workers, /metrics adds up the metrics of all of them through
+snapshot files in METRICS_MULTIPROC_DIR (a temporary directory unless set).
+"""
+import argparse
+import importlib.util
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import threading
+import time
+
+import uvicorn
+from uvicorn.supervisors import Multiprocess
+
+from core.config import settings, logger
+
+# Sent by the supervisor to tell its workers to start failing readiness
+DRAIN_SIGNAL = signal.SIGUSR1
+
+
+def default_workers() -> int:
+    """
+    One worker per core. Workers are async and offload blocking work to
+    their threadpool, so more processes than cores only adds contention.
+    """
+    if settings.WEB_CONCURRENCY > 0:
+        return settings.WEB_CONCURRENCY
+    try:
+        return max(len(os.sched_getaffinity(0)), 1)  # Respects container CPU pinning
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _available(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+def start_draining() -> None:
+    from core.health import readiness_probe
+    if not readiness_probe.draining:
+        readiness_probe.draining = True
+        logger.info("Draining: failing readiness, still serving requests")
+
+
+class DrainingServer(uvicorn.Server):
+    """
+    uvicorn server that fails readiness before it stops accepting
+    connections. A single-process server does so itself on SIGTERM, then
+    shuts down after `grace` seconds. Under the supervisor, workers start
+    draining on DRAIN_SIGNAL and the supervisor sends SIGTERM once the grace
+    period is over, so SIGHUP restarts are not delayed by it.
+    """
+
+    def __init__(self, config: uvicorn.Config, grace: float, drain_on_term: bool):
+        super().__init__(config)
+        self.grace = grace
+        self.drain_on_term = drain_on_term
+        self._exit_timer = None
+
+    async def serve(self, sockets=None) -> None:
+        signal.signal(DRAIN_SIGNAL, lambda sig, frame: start_draining())
+        await super().serve(sockets)
+
+    def handle_exit(self, sig, frame) -> None:
+        # Other signals, and a second SIGTERM during the grace period, shut down at once
+        if sig != signal.SIGTERM or not self.drain_on_term or self.grace <= 0 or self._exit_timer is not None:
+            return super().handle_exit(sig, frame)
+        start_draining()
+        self._exit_timer = threading.Timer(self.grace, super().handle_exit, (sig, frame))
+        self._exit_timer.daemon = True
+        self._exit_timer.start()
+
+
+class DrainingMultiprocess(Multiprocess):
+    def __init__(self, *args, grace: float, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.grace = grace
+
+    def handle_term(self) -> None:
+        if self.grace > 0:
+            logger.info("Received SIGTERM, workers fail readiness for %.0fs before shutting down", self.grace)
+            for process in self.processes:
+                if process.pid:
+                    os.kill(process.pid, DRAIN_SIGNAL)
+            time.sleep(self.grace)
+        super().handle_term()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=settings.HOST)
+    parser.add_argument("--port", type=int, default=settings.PORT)
+    parser.add_argument("--workers", type=int, default=default_workers())
+    args = parser.parse_args()
+
+    loop = "uvloop" if _available("uvloop") else "asyncio"
+    http = "httptools" if _available("httptools") else "h11"
+
+    # Import once in the supervisor so configuration or import errors fail
+    # the launch immediately instead of crash-looping every worker
+    import main  # noqa: F401
+
+    logger.info("Starting %d workers on %s:%d (loop=%s, http=%s)", args.workers, args.host, args.port, loop, http)
+    if args.workers > 1 and settings.DATABASE_REPLICA_URLS and not settings.READ_YOUR_WRITES_BACKEND_URL:
+        logger.warning("READ_YOUR_WRITES_BACKEND_URL is not set; users may read their own writes stale from a replica"
+                       " when their next request reaches another worker")
+    if args.workers > 1 and not settings.IDEMPOTENCY_BACKEND_URL:
+        logger.warning("IDEMPOTENCY_BACKEND_URL is not set; a retried request that reaches another worker"
+                       " runs again despite its Idempotency-Key")
+    metrics_dir = None
+    if args.workers > 1 and settings.METRICS_ENABLED:
+        # Workers add up their metrics through snapshots in a shared directory (see core/metrics.py).
+        # Spawned workers read it from the environment when they import the settings.
+        from core.metrics import reset_snapshot_dir
+        if not settings.METRICS_MULTIPROC_DIR:
+            metrics_dir = tempfile.mkdtemp(prefix="metrics-")
+            settings.METRICS_MULTIPROC_DIR = os.environ["METRICS_MULTIPROC_DIR"] = metrics_dir
+        reset_snapshot_dir(settings.METRICS_MULTIPROC_DIR)
+    config = uvicorn.Config(
+        "main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        loop=loop,
+        http=http,
+        backlog=settings.BACKLOG,
+        timeout_keep_alive=settings.KEEPALIVE_TIMEOUT,
+        limit_concurrency=settings.LIMIT_CONCURRENCY or None,
+        # Leave time for the lifespan to drain chat streams on shutdown
+        timeout_graceful_shutdown=int(settings.SHUTDOWN_DRAIN_TIMEOUT) + 5,
+        proxy_headers=True,
+        server_header=False,
+        access_log=False,  # Request metrics come from /metrics; access lines cost CPU per request
+    )
+    grace = settings.SHUTDOWN_READINESS_GRACE
+    server = DrainingServer(config, grace, drain_on_term=config.workers == 1)
+    if config.workers > 1:
+        try:
+            DrainingMultiprocess(config, target=server.run, sockets=[config.bind_socket()], grace=grace).run()
+        finally:
+            if metrics_dir:
+                shutil.rmtree(metrics_dir, ignore_errors=True)
+    else:
+        server.run()
+        if not server.started:
+            sys.exit(3)  # uvicorn's startup-failure exit code
+
+
+if __name__ == "__main__":
+    main()
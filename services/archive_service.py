@@ -0,0 +1,204 @@
+import asyncio
+import json
+import random
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+from sqlalchemy import delete, exists, func, insert, or_, select, update
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from core.blob_storage import BlobStorage, get_storage
+from core.config import settings, logger
+from core.database import get_db_context, unit_of_work
+from models.chat import Chat, Message
+
+ARCHIVE_EXTENSION = "json.zst"
+ARCHIVE_FORMAT = 1
+
+
+def archive_storage() -> BlobStorage:
+    return get_storage(settings.ARCHIVE_STORAGE_URL)
+
+
+def new_archive_key(chat_id: int) -> str:
+    """
+    A key no other archive has used. Unlike media, archives are not keyed by
+    content: archiving the same messages twice must not share a blob, or
+    deleting one archive after rehydration would delete the other.
+    """
+    return f"{uuid.uuid4().hex}_{chat_id}.{ARCHIVE_EXTENSION}"
+
+
+def encode_archive(chat_id: int, messages: List[dict]) -> bytes:
+    """
+    Serialize a chat's messages to zstd-compressed JSON. zstandard is
+    imported here so only workers that archive or rehydrate load it.
+    """
+    import zstandard
+    document = {
+        "format": ARCHIVE_FORMAT,
+        "chat_id": chat_id,
+        "messages": [{**msg, "created_at": msg["created_at"].isoformat()} for msg in messages],
+    }
+    raw = json.dumps(document, separators=(",", ":")).encode()
+    return zstandard.ZstdCompressor(level=settings.ARCHIVE_ZSTD_LEVEL).compress(raw)
+
+
+def decode_archive(data: bytes) -> List[dict]:
+    """
+    Inverse of encode_archive: the message rows, ready to insert.
+    """
+    import zstandard
+    document = json.loads(zstandard.ZstdDecompressor().decompress(data))
+    return [
+        {**msg, "chat_id": document["chat_id"], "created_at": datetime.fromisoformat(msg["created_at"])}
+        for msg in document["messages"]
+    ]
+
+
+def _cutoff() -> datetime:
+    return datetime.now(timezone.utc) - timedelta(days=settings.ARCHIVE_AFTER_DAYS)
+
+
+def _not_rehydrated_since(cutoff: datetime):
+    return or_(Chat.rehydrated_at.is_(None), Chat.rehydrated_at < cutoff)
+
+
+def archive_chat(chat_id: int) -> bool:
+    """
+    Move one chat's messages to cold storage if it is still inactive: no
+    message and no rehydration since the ARCHIVE_AFTER_DAYS cutoff.
+
+    The messages are read and uploaded without holding any lock. Only then
+    is the chat row locked FOR UPDATE SKIP LOCKED, so chats being written to
+    (a message insert holds a key-share lock on its chat) are skipped and
+    concurrent archivers never pick the same chat. Under the lock the chat
+    is checked again: if it changed since the upload, the blob is deleted
+    and the chat left alone. Otherwise the archive key is set and the
+    messages deleted, and new messages wait only for that.
+
+    :return: True if the chat was archived.
+    """
+    cutoff = _cutoff()
+    eligible = (Chat.id == chat_id, Chat.archive_key.is_(None), _not_rehydrated_since(cutoff))
+    with get_db_context() as db:
+        if db.execute(select(Chat.id).where(*eligible)).scalar() is None:
+            return False
+        rows = db.execute(
+            select(Message.id, Message.sender, Message.message, Message.created_at)
+            .where(Message.chat_id == chat_id)
+            .order_by(Message.id)
+        ).mappings().all()
+    if not rows or max(row["created_at"] for row in rows) >= cutoff:
+        return False
+
+    storage = archive_storage()
+    key = new_archive_key(chat_id)
+    storage.put(key, encode_archive(chat_id, [dict(row) for row in rows]), "application/zstd")
+    archived = False
+    try:
+        with get_db_context() as db, unit_of_work(db):
+            if db.execute(select(Chat.id).where(*eligible).with_for_update(skip_locked=True)).scalar() is None:
+                return False
+            # Message ids only grow, so the same count and last id mean the same messages
+            count, last_id = db.execute(
+                select(func.count(), func.max(Message.id)).where(Message.chat_id == chat_id)
+            ).one()
+            if count != len(rows) or last_id != rows[-1]["id"]:
+                return False
+            db.execute(update(Chat).where(Chat.id == chat_id).values(archive_key=key, archived_at=func.now()))
+            db.execute(delete(Message).where(Message.chat_id == chat_id))
+        archived = True
+    finally:
+        # A blob no chat points to, e.g. the chat got a message after the upload
+        if not archived:
+            storage.delete(key)
+    logger.debug("Archived %d messages of chat %s to %s", len(rows), chat_id, key)
+    return True
+
+
+def archive_inactive_chats(batch_size: int = None) -> int:
+    """
+    Archive up to `batch_size` chats whose last message, and last
+    rehydration, is older than ARCHIVE_AFTER_DAYS. Each chat is archived in
+    its own short transaction.
+
+    :return: The number of chats archived.
+    """
+    cutoff = _cutoff()
+    with get_db_context() as db:
+        chat_ids = db.scalars(
+            select(Chat.id)
+            .where(
+                Chat.archive_key.is_(None),
+                _not_rehydrated_since(cutoff),
+                exists().where(Message.chat_id == Chat.id),
+                ~exists().where(Message.chat_id == Chat.id, Message.created_at >= cutoff),
+            )
+            .limit(batch_size or settings.ARCHIVE_BATCH_SIZE)
+        ).all()
+    archived = 0
+    for chat_id in chat_ids:
+        try:
+            archived += archive_chat(chat_id)
+        except Exception as e:
+            logger.error("Archiving chat %s failed: %s", chat_id, e)
+    if archived:
+        logger.info("Archived %d inactive chats", archived)
+    return archived
+
+
+def rehydrate_chat(db: Session, chat: Chat) -> None:
+    """
+    Restore an archived chat's messages to the messages table, keeping their
+    original ids, and expire the chat so its messages reload. A no-op for
+    chats that are not archived, which costs nothing since archive_key is
+    loaded with the chat.
+
+    Messages written to the chat after it was archived stay where they are
+    and are merged with the restored ones. rehydrated_at is set, so the
+    archiver leaves the chat alone for another ARCHIVE_AFTER_DAYS even though
+    the restored messages are old.
+    """
+    if chat.archive_key is None:
+        return
+    storage = archive_storage()
+    # Fetched before taking the lock, so the chat row stays locked only for the inserts
+    key = chat.archive_key
+    data = storage.get(key)
+    with unit_of_work(db):
+        # Re-read under the lock; another request may have rehydrated it already
+        current_key = db.execute(select(Chat.archive_key).where(Chat.id == chat.id).with_for_update()).scalar_one()
+        if current_key is not None:
+            if current_key != key:
+                # Rehydrated and archived again since the chat was loaded
+                key, data = current_key, storage.get(current_key)
+            if data is None:
+                raise RuntimeError(f"Archive {key} of chat {chat.id} is missing")
+            rows = decode_archive(data)
+            db.execute(insert(Message), rows)
+            db.execute(
+                update(Chat)
+                .where(Chat.id == chat.id)
+                .values(archive_key=None, archived_at=None, rehydrated_at=func.now())
+            )
+    db.expire(chat)
+    if current_key is not None:
+        storage.delete(key)
+        logger.debug("Rehydrated %d messages of chat %s", len(rows), chat.id)
+
+
+async def run_archiver() -> None:
+    """
+    Archive inactive chats every ARCHIVE_INTERVAL seconds until cancelled.
+    Every worker runs one; the interval is jittered so workers spread out,
+    and row locks keep their passes from overlapping on a chat.
+    """
+    while True:
+        await asyncio.sleep(settings.ARCHIVE_INTERVAL * random.uniform(0.5, 1.5))
+        try:
+            await run_in_threadpool(archive_inactive_chats)
+        except Exception as e:
+            logger.error("Archiver pass failed: %s", e)
@@ -1,16 +1,28 @@
-from typing import List
+import hashlib
+import re
+import time
+from datetime import timedelta
+from typing import List, Optional, Sequence
 from sqlalchemy.orm import Session
 from models.user import User
-from core.config import logger
-from sqlalchemy import text
+from schemas.user import UserCreate
+from core.config import settings, logger
+from core.metrics import EMBEDDING_SEARCH_TIME
+from core.security import create_access_token, decode_access_token, get_password_hash
+from sqlalchemy import case, func, select, text
 
+EMBEDDING_MODEL = "text-embedding-ada-002"  # 1536 dimensions, see models.user.VECTOR_DIM
+PASSWORD_RESET_PURPOSE = "password_reset"
 
-def search_users_by_embedding(db: Session, query_embedding: List[float], top_n: int = 5) -> List[User]:
+
+def search_users_by_embedding(
+    db: Session, query_embedding: List[float], top_n: int = 5, exclude_user_ids: Sequence[int] = ()
+) -> List[User]:
     """
     Efficient search for users by embedding similarity using PostgreSQL pgvector extension.
     Uses cosine similarity operator directly in SQL.
 
-    Returns top_n users sorted by similarity descending.
+    Returns top_n users sorted by similarity descending, leaving out exclude_user_ids.
     """
     # Pgvector cosine distance operator: <=>  (lower means more similar)
     # We order by ascending distance
@@ -18,9 +30,15 @@ def search_users_by_embedding(db: Session, query_embedding: List[float], top_n:
     # Convert input embedding list to string format compatible with SQL array input
     embedding_str = ','.join(str(x) for x in query_embedding)
 
+    params = {'top_n': top_n}
+    exclude = ''
+    if exclude_user_ids:
+        exclude = 'AND id <> ALL(:exclude_user_ids)'
+        params['exclude_user_ids'] = list(exclude_user_ids)
+
     sql = text(f"""
     SELECT * FROM users
-    WHERE bio_embedding IS NOT NULL AND profession_embedding IS NOT NULL
+    WHERE bio_embedding IS NOT NULL AND profession_embedding IS NOT NULL {exclude}
     ORDER BY LEAST(
         bio_embedding <=> cube(array[{embedding_str}]),
         profession_embedding <=> cube(array[{embedding_str}])
@@ -28,17 +46,117 @@ def search_users_by_embedding(db: Session, query_embedding: List[float], top_n:
     LIMIT :top_n
     """)
 
-    result = db.execute(sql, {'top_n': top_n})
+    start = time.perf_counter()
+    result = db.execute(sql, params)
     users = result.fetchall()
 
     # Convert result back to User objects
     user_list = [db.merge(user) for user in users]
+    EMBEDDING_SEARCH_TIME.observe(time.perf_counter() - start)
 
-    logger.info(f"User similarity search top {top_n}: {[ (u.email) for u in user_list]}")
+    logger.debug("User similarity search top %d: %s", top_n, [u.id for u in user_list])
 
     return user_list
 
 
+def generate_embedding(text_input: str) -> List[float]:
+    """
+    Embed a piece of text (a search query, bio or profession) with the
+    OpenAI embeddings API.
+    """
+    # Import here to avoid circular imports
+    from utils.chat import get_openai_client
+    response = get_openai_client().embeddings.create(model=EMBEDDING_MODEL, input=text_input)
+    return response.data[0].embedding
+
+
+def normalize_location(location: Optional[str]) -> Optional[str]:
+    """
+    Lowercase and collapse whitespace so a location filter matches the
+    lower(location) trigram index. Returns None for an empty filter.
+    """
+    if not location:
+        return None
+    normalized = re.sub(r"\s+", " ", location).strip().lower()
+    return normalized or None
+
+
+def search_users_hybrid(
+    db: Session,
+    query_embedding: List[float],
+    interests: Optional[Sequence[str]] = None,
+    location: Optional[str] = None,
+    top_n: int = 5,
+    exclude_user_ids: Sequence[int] = (),
+) -> List[User]:
+    """
+    Search for users by structured filters first, then by embedding similarity.
+
+    Candidates are prefiltered in SQL on interest overlap (`&&`, GIN index)
+    and fuzzy location match (pg_trgm on lower(location)). When more than
+    USER_SEARCH_CANDIDATE_LIMIT match, the most relevant are kept: most
+    shared interests first, then substring location matches, then the closest
+    location by trigram similarity. Only those candidates' embeddings are
+    ranked. Without any filter this falls back to search_users_by_embedding.
+
+    :param query_embedding: Embedding of the free-text query.
+    :param interests: Match users sharing at least one of these interests.
+    :param location: Match users whose location is similar to this one.
+    :param top_n: Number of users to return.
+    :param exclude_user_ids: Users never to return, e.g. the searching user.
+    :return: Up to top_n users, most similar first.
+    """
+    interests = [interest.strip() for interest in interests or [] if interest and interest.strip()]
+    location = normalize_location(location)
+    if not interests and not location:
+        return search_users_by_embedding(db, query_embedding, top_n, exclude_user_ids)
+
+    start = time.perf_counter()
+    candidates = select(User.id, User.bio_embedding, User.profession_embedding).where(
+        User.bio_embedding.isnot(None), User.profession_embedding.isnot(None)
+    )
+    relevance = []
+    if interests:
+        candidates = candidates.where(User.interests.overlap(interests))
+        shared_interests = sum(case((User.interests.contains([interest]), 1), else_=0) for interest in interests)
+        relevance.append(shared_interests.desc())
+    if location:
+        location_key = func.lower(User.location)
+        location_contains = location_key.contains(location, autoescape=True)
+        # Substring match for "San Francisco" vs "San Francisco, CA", trigram similarity for typos
+        candidates = candidates.where(location_contains | location_key.op("%")(location))
+        relevance += [location_contains.desc(), func.similarity(location_key, location).desc()]
+    if exclude_user_ids:
+        candidates = candidates.where(User.id.notin_(exclude_user_ids))
+    # User.id last so the cut at the candidate limit is deterministic
+    candidates = candidates.order_by(*relevance, User.id).limit(settings.USER_SEARCH_CANDIDATE_LIMIT)
+    rows = db.execute(candidates).all()
+    if not rows:
+        return []
+
+    from numpy import argsort, array, maximum
+    from numpy.linalg import norm
+    query = array(query_embedding, dtype="float32")
+    query /= norm(query) or 1.0
+
+    def similarities(vectors):
+        matrix = array(vectors, dtype="float32")
+        norms = norm(matrix, axis=1)
+        norms[norms == 0] = 1.0
+        return (matrix @ query) / norms
+
+    # Same score as search_users_by_embedding: the closer of bio and profession
+    scores = maximum(similarities([row.bio_embedding for row in rows]),
+                     similarities([row.profession_embedding for row in rows]))
+    best_ids = [rows[i].id for i in argsort(-scores)[:top_n]]
+    users_by_id = {user.id: user for user in db.query(User).filter(User.id.in_(best_ids))}
+    user_list = [users_by_id[user_id] for user_id in best_ids if user_id in users_by_id]
+    EMBEDDING_SEARCH_TIME.observe(time.perf_counter() - start)
+
+    logger.debug("Hybrid user search ranked %d candidates, returned %d", len(rows), len(user_list))
+    return user_list
+
+
 def cosine_similarity(vec1: list[float], vec2: list[float]) -> float:
     # We can optionally keep this for non-DB purposes
     from numpy import dot
@@ -51,3 +169,63 @@ def cosine_similarity(vec1: list[float], vec2: list[float]) -> float:
     if denom == 0.0:
         return 0.0
     return float(dot(v1, v2) / denom)
+
+
+def create_user(user_create: UserCreate, db: Session) -> User:
+    """
+    Add a password account to the session and flush it so it has an id.
+    The bio and profession are embedded for user search when given. The
+    caller sets the active token and commits.
+    """
+    user = User(
+        email=user_create.email,
+        hashed_password=get_password_hash(user_create.password),
+        username=user_create.username,
+        interests=user_create.interests,
+        profile_pic=user_create.profile_pic,
+        location=user_create.location,
+        bio=user_create.bio,
+        profession=user_create.profession,
+        bio_embedding=generate_embedding(user_create.bio) if user_create.bio else None,
+        profession_embedding=generate_embedding(user_create.profession) if user_create.profession else None,
+    )
+    db.add(user)
+    db.flush()
+    logger.info("Created user %s", user.id)
+    return user
+
+
+def _password_fingerprint(user: User) -> str:
+    return hashlib.sha256(user.hashed_password.encode()).hexdigest()[:16]
+
+
+def generate_password_reset_token(user: User, db: Session) -> str:
+    """
+    A signed, short-lived token for resetting the user's password. It carries
+    a fingerprint of the current password hash, so it stops working once the
+    password changes, which makes it single-use. Nothing is stored.
+    """
+    return create_access_token(
+        data={"sub": user.email, "purpose": PASSWORD_RESET_PURPOSE, "pwd": _password_fingerprint(user)},
+        expires_delta=timedelta(minutes=settings.PASSWORD_RESET_TOKEN_MINUTES),
+    )
+
+
+def reset_password(token: str, new_password: str, db: Session) -> bool:
+    """
+    Set a new password from a token made by generate_password_reset_token and
+    end the user's current session.
+
+    :return: False if the token is invalid, expired, already used, or not a reset token.
+    """
+    payload = decode_access_token(token)
+    if not payload or payload.get("purpose") != PASSWORD_RESET_PURPOSE:
+        return False
+    user = db.query(User).filter(User.email == payload.get("sub")).first()
+    if not user or payload.get("pwd") != _password_fingerprint(user):
+        return False
+    user.hashed_password = get_password_hash(new_password)
+    user.active_token = None
+    db.commit()
+    logger.info("Password reset for user %s", user.id)
+    return True
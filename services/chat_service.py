@@ -1,15 +1,31 @@
-from typing import Tuple, List, Generator
-from sqlalchemy.orm import Session
-from models.chat import Chat, Message
+import base64
+import json
+from datetime import datetime, timezone
+from typing import Tuple, List, Generator, Optional, Union
+from sqlalchemy import Integer, REAL, any_, cast, func, insert, select, tuple_, update
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+from models.chat import Chat, Message, SEARCH_CONFIG
 from models.user import User
 from utils.chat import generate_chat_title, generate_llm_response, stream_llm_response
-from services.auth_service import generate_embedding, search_users_by_embedding
+from services.auth_service import generate_embedding, search_users_hybrid
+from services.archive_service import rehydrate_chat
 from core.config import logger
+from core.database import get_db_context, get_read_db_context, unit_of_work
+from core.sse import StreamDone
+
+
+DEFAULT_CHAT_TITLE = "New Chat"
+# A chat is titled once, when its user messages first reach this count
+TITLE_AFTER_USER_MESSAGES = 5
 
 
 def generate_chat_title_after_messages(db: Session, chat: Chat) -> None:
+    if chat.title != DEFAULT_CHAT_TITLE:
+        return
     user_messages = db.query(Message).filter(Message.chat_id == chat.id, Message.sender == 'user').order_by(Message.created_at).all()
-    if len(user_messages) >= 5:
+    if len(user_messages) >= TITLE_AFTER_USER_MESSAGES:
         messages_text = "\n".join([msg.message for msg in user_messages])
         title = generate_chat_title(messages_text)
         if title:
@@ -18,18 +34,37 @@ def generate_chat_title_after_messages(db: Session, chat: Chat) -> None:
             db.refresh(chat)
 
 
-def create_chat(db: Session, user: User, message: str) -> Tuple[Chat, str]:
-    default_title = "New Chat"
-    chat = Chat(
-        title=default_title,
-        user_id=user.id,
-        context=[]
-    )
-    db.add(chat)
-    db.commit()
-    db.refresh(chat)
-    user_msg, assistant_msg = create_message(db, chat, message)
-    generate_chat_title_after_messages(db, chat)
+def _title_from_loaded_messages(chat: Chat) -> Optional[str]:
+    """
+    Title for the turn that brings the chat to TITLE_AFTER_USER_MESSAGES user
+    messages, counted from its already-loaded messages. Later turns and
+    chats that already have a title make no LLM call.
+    """
+    if chat.title != DEFAULT_CHAT_TITLE:
+        return None
+    user_messages = [msg for msg in chat.messages if msg.sender == 'user']
+    if len(user_messages) == TITLE_AFTER_USER_MESSAGES:
+        return generate_chat_title("\n".join(msg.message for msg in user_messages))
+    return None
+
+
+def create_chat(user: User, message: str) -> Tuple[Chat, str]:
+    """
+    Create a chat from its first message.
+
+    The chat and the user message are written in one short transaction, the
+    LLM runs with no connection checked out, and the assistant reply is
+    written in a second short one. The returned chat is detached but fully loaded.
+    """
+    with get_db_context() as db, unit_of_work(db):
+        chat = Chat(
+            title=DEFAULT_CHAT_TITLE,
+            user_id=user.id,
+            context=[],
+            messages=[Message(sender="user", message=message)]
+        )
+        db.add(chat)
+    assistant_msg = _write_assistant_reply(chat)
     return chat, assistant_msg.message
 
 
@@ -37,62 +72,272 @@ def get_chat(db: Session, chat_id: int, user: User) -> Chat:
     chat = db.query(Chat).filter(Chat.id == chat_id, Chat.user_id == user.id).first()
     if not chat:
         raise Exception("Chat not found or unauthorized")
+    rehydrate_chat(db, chat)
     generate_chat_title_after_messages(db, chat)
     return chat
 
 
-def create_message(db: Session, chat: Chat, message: str) -> Tuple[Message, Message]:
-    user_msg = Message(
-        chat_id=chat.id,
-        sender="user",
-        message=message
-    )
-    db.add(user_msg)
-    db.commit()
-    db.refresh(user_msg)
-    llm_text = generate_llm_response(chat)
-    assistant_msg = Message(
-        chat_id=chat.id,
-        sender="assistant",
-        message=llm_text
+def get_chat_etag(db: Session, chat_id: int, user: User) -> Optional[str]:
+    """
+    ETag of GET /chat/{chat_id} for this chat, from the chat's version and the
+    profile versions of the users in its context (they are embedded as
+    expanded_context). One query on primary keys; no messages are loaded.
+
+    Versions only increase, so their sum changes whenever any of them does.
+
+    :return: The ETag, or None if the chat does not exist or belongs to someone else.
+    """
+    context_version = (
+        select(func.coalesce(func.sum(User.profile_version), 0))
+        .where(User.id == any_(cast(Chat.context, ARRAY(Integer))))
+        .scalar_subquery()
     )
-    db.add(assistant_msg)
-    db.commit()
-    db.refresh(assistant_msg)
+    row = db.execute(
+        select(Chat.version, context_version).where(Chat.id == chat_id, Chat.user_id == user.id)
+    ).first()
+    if row is None:
+        return None
+    return f'"{chat_id}-{row[0]}-{row[1]}"'
+
+
+def start_turn(chat_id: int, user: User, message: str) -> Optional[Chat]:
+    """
+    Read/write phase before generation: load the user's chat with its
+    messages and store the new user message, in one short-lived session.
+
+    :return: The detached chat, including the new message, or None if the
+             chat does not exist or belongs to someone else.
+    """
+    with get_db_context() as db:
+        chat = (
+            db.query(Chat)
+            .options(selectinload(Chat.messages))
+            .filter(Chat.id == chat_id, Chat.user_id == user.id)
+            .first()
+        )
+        if not chat:
+            return None
+        rehydrate_chat(db, chat)
+        with unit_of_work(db):
+            chat.messages.append(Message(sender="user", message=message))
+    return chat
+
+
+def create_message(chat_id: int, user: User, message: str) -> Optional[Tuple[Message, Message]]:
+    """
+    Run a full chat turn without holding a connection during generation.
+
+    :return: (user message, assistant message), or None if the chat was not found.
+    """
+    chat = start_turn(chat_id, user, message)
+    if not chat:
+        return None
+    user_msg = chat.messages[-1]
+    assistant_msg = _write_assistant_reply(chat)
     return user_msg, assistant_msg
 
 
-def stream_message_response(db: Session, chat: Chat, message: str) -> Generator[str, None, None]:
-    user_msg = Message(
-        chat_id=chat.id,
-        sender="user",
-        message=message
+def _write_assistant_reply(chat: Chat) -> Message:
+    """
+    Generate the assistant reply for the chat's loaded messages, then persist
+    it together with any title update.
+    """
+    llm_text = generate_llm_response(chat)
+    title = _title_from_loaded_messages(chat)
+    return _save_assistant_message(chat, llm_text, title)
+
+
+def _save_assistant_message(chat: Chat, text: str, title: Optional[str] = None) -> Message:
+    """
+    Write phase after generation: re-attach the detached chat to a fresh
+    short-lived session and insert the reply in a single transaction.
+    """
+    with get_db_context() as db, unit_of_work(db):
+        db.add(chat)
+        assistant_msg = Message(sender="assistant", message=text)
+        chat.messages.append(assistant_msg)
+        if title:
+            chat.title = title
+    return assistant_msg
+
+
+def user_search_tool(
+    db: Session,
+    chat: Chat,
+    query: str,
+    interests: Optional[List[str]] = None,
+    location: Optional[str] = None,
+    top_n: int = 5,
+) -> Message:
+    """
+    The chat's user_search tool: find users matching the query and the
+    model's structured filters, add them to the chat's context, and describe
+    them for the model.
+
+    :return: An unsaved Message whose text is the tool result for the LLM.
+    """
+    query_embedding = generate_embedding(query)
+    # The ranking query scans candidate profiles; run it on a replica
+    with get_read_db_context() as read_db:
+        users = search_users_hybrid(
+            read_db, query_embedding, interests, location, top_n, exclude_user_ids=[chat.user_id]
+        )
+
+    context = list(chat.context or [])
+    context.extend(str(found.id) for found in users if str(found.id) not in context)
+    db.execute(update(Chat).where(Chat.id == chat.id).values(context=context, version=Chat.version + 1))
+    # The chat may be detached; record the new context without marking it dirty
+    set_committed_value(chat, "context", context)
+
+    results = [
+        {
+            "id": found.id,
+            "username": found.username,
+            "location": found.location,
+            "interests": found.interests or [],
+            "profession": found.profession,
+        }
+        for found in users
+    ]
+    return Message(chat_id=chat.id, sender="function", message=json.dumps(results))
+
+
+def import_chats(db: Session, user: User, chats: List[dict]) -> List[int]:
+    """
+    Bulk-insert chats with their full message history, e.g. when importing
+    or replaying conversations. No LLM calls are made.
+
+    Everything is written in one transaction with two multi-row INSERTs,
+    one for the chats and one for all of their messages, regardless of
+    how many chats are imported.
+
+    :param chats: Dicts with "title" and "messages",
+                  each message a dict with "sender", "message" and optional "created_at".
+                  Messages without a created_at get the time of the import, so
+                  every row has the same keys for the executemany INSERT.
+    :return: The ids of the new chats, in input order.
+    """
+    if not chats:
+        return []
+    now = datetime.now(timezone.utc)
+    with unit_of_work(db):
+        chat_ids = db.scalars(
+            insert(Chat).returning(Chat.id, sort_by_parameter_order=True),
+            [
+                {"title": chat.get("title") or DEFAULT_CHAT_TITLE, "user_id": user.id, "context": []}
+                for chat in chats
+            ],
+        ).all()
+        message_rows = [
+            {
+                "chat_id": chat_id,
+                "sender": msg["sender"],
+                "message": msg["message"],
+                "created_at": msg.get("created_at") or now,
+            }
+            for chat_id, chat in zip(chat_ids, chats)
+            for msg in chat.get("messages", [])
+        ]
+        if message_rows:
+            db.execute(insert(Message), message_rows)
+    logger.info("Imported %d chats with %d messages for user %s", len(chat_ids), len(message_rows), user.id)
+    return list(chat_ids)
+
+
+SNIPPET_OPTIONS = "MaxFragments=2, MaxWords=20, MinWords=5, StartSel=<b>, StopSel=</b>"
+
+
+def encode_search_cursor(rank: float, message_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([rank, message_id]).encode()).decode()
+
+
+def decode_search_cursor(cursor: str) -> Tuple[float, int]:
+    """
+    :raises ValueError: If the cursor was not produced by encode_search_cursor.
+    """
+    try:
+        rank, message_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(rank), int(message_id)
+    except Exception as e:
+        raise ValueError("Invalid search cursor") from e
+
+
+def search_messages(
+    db: Session, user: User, query: str, limit: int = 20, cursor: Optional[str] = None
+) -> Tuple[List[dict], Optional[str]]:
+    """
+    Full-text search over the user's own messages, best match first.
+
+    Matches come from the GIN index on messages.search_vector, restricted
+    to chats owned by the user. Pages are keyset-paginated on (rank, id),
+    so deep pages cost the same as the first, and snippets (ts_headline,
+    the expensive part) are only built for the rows of the returned page.
+    Chats in cold storage (services/archive_service.py) are not searched
+    until they are opened again.
+
+    :param query: Web-search syntax: words, "quoted phrases", OR, -excluded.
+    :param cursor: next_cursor of the previous page, if any.
+    :return: (results, cursor for the next page or None).
+    """
+    search_vector = Message.__table__.c.search_vector
+    ts_query = func.websearch_to_tsquery(SEARCH_CONFIG, query)
+    rank = func.ts_rank(search_vector, ts_query)
+
+    page = (
+        select(Message.id.label("message_id"), rank.label("rank"))
+        .join(Chat, Chat.id == Message.chat_id)
+        .where(Chat.user_id == user.id, search_vector.op("@@")(ts_query))
     )
-    db.add(user_msg)
-    db.commit()
-    db.refresh(user_msg)
+    if cursor:
+        cursor_rank, cursor_id = decode_search_cursor(cursor)
+        # Compare as REAL, the type ts_rank returns, so the boundary row is matched exactly
+        page = page.where(tuple_(rank, Message.id) < tuple_(cast(cursor_rank, REAL), cursor_id))
+    # One extra row tells whether there is a next page
+    page = page.order_by(rank.desc(), Message.id.desc()).limit(limit + 1).subquery()
 
-    assistant_msg = None
-    collected_text = ""
+    rows = db.execute(
+        select(
+            page.c.message_id,
+            page.c.rank,
+            Message.chat_id,
+            Chat.title.label("chat_title"),
+            Message.sender,
+            Message.created_at,
+            func.ts_headline(SEARCH_CONFIG, Message.message, ts_query, SNIPPET_OPTIONS).label("snippet"),
+        )
+        .join(Message, Message.id == page.c.message_id)
+        .join(Chat, Chat.id == Message.chat_id)
+        .order_by(page.c.rank.desc(), page.c.message_id.desc())
+    ).mappings().all()
 
-    for chunk in stream_llm_response(chat, message):
-        collected_text += chunk
+    results = [dict(row) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = results[-1]
+        next_cursor = encode_search_cursor(last["rank"], last["message_id"])
+    return results, next_cursor
 
-        # Create assistant message if not present, else update
-        if assistant_msg is None:
-            assistant_msg = Message(
-                chat_id=chat.id,
-                sender="assistant",
-                message=collected_text
-            )
-            db.add(assistant_msg)
-        else:
-            assistant_msg.message = collected_text
 
-        db.commit()
-        db.refresh(assistant_msg)
+def stream_message_response(chat: Chat) -> Generator[Union[str, StreamDone], None, None]:
+    """
+    Stream the assistant reply for a chat prepared by start_turn.
 
-        yield chunk
+    No session is held while tokens arrive; the full reply is written once
+    at the end in a short-lived session, including a partial reply if the
+    stream is cut short. A stream that completes titles the chat like any
+    other turn (see _title_from_loaded_messages).
+    """
+    assistant_msg = None
+    collected_text = ""
+    title = None
+    try:
+        for chunk in stream_llm_response(chat, None):
+            collected_text += chunk
+            yield chunk
+        title = _title_from_loaded_messages(chat)
+    finally:
+        if collected_text:
+            assistant_msg = _save_assistant_message(chat, collected_text, title)
 
-    # Yield a terminator indicator
-    yield "[DONE]"
+    # Yield a terminator carrying the persisted assistant message id
+    yield StreamDone(message_id=assistant_msg.id if assistant_msg else None)
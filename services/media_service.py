@@ -0,0 +1,89 @@
+import io
+from typing import Optional
+
+from fastapi import HTTPException
+
+from core.blob_storage import CONTENT_TYPES, content_key, derived_key, get_storage
+from core.config import settings, logger
+
+THUMBNAIL_QUALITY = 85
+
+
+def sniff_image_type(data: bytes) -> Optional[str]:
+    """
+    Return the file extension for JPEG, PNG, WebP and GIF data, judged by
+    the file signature rather than the client-supplied content type.
+    """
+    if data.startswith(b"\xff\xd8\xff"):
+        return "jpg"
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    return None
+
+
+def store_profile_pic(data: bytes) -> str:
+    """
+    Store an uploaded profile picture and return its storage key.
+
+    The key is derived from the content, so re-uploading the same image is
+    a no-op and the stored blob can be cached forever (see routes/media.py).
+
+    :param data: The raw image bytes.
+    :return: The key to keep in User.profile_pic.
+    :raises HTTPException: 413 if the image is too large, 415 if it is not a supported image.
+    """
+    if len(data) > settings.PROFILE_PIC_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Image exceeds {settings.PROFILE_PIC_MAX_BYTES} bytes")
+    extension = sniff_image_type(data)
+    if extension is None:
+        raise HTTPException(status_code=415, detail="Unsupported image type; use JPEG, PNG, WebP or GIF")
+    key = content_key(data, extension)
+    get_storage().put(key, data, CONTENT_TYPES[extension])
+    logger.info("Stored profile picture %s (%d bytes)", key, len(data))
+    return key
+
+
+def generate_thumbnails(key: str) -> None:
+    """
+    Write a JPEG thumbnail of the image at `key` for each THUMBNAIL_SIZES
+    entry, skipping sizes that already exist. Runs after the upload response
+    has been sent; until a thumbnail exists, routes/media.py serves the
+    original in its place. Pillow is imported here so it is only loaded by
+    workers that actually resize images.
+
+    Images over IMAGE_MAX_PIXELS are rejected from their header, before any
+    pixel data is decoded. JPEGs are decoded at the smallest DCT scale that
+    still covers the largest thumbnail.
+    """
+    storage = get_storage()
+    pending = [size for size in settings.THUMBNAIL_SIZES if not storage.exists(derived_key(key, size))]
+    if not pending:
+        return
+    data = storage.get(key)
+    if data is None:
+        logger.warning("Cannot generate thumbnails, %s is missing", key)
+        return
+    try:
+        from PIL import Image, ImageOps
+
+        with Image.open(io.BytesIO(data)) as image:
+            width, height = image.size
+            if width * height > settings.IMAGE_MAX_PIXELS:
+                logger.warning("Not generating thumbnails for %s, %dx%d exceeds IMAGE_MAX_PIXELS", key, width, height)
+                return
+            image.draft("RGB", (max(pending), max(pending)))
+            image = ImageOps.exif_transpose(image).convert("RGB")
+            for size in pending:
+                thumbnail = image.copy()
+                thumbnail.thumbnail((size, size))
+                buffer = io.BytesIO()
+                thumbnail.save(buffer, "JPEG", quality=THUMBNAIL_QUALITY, optimize=True)
+                storage.put(derived_key(key, size), buffer.getvalue(), "image/jpeg")
+    except Exception as e:
+        logger.error("Thumbnail generation failed for %s: %s", key, e)
+        return
+    logger.debug("Generated %d thumbnails for %s", len(pending), key)
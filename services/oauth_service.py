@@ -1,73 +1,237 @@
+import asyncio
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
 from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
 from starlette.responses import JSONResponse
-from sqlalchemy.orm import Session
 import jwt
 
 from core.config import settings, logger
-from authlib.integrations.starlette_client import OAuth
+from core.database import get_db_context
+from core.oidc import http_client, metadata_cache, verify_id_token
+
+from utils.oauth import link_oauth_user
+
+
+@dataclass(frozen=True)
+class OAuthProvider:
+    name: str
+    client_id: str
+    client_secret: str
+    redirect_uri: str
+    scope: str
+    discovery_url: Optional[str] = None  # OpenID providers; the ID token identifies the user
+    authorize_url: Optional[str] = None  # Plain OAuth 2 providers
+    access_token_url: Optional[str] = None
+    issuers: Tuple[str, ...] = ()  # Accepted issuers besides the one in the discovery document
+    response_mode: Optional[str] = None
+
+    @property
+    def display_name(self) -> str:
+        return self.name.capitalize()
+
+
+def _configured_providers():
+    return [
+        OAuthProvider(
+            name="google",
+            client_id=settings.GOOGLE_CLIENT_ID,
+            client_secret=settings.GOOGLE_CLIENT_SECRET,
+            redirect_uri=settings.GOOGLE_REDIRECT_URI,
+            scope="openid email profile",
+            discovery_url=settings.GOOGLE_DISCOVERY_URL,
+            issuers=("accounts.google.com",),
+        ),
+        OAuthProvider(
+            name="apple",
+            client_id=settings.APPLE_CLIENT_ID,
+            client_secret=settings.APPLE_CLIENT_SECRET,
+            redirect_uri=settings.APPLE_REDIRECT_URI,
+            scope="openid email name",
+            discovery_url=settings.APPLE_DISCOVERY_URL,
+            response_mode="form_post",  # Required by Apple when requesting name or email
+        ),
+        OAuthProvider(
+            name="github",
+            client_id=settings.GITHUB_CLIENT_ID,
+            client_secret=settings.GITHUB_CLIENT_SECRET,
+            redirect_uri=settings.GITHUB_REDIRECT_URI,
+            scope="read:user user:email",
+            authorize_url="https://github.com/login/oauth/authorize",
+            access_token_url="https://github.com/login/oauth/access_token",
+        ),
+    ]
+
+
+_providers: Optional[Dict[str, OAuthProvider]] = None
+_oauth = None
+
+
+def load_providers() -> Dict[str, OAuthProvider]:
+    """
+    Build the provider registry from settings, once per worker at startup
+    (main.py). Providers without a client id are left out.
+    """
+    global _providers
+    if _providers is None:
+        _providers = {provider.name: provider for provider in _configured_providers() if provider.client_id}
+        logger.info("OAuth providers enabled: %s", ", ".join(_providers) or "none")
+    return _providers
+
+
+def get_provider(provider_name: str) -> OAuthProvider:
+    provider = load_providers().get(provider_name)
+    if provider is None:
+        raise HTTPException(status_code=404, detail="Unknown OAuth provider")
+    return provider
+
+
+def get_oauth():
+    """
+    Return the shared authlib OAuth registry with every enabled provider
+    registered, importing authlib on first use so it is not loaded at
+    worker startup.
+    """
+    global _oauth
+    if _oauth is None:
+        from authlib.integrations.starlette_client import OAuth, StarletteOAuth2App
+
+        class CachedMetadataOAuth2App(StarletteOAuth2App):
+            """
+            Reads discovery documents and JWKS from the shared cache in
+            core/oidc.py instead of fetching and pinning its own copy.
+            """
+
+            async def load_server_metadata(self):
+                if self._server_metadata_url:
+                    self.server_metadata.update(await metadata_cache.get(self._server_metadata_url))
+                return self.server_metadata
 
-from utils.oauth import get_or_create_user_with_oauth
+            async def fetch_jwk_set(self, force=False):
+                metadata = await self.load_server_metadata()
+                return await metadata_cache.get(metadata["jwks_uri"], force=force)
 
-# Initialize OAuth client
-oauth = OAuth()
+        class ProviderRegistry(OAuth):
+            oauth2_client_cls = CachedMetadataOAuth2App
 
+        oauth = ProviderRegistry()
+        for provider in load_providers().values():
+            client_kwargs = {"scope": provider.scope}
+            if provider.response_mode:
+                client_kwargs["response_mode"] = provider.response_mode
+            oauth.register(
+                name=provider.name,
+                client_id=provider.client_id,
+                client_secret=provider.client_secret,
+                server_metadata_url=provider.discovery_url,
+                authorize_url=provider.authorize_url,
+                access_token_url=provider.access_token_url,
+                client_kwargs=client_kwargs,
+            )
+        _oauth = oauth
+    return _oauth
 
-def create_authorization_url(provider_name: str) -> str:
+
+async def create_authorization_url(request, provider_name: str) -> str:
+    """
+    Create the authorization URL for a provider and store the state (and
+    nonce) in the session so the callback can be checked against them.
+    """
+    provider = get_provider(provider_name)
+    client = get_oauth().create_client(provider.name)
+    authorization = await client.create_authorization_url(provider.redirect_uri)
+    await client.save_authorize_data(request, redirect_uri=provider.redirect_uri, **authorization)
+    logger.debug("Generated %s auth URL", provider.display_name)
+    return authorization["url"]
+
+
+async def verify_provider_id_token(provider: OAuthProvider, oauth_token: dict) -> dict:
+    """
+    Return the claims of the provider's ID token. authlib has already
+    verified it when the authorization request carried a nonce; otherwise
+    it is verified here. Either way the keys come from the shared cache, so
+    no request to the provider is made once its metadata is cached.
+    """
+    if oauth_token.get("userinfo"):
+        return dict(oauth_token["userinfo"])
+    id_token = oauth_token.get("id_token")
+    if not id_token:
+        raise HTTPException(status_code=400, detail=f"{provider.display_name} did not return an id_token")
+    try:
+        return await verify_id_token(id_token, provider.discovery_url, provider.client_id, provider.issuers)
+    except jwt.InvalidTokenError as e:
+        logger.warning("Rejected %s id_token: %s", provider.name, e)
+        raise HTTPException(status_code=400, detail=f"Invalid {provider.display_name} id_token")
+    except Exception as e:
+        logger.error("Could not verify %s id_token: %s", provider.name, e)
+        raise HTTPException(status_code=502, detail=f"Could not verify {provider.display_name} id_token")
+
+
+async def fetch_github_user_info(access_token: str) -> dict:
     """
-    Helper function to create the authorization URL for a given OAuth provider.
+    Fetch the GitHub profile and email addresses concurrently and return
+    the profile with its email set to the primary verified address, or any
+    verified one. Unverified addresses are never used, so the email is None
+    when the account has no verified address.
     """
-    redirect_uri_map = {
-        "google": settings.GOOGLE_REDIRECT_URI,
-        "apple": settings.APPLE_REDIRECT_URI,
-        "github": settings.GITHUB_REDIRECT_URI,
-    }
-    redirect_uri = redirect_uri_map.get(provider_name)
-    if not redirect_uri:
-        logger.error(f"Redirect URI not found for provider: {provider_name}")
-        raise HTTPException(status_code=400, detail="Invalid OAuth provider")
-
-    authorization_url, state = getattr(oauth, provider_name).create_authorization_url(redirect_uri)
-    logger.info(f"Generated {provider_name.capitalize()} auth URL: {authorization_url}")
-    return authorization_url
-
-
-async def handle_oauth_callback(
-    request, db: Session, provider_name: str
-) -> JSONResponse:
+    headers = {"Authorization": f"Bearer {access_token}", "Accept": "application/vnd.github+json"}
+    client = http_client()
     try:
-        oauth_token = await getattr(oauth, provider_name).authorize_access_token(request)
+        user_resp, emails_resp = await asyncio.gather(
+            client.get(f"{settings.GITHUB_API_URL}/user", headers=headers),
+            client.get(f"{settings.GITHUB_API_URL}/user/emails", headers=headers),
+        )
+        user_resp.raise_for_status()
+        emails_resp.raise_for_status()
     except Exception as e:
-        logger.error(f"{provider_name.capitalize()} auth error: {e}")
-        raise HTTPException(status_code=400, detail=f"{provider_name.capitalize()} authorization failed")
-
-    if provider_name == "apple":
-        id_token = oauth_token.get("id_token")
-        if not id_token:
-            raise HTTPException(status_code=400, detail="Apple did not return an id_token")
-        try:
-            oauth_user_info = jwt.decode(id_token, options={"verify_signature": False})
-        except Exception as e:
-            logger.error(f"Error decoding Apple id_token: {e}")
-            raise HTTPException(status_code=400, detail="Failed to decode Apple id_token")
-    elif provider_name == "github":
-        user_resp = await oauth.github.get("user")
-        emails_resp = await oauth.github.get("user/emails")
-        emails_json = emails_resp.json()
-        email = emails_json[0]["email"] if emails_json and len(emails_json) > 0 else None
-        oauth_user_info = user_resp.json()
-        oauth_user_info["email"] = email
-        if not email:
-            raise HTTPException(status_code=400, detail="GitHub account did not return an email")
+        logger.error("GitHub API error: %s", e)
+        raise HTTPException(status_code=400, detail="Failed to retrieve user info from GitHub")
+
+    verified = [e for e in emails_resp.json() or [] if e.get("verified") is True]
+    primary = next((e for e in verified if e.get("primary")), None)
+    oauth_user_info = user_resp.json()
+    oauth_user_info["email"] = (primary or verified[0])["email"] if verified else None
+    return oauth_user_info
+
+
+def _email_verified(claims: dict) -> bool:
+    # Apple sends the claim as the string "true"; Google sends a boolean
+    return claims.get("email_verified") is True or claims.get("email_verified") == "true"
+
+
+def _link_user(provider_name: str, provider_user_id: str, email: str, user_info: dict) -> Optional[str]:
+    with get_db_context() as db:
+        return link_oauth_user(db, provider_name, provider_user_id, email, user_info)
+
+
+async def handle_oauth_callback(request, provider_name: str) -> JSONResponse:
+    provider = get_provider(provider_name)
+    try:
+        oauth_token = await get_oauth().create_client(provider.name).authorize_access_token(request)
+    except Exception as e:
+        logger.error("%s auth error: %s", provider.display_name, e)
+        raise HTTPException(status_code=400, detail=f"{provider.display_name} authorization failed")
+
+    if provider.discovery_url:
+        oauth_user_info = await verify_provider_id_token(provider, oauth_token)
+        provider_user_id = oauth_user_info.get("sub")
+        if not _email_verified(oauth_user_info):
+            # An unverified email must never identify or create an account
+            oauth_user_info["email"] = None
     else:
-        try:
-            oauth_user_info = await getattr(oauth, provider_name).parse_id_token(request, oauth_token)
-        except Exception as e:
-            logger.error(f"Failed to parse {provider_name.capitalize()} ID token: {e}")
-            raise HTTPException(status_code=400, detail=f"Failed to retrieve user info from {provider_name.capitalize()}")
+        # GitHub is the only plain OAuth 2 provider
+        oauth_user_info = await fetch_github_user_info(oauth_token.get("access_token"))
+        provider_user_id = oauth_user_info.get("id")
 
     email = oauth_user_info.get("email")
-    if not email:
-        raise HTTPException(status_code=400, detail=f"{provider_name.capitalize()} account did not return an email")
+    if not email or provider_user_id is None:
+        raise HTTPException(status_code=400, detail=f"{provider.display_name} account did not return a verified email")
 
-    access_token = get_or_create_user_with_oauth(email, oauth_token, oauth_user_info, db)
+    access_token = await run_in_threadpool(_link_user, provider.name, str(provider_user_id), email, oauth_user_info)
+    if access_token is None:
+        raise HTTPException(
+            status_code=409,
+            detail="An account with this email already exists; sign in the way you signed up",
+        )
     return JSONResponse({"access_token": access_token, "token_type": "bearer"})
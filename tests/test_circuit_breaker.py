@@ -0,0 +1,140 @@
+import pytest
+
+from core import circuit_breaker
+from core.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+RESET_TIMEOUT = 30.0
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuit_breaker, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def breaker(clock):
+    return CircuitBreaker("test", failure_threshold=3, reset_timeout=RESET_TIMEOUT)
+
+
+def open_breaker(breaker):
+    for _ in range(3):
+        breaker.record_failure()
+
+
+def test_opens_after_consecutive_failures(breaker):
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CLOSED and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN and not breaker.allow()
+
+
+def test_success_resets_the_failure_count(breaker):
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+
+
+def test_lets_one_trial_through_after_reset_timeout(breaker, clock):
+    open_breaker(breaker)
+    clock.now += RESET_TIMEOUT - 1
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
+    assert not breaker.allow()
+
+
+def test_successful_trial_closes(breaker, clock):
+    open_breaker(breaker)
+    clock.now += RESET_TIMEOUT
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.allow() and breaker.allow()
+
+
+def test_failed_trial_reopens(breaker, clock):
+    open_breaker(breaker)
+    clock.now += RESET_TIMEOUT
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN and not breaker.allow()
+    clock.now += RESET_TIMEOUT
+    assert breaker.allow()
+
+
+def test_released_trial_lets_the_next_call_try(breaker, clock):
+    open_breaker(breaker)
+    clock.now += RESET_TIMEOUT
+    assert breaker.allow()
+    breaker.release_trial()
+    assert breaker.allow()
+    assert not breaker.allow()
+
+
+def test_abandoned_trial_is_replaced_after_reset_timeout(breaker, clock):
+    open_breaker(breaker)
+    clock.now += RESET_TIMEOUT
+    assert breaker.allow()
+    clock.now += RESET_TIMEOUT - 1
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.allow()
+
+
+def test_guard_records_failures(breaker):
+    for _ in range(3):
+        with pytest.raises(RuntimeError):
+            with breaker.guard():
+                raise RuntimeError("timeout")
+    assert breaker.state == OPEN
+
+
+def test_guard_success_closes_a_trial(breaker, clock):
+    open_breaker(breaker)
+    clock.now += RESET_TIMEOUT
+    assert breaker.allow()
+    with breaker.guard():
+        pass
+    assert breaker.state == CLOSED
+
+
+def test_guard_ignores_errors_that_are_not_failures(breaker, clock):
+    open_breaker(breaker)
+    clock.now += RESET_TIMEOUT
+    assert breaker.allow()
+    with pytest.raises(ValueError):
+        with breaker.guard(is_failure=lambda exc: not isinstance(exc, ValueError)):
+            raise ValueError("bad request")
+    # The trial was released rather than failed, so another call may try
+    assert breaker.allow()
+
+
+def test_guard_releases_the_trial_on_cancellation(breaker, clock):
+    open_breaker(breaker)
+    clock.now += RESET_TIMEOUT
+    assert breaker.allow()
+
+    def stream():
+        with breaker.guard():
+            yield "chunk"
+            yield "chunk"
+
+    chunks = stream()
+    next(chunks)
+    chunks.close()
+    assert breaker.allow()
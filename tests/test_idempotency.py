@@ -0,0 +1,273 @@
+import asyncio
+import os
+import uuid
+
+import pytest
+from fastapi import HTTPException, Response
+from starlette.requests import Request
+
+from core import idempotency
+from core.idempotency import IdempotencyStore, SharedIdempotencyBackend, decode_result, encode_result
+
+TEST_REDIS_URL = os.getenv("TEST_REDIS_URL")
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+class DictBackend(SharedIdempotencyBackend):
+    """Shared backend kept in a dict, standing in for Redis between "workers"."""
+
+    def __init__(self):
+        self.records = {}
+
+    def claim(self, key, fingerprint, owner, ttl):
+        record = self.records.get(key)
+        if record is not None:
+            return record["fingerprint"], record.get("result")
+        self.records[key] = {"fingerprint": fingerprint, "owner": owner}
+        return None
+
+    def complete(self, key, owner, result, ttl):
+        if self.records.get(key, {}).get("owner") == owner:
+            self.records[key]["result"] = result
+
+    def release(self, key, owner):
+        if self.records.get(key, {}).get("owner") == owner:
+            del self.records[key]
+
+
+def make_request(key=None, path="/chats/1/messages"):
+    headers = [] if key is None else [(b"idempotency-key", key.encode())]
+    return Request({"type": "http", "method": "POST", "path": path, "headers": headers, "query_string": b""})
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(idempotency, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = IdempotencyStore(ttl=60)
+    monkeypatch.setattr(idempotency, "store", store)
+    monkeypatch.setattr(idempotency, "shared_backend", None)
+    return store
+
+
+def test_begin_returns_the_same_entry_for_a_duplicate():
+    async def scenario():
+        store = IdempotencyStore(ttl=60)
+        entry, owner = store.begin("1:k", "fp")
+        duplicate, duplicate_owner = store.begin("1:k", "fp")
+        assert owner and not duplicate_owner
+        assert duplicate is entry
+
+    asyncio.run(scenario())
+
+
+def test_begin_rejects_a_reused_key():
+    async def scenario():
+        store = IdempotencyStore(ttl=60)
+        store.begin("1:k", "fp")
+        with pytest.raises(HTTPException) as exc:
+            store.begin("1:k", "other")
+        assert exc.value.status_code == 422
+
+    asyncio.run(scenario())
+
+
+def test_entries_expire(clock):
+    async def scenario():
+        store = IdempotencyStore(ttl=60)
+        entry, _ = store.begin("1:k", "fp")
+        clock.now += 59
+        assert store.begin("1:k", "fp") == (entry, False)
+        clock.now += 1
+        renewed, owner = store.begin("1:k", "other")
+        assert owner and renewed is not entry
+
+    asyncio.run(scenario())
+
+
+def test_oldest_entries_are_evicted():
+    async def scenario():
+        store = IdempotencyStore(ttl=60, max_keys=2)
+        first, _ = store.begin("1:a", "fp")
+        store.begin("1:b", "fp")
+        store.begin("1:c", "fp")
+        assert store.begin("1:a", "fp")[0] is not first
+        assert not store.begin("1:c", "fp")[1]
+
+    asyncio.run(scenario())
+
+
+def test_fail_forgets_the_key_and_wakes_duplicates():
+    async def scenario():
+        store = IdempotencyStore(ttl=60)
+        entry, _ = store.begin("1:k", "fp")
+        waiter = asyncio.ensure_future(entry.wait())
+        await asyncio.sleep(0)
+        store.fail("1:k", entry, RuntimeError("boom"))
+        with pytest.raises(RuntimeError):
+            await waiter
+        assert store.begin("1:k", "fp")[1]
+
+    asyncio.run(scenario())
+
+
+def test_result_round_trip():
+    response = Response(content=b"\x00{}", status_code=201, headers={"X-Chat": "7"}, media_type="application/json")
+    decoded = decode_result(encode_result(response))
+    assert decoded.status_code == 201
+    assert decoded.body == b"\x00{}"
+    assert decoded.headers["x-chat"] == "7"
+    assert decoded.headers["content-type"] == "application/json"
+    assert decode_result(encode_result({"id": 3, "tags": ["a"]})) == {"id": 3, "tags": ["a"]}
+
+
+def test_run_idempotent_without_key_always_runs(store):
+    calls = []
+
+    async def handler():
+        calls.append(1)
+        return len(calls)
+
+    async def scenario():
+        return [await idempotency.run_idempotent(make_request(), 1, {}, handler) for _ in range(2)]
+
+    assert asyncio.run(scenario()) == [1, 2]
+
+
+def test_run_idempotent_coalesces_concurrent_duplicates(store):
+    calls = []
+
+    async def handler():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"calls": len(calls)}
+
+    async def scenario():
+        return await asyncio.gather(
+            *(idempotency.run_idempotent(make_request("k"), 1, {"content": "hi"}, handler) for _ in range(5))
+        )
+
+    assert asyncio.run(scenario()) == [{"calls": 1}] * 5
+
+
+def test_run_idempotent_scopes_keys_per_user(store):
+    async def handler():
+        return object()
+
+    async def scenario():
+        first = await idempotency.run_idempotent(make_request("k"), 1, {}, handler)
+        second = await idempotency.run_idempotent(make_request("k"), 2, {}, handler)
+        assert first is not second
+
+    asyncio.run(scenario())
+
+
+def test_run_idempotent_allows_retry_after_failure(store):
+    attempts = []
+
+    async def handler():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise HTTPException(status_code=503)
+        return "ok"
+
+    async def scenario():
+        with pytest.raises(HTTPException):
+            await idempotency.run_idempotent(make_request("k"), 1, {}, handler)
+        return await idempotency.run_idempotent(make_request("k"), 1, {}, handler)
+
+    assert asyncio.run(scenario()) == "ok"
+    assert len(attempts) == 2
+
+
+def test_run_idempotent_replays_across_workers(monkeypatch, store):
+    backend = DictBackend()
+    monkeypatch.setattr(idempotency, "shared_backend", backend)
+    calls = []
+
+    async def handler():
+        calls.append(1)
+        return Response(content=b"sent", status_code=201)
+
+    async def scenario():
+        first = await idempotency.run_idempotent(make_request("k"), 1, {}, handler)
+        # A retry reaching another worker finds nothing in that worker's store
+        monkeypatch.setattr(idempotency, "store", IdempotencyStore(ttl=60))
+        second = await idempotency.run_idempotent(make_request("k"), 1, {}, handler)
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert (second.status_code, second.body) == (first.status_code, first.body)
+
+
+def test_run_idempotent_rejects_reuse_across_workers(monkeypatch, store):
+    monkeypatch.setattr(idempotency, "shared_backend", DictBackend())
+
+    async def handler():
+        return "ok"
+
+    async def scenario():
+        await idempotency.run_idempotent(make_request("k"), 1, {"content": "a"}, handler)
+        monkeypatch.setattr(idempotency, "store", IdempotencyStore(ttl=60))
+        await idempotency.run_idempotent(make_request("k"), 1, {"content": "b"}, handler)
+
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(scenario())
+    assert exc.value.status_code == 422
+
+
+def test_failed_run_releases_the_shared_key(monkeypatch, store):
+    backend = DictBackend()
+    monkeypatch.setattr(idempotency, "shared_backend", backend)
+
+    async def handler():
+        raise RuntimeError("boom")
+
+    async def scenario():
+        with pytest.raises(RuntimeError):
+            await idempotency.run_idempotent(make_request("k"), 1, {}, handler)
+        # The release runs in the executor without being awaited
+        for _ in range(100):
+            if not backend.records:
+                break
+            await asyncio.sleep(0.01)
+
+    asyncio.run(scenario())
+    assert backend.records == {}
+
+
+def test_unreachable_redis_fails_open():
+    backend = idempotency.RedisIdempotencyBackend("redis://127.0.0.1:1/0")
+    assert backend.claim("1:k", "fp", "owner", 10) is None
+    assert backend.claim("1:k", "other", "owner-2", 10) is None
+
+
+@pytest.mark.skipif(not TEST_REDIS_URL, reason="set TEST_REDIS_URL to run against Redis")
+def test_redis_backend():
+    backend = idempotency.RedisIdempotencyBackend(TEST_REDIS_URL, prefix=f"test-{uuid.uuid4().hex}:")
+    assert backend.claim("1:k", "fp", "a", 10) is None
+    assert backend.claim("1:k", "fp", "b", 10) == ("fp", None)
+
+    backend.release("1:k", "b")  # Not the owner, so ignored
+    backend.complete("1:k", "b", "stolen", 10)
+    assert backend.claim("1:k", "fp", "b", 10) == ("fp", None)
+
+    backend.complete("1:k", "a", "done", 10)
+    assert backend.claim("1:k", "fp", "b", 10) == ("fp", "done")
+
+    assert backend.claim("1:r", "fp", "a", 10) is None
+    backend.release("1:r", "a")
+    assert backend.claim("1:r", "fp", "b", 10) is None
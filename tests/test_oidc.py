@@ -0,0 +1,202 @@
+import asyncio
+
+import httpx
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from benchmarks.oauth_stub import STUB_URL, StubProvider
+from core import oidc
+
+AUDIENCE = "test-client"
+TTL = 100.0
+REFRESH_AHEAD = 10.0
+MIN_REFRESH_INTERVAL = 5.0
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+class FlakyTransport(httpx.ASGITransport):
+    """Routes requests to the stub, or fails them while `fail` is set."""
+
+    def __init__(self, app):
+        super().__init__(app=app)
+        self.fail = False
+
+    async def handle_async_request(self, request):
+        if self.fail:
+            raise httpx.ConnectError("provider unreachable", request=request)
+        return await super().handle_async_request(request)
+
+
+@pytest.fixture
+def stub():
+    return StubProvider()
+
+
+@pytest.fixture
+def transport(stub):
+    return FlakyTransport(stub.app)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(oidc, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def cache(monkeypatch, transport):
+    cache = oidc.MetadataCache(TTL, REFRESH_AHEAD, MIN_REFRESH_INTERVAL)
+    monkeypatch.setattr(oidc, "metadata_cache", cache)
+    monkeypatch.setattr(oidc, "_client", httpx.AsyncClient(transport=transport, base_url=STUB_URL))
+    return cache
+
+
+async def settle(cache):
+    # Let background refreshes run to completion
+    while cache._tasks:
+        await asyncio.gather(*cache._tasks)
+
+
+def test_verify_id_token_fetches_metadata_once(stub, cache):
+    async def scenario():
+        for _ in range(3):
+            claims = await oidc.verify_id_token(
+                stub.mint_id_token("ada@example.com", AUDIENCE, nonce="n-1"), stub.discovery_url, AUDIENCE, nonce="n-1"
+            )
+            assert claims["email"] == "ada@example.com"
+
+    asyncio.run(scenario())
+    assert stub.hits["/.well-known/openid-configuration"] == 1
+    assert stub.hits["/jwks"] == 1
+
+
+@pytest.mark.parametrize(
+    "mint, verify",
+    [
+        ({"audience": "someone-else"}, {}),
+        ({"audience": AUDIENCE, "nonce": "n-1"}, {"nonce": "n-2"}),
+        ({"audience": AUDIENCE, "expires_in": -3600}, {}),
+    ],
+    ids=["audience", "nonce", "expired"],
+)
+def test_verify_id_token_rejects_invalid_tokens(stub, cache, mint, verify):
+    token = stub.mint_id_token("ada@example.com", **mint)
+    with pytest.raises(jwt.InvalidTokenError):
+        asyncio.run(oidc.verify_id_token(token, stub.discovery_url, AUDIENCE, **verify))
+
+
+def test_verify_id_token_rejects_foreign_signature(stub, cache):
+    async def scenario():
+        await oidc.verify_id_token(stub.mint_id_token("ada@example.com", AUDIENCE), stub.discovery_url, AUDIENCE)
+        # Same kid, different key: the cached JWKS still holds the genuine one
+        stub._private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        forged = stub.mint_id_token("ada@example.com", AUDIENCE)
+        with pytest.raises(jwt.InvalidSignatureError):
+            await oidc.verify_id_token(forged, stub.discovery_url, AUDIENCE)
+
+    asyncio.run(scenario())
+
+
+def test_rotated_key_refetches_jwks_once(stub, cache, clock):
+    async def scenario():
+        await oidc.verify_id_token(stub.mint_id_token("ada@example.com", AUDIENCE), stub.discovery_url, AUDIENCE)
+        clock.now += MIN_REFRESH_INTERVAL
+        stub.kid = "rotated"
+        stub._private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        claims = await oidc.verify_id_token(stub.mint_id_token("bob@example.com", AUDIENCE), stub.discovery_url, AUDIENCE)
+        assert claims["email"] == "bob@example.com"
+
+    asyncio.run(scenario())
+    assert stub.hits["/jwks"] == 2
+
+
+def test_unknown_key_refetch_is_rate_limited(stub, cache, clock):
+    async def scenario():
+        await oidc.verify_id_token(stub.mint_id_token("ada@example.com", AUDIENCE), stub.discovery_url, AUDIENCE)
+        token = jwt.encode({"aud": AUDIENCE}, "secret", algorithm="HS256", headers={"kid": "unknown"})
+        for _ in range(3):
+            with pytest.raises(jwt.InvalidTokenError):
+                await oidc.verify_id_token(token, stub.discovery_url, AUDIENCE)
+
+    asyncio.run(scenario())
+    assert stub.hits["/jwks"] == 1
+
+
+def test_cached_until_refresh_window(stub, cache, clock):
+    async def scenario():
+        first = await cache.get(stub.discovery_url)
+        clock.now += TTL - REFRESH_AHEAD - 1
+        assert await cache.get(stub.discovery_url) is first
+        await settle(cache)
+
+    asyncio.run(scenario())
+    assert stub.hits["/.well-known/openid-configuration"] == 1
+
+
+def test_refresh_window_serves_cached_copy_and_refreshes_in_background(stub, cache, clock):
+    async def scenario():
+        first = await cache.get(stub.discovery_url)
+        clock.now += TTL - REFRESH_AHEAD + 1
+        # Served at once from the cache; the refetch happens behind it
+        assert await cache.get(stub.discovery_url) is first
+        assert await cache.get(stub.discovery_url) is first
+        await settle(cache)
+        assert await cache.get(stub.discovery_url) is not first
+
+    asyncio.run(scenario())
+    assert stub.hits["/.well-known/openid-configuration"] == 2
+
+
+def test_expired_copy_is_refetched(stub, cache, clock):
+    async def scenario():
+        first = await cache.get(stub.discovery_url)
+        clock.now += TTL
+        assert await cache.get(stub.discovery_url) is not first
+
+    asyncio.run(scenario())
+    assert stub.hits["/.well-known/openid-configuration"] == 2
+
+
+def test_concurrent_misses_share_one_fetch(cache, transport):
+    stub = StubProvider(latency=0.05)
+    transport.app = stub.app
+
+    async def scenario():
+        documents = await asyncio.gather(*(cache.get(stub.discovery_url) for _ in range(20)))
+        assert all(document is documents[0] for document in documents)
+
+    asyncio.run(scenario())
+    assert stub.hits["/.well-known/openid-configuration"] == 1
+
+
+def test_failed_refresh_serves_stale_copy(stub, cache, clock, transport):
+    async def scenario():
+        first = await cache.get(stub.discovery_url)
+        clock.now += TTL * 2
+        transport.fail = True
+        assert await cache.get(stub.discovery_url) is first
+        # Not retried until the minimum refresh interval has passed
+        transport.fail = False
+        clock.now += MIN_REFRESH_INTERVAL / 2
+        assert await cache.get(stub.discovery_url) is first
+        assert stub.hits["/.well-known/openid-configuration"] == 1
+        clock.now += MIN_REFRESH_INTERVAL
+        assert await cache.get(stub.discovery_url) is not first
+
+    asyncio.run(scenario())
+    assert stub.hits["/.well-known/openid-configuration"] == 2
+
+
+def test_failed_first_fetch_raises(stub, cache, transport):
+    transport.fail = True
+    with pytest.raises(httpx.ConnectError):
+        asyncio.run(cache.get(stub.discovery_url))
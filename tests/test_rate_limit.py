@@ -0,0 +1,178 @@
+import asyncio
+import os
+import uuid
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from core import rate_limit
+from core.config import settings
+from core.rate_limit import AdmissionQueue, InMemoryRateLimitBackend, RedisRateLimitBackend
+
+TEST_REDIS_URL = os.getenv("TEST_REDIS_URL")
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    backend = InMemoryRateLimitBackend()
+    monkeypatch.setattr(rate_limit, "backend", backend)
+    return backend
+
+
+def test_bucket_allows_a_burst_then_rejects(clock):
+    backend = InMemoryRateLimitBackend()
+    assert [backend.take("k", rate=1.0, capacity=3)[0] for _ in range(4)] == [True, True, True, False]
+
+
+def test_bucket_reports_time_until_refill(clock):
+    backend = InMemoryRateLimitBackend()
+    backend.take("k", rate=0.5, capacity=1)
+    assert backend.take("k", rate=0.5, capacity=1) == (False, pytest.approx(2.0))
+    clock.now += 1.5
+    assert backend.take("k", rate=0.5, capacity=1) == (False, pytest.approx(0.5))
+
+
+def test_bucket_refills_up_to_capacity(clock):
+    backend = InMemoryRateLimitBackend()
+    for _ in range(2):
+        backend.take("k", rate=1.0, capacity=2)
+    clock.now += 100
+    assert [backend.take("k", rate=1.0, capacity=2)[0] for _ in range(3)] == [True, True, False]
+
+
+def test_refund_returns_tokens_up_to_capacity(clock):
+    backend = InMemoryRateLimitBackend()
+    backend.take("k", rate=1.0, capacity=1)
+    backend.refund("k", capacity=1)
+    backend.refund("k", capacity=1)
+    assert [backend.take("k", rate=1.0, capacity=1)[0] for _ in range(2)] == [True, False]
+
+
+def test_refund_of_unknown_key_does_nothing():
+    backend = InMemoryRateLimitBackend()
+    backend.refund("k", capacity=1)
+    assert backend._buckets == {}
+
+
+def test_idle_buckets_are_evicted_in_lru_order(clock):
+    backend = InMemoryRateLimitBackend(max_keys=2)
+    backend.take("a", rate=1.0, capacity=1)
+    backend.take("b", rate=1.0, capacity=1)
+    backend.take("a", rate=1.0, capacity=1)
+    backend.take("c", rate=1.0, capacity=1)
+    assert list(backend._buckets) == ["a", "c"]
+
+
+def test_slots_are_limited_and_released():
+    backend = InMemoryRateLimitBackend()
+    assert [backend.incr_slot("s", limit=2) for _ in range(3)] == [True, True, False]
+    backend.decr_slot("s")
+    assert backend.incr_slot("s", limit=2)
+    backend.decr_slot("s")
+    backend.decr_slot("s")
+    backend.decr_slot("s")
+    assert backend._slots == {}
+
+
+def test_unreachable_redis_falls_back_to_memory():
+    backend = RedisRateLimitBackend("redis://127.0.0.1:1/0")
+    assert [backend.take("k", rate=1.0, capacity=2)[0] for _ in range(3)] == [True, True, False]
+    assert [backend.incr_slot("s", limit=1) for _ in range(2)] == [True, False]
+    backend.decr_slot("s")
+    assert backend.incr_slot("s", limit=1)
+
+
+@pytest.mark.skipif(not TEST_REDIS_URL, reason="set TEST_REDIS_URL to run against Redis")
+def test_redis_backend():
+    backend = RedisRateLimitBackend(TEST_REDIS_URL, prefix=f"test-{uuid.uuid4().hex}:")
+    assert [backend.take("k", rate=0.01, capacity=2)[0] for _ in range(3)] == [True, True, False]
+    backend.refund("k", capacity=2)
+    assert backend.take("k", rate=0.01, capacity=2)[0]
+
+    assert [backend.incr_slot("s", limit=2) for _ in range(3)] == [True, True, False]
+    backend.decr_slot("s")
+    assert backend.incr_slot("s", limit=2)
+
+
+def test_global_rejection_refunds_the_user_token(monkeypatch, backend, clock):
+    monkeypatch.setattr(settings, "USER_LLM_BURST", 1)
+    monkeypatch.setattr(settings, "GLOBAL_LLM_BURST", 1)
+    monkeypatch.setattr(settings, "GLOBAL_LLM_RATE_PER_SEC", 1.0)
+    backend.take("global", rate=1.0, capacity=1)
+    request = SimpleNamespace(state=SimpleNamespace(user=SimpleNamespace(id=7)))
+
+    with pytest.raises(HTTPException) as exc:
+        rate_limit.check_llm_rate_limit(request)
+    assert exc.value.status_code == 429
+    assert exc.value.headers["Retry-After"] == "1"
+
+    clock.now += 1
+    rate_limit.check_llm_rate_limit(request)
+    with pytest.raises(HTTPException) as exc:
+        rate_limit.check_llm_rate_limit(request)
+    assert exc.value.detail == "Rate limit exceeded"
+
+
+def test_admission_queue_rejects_beyond_waiting_limit():
+    async def scenario():
+        queue = AdmissionQueue(max_active=1, max_waiting=1, timeout=5)
+        await queue.acquire()
+        waiter = asyncio.ensure_future(queue.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException):
+            await queue.acquire()
+        queue.release()
+        await waiter
+        assert queue.waiting == 0
+
+    asyncio.run(scenario())
+
+
+def test_admission_queue_times_out_waiters():
+    async def scenario():
+        queue = AdmissionQueue(max_active=1, max_waiting=1, timeout=0.01)
+        await queue.acquire()
+        with pytest.raises(HTTPException) as exc:
+            await queue.acquire()
+        assert exc.value.status_code == 429
+        assert queue.waiting == 0
+
+    asyncio.run(scenario())
+
+
+def test_admit_stream_release_is_idempotent(monkeypatch, backend):
+    monkeypatch.setattr(settings, "USER_MAX_STREAMS", 1)
+    monkeypatch.setattr(rate_limit, "llm_queue", AdmissionQueue(max_active=5, max_waiting=0, timeout=1))
+
+    async def scenario():
+        release = await rate_limit.admit_stream(7)
+        with pytest.raises(HTTPException):
+            await rate_limit.admit_stream(7)
+        release()
+        release()
+        # The slot is released on the loop, then in the executor
+        for _ in range(100):
+            if not backend._slots:
+                break
+            await asyncio.sleep(0.01)
+        assert backend._slots == {}
+        assert not rate_limit.llm_queue._semaphore.locked()
+        (await rate_limit.admit_stream(7))()
+
+    asyncio.run(scenario())
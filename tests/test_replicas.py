@@ -0,0 +1,131 @@
+import os
+import time
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from core.replicas import InMemoryWriterTracker, ReplicaRouter, WriterTracker
+
+# A streaming Postgres replica of TEST_PRIMARY_URL, e.g. one made with
+# pg_basebackup; the SQLite tests below stand in for it otherwise
+TEST_PRIMARY_URL = os.getenv("TEST_PRIMARY_URL", "")
+TEST_REPLICA_URL = os.getenv("TEST_REPLICA_URL", "")
+
+
+@pytest.fixture
+def primary(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'primary.db'}")
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def replica(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+    yield engine
+    engine.dispose()
+
+
+class BrokenTracker(WriterTracker):
+    def note_write(self, user_id, window):
+        raise ConnectionError("tracker down")
+
+    def wrote_recently(self, user_id):
+        raise ConnectionError("tracker down")
+
+
+def test_no_replicas_reads_from_primary(primary):
+    router = ReplicaRouter(primary, [])
+    router.refresh_lag()
+    assert router.engine_for(1) is primary
+
+
+def test_replica_unused_until_lag_is_measured(primary, replica):
+    router = ReplicaRouter(primary, [replica])
+    assert router.engine_for(None) is primary
+
+    router.refresh_lag()
+    assert router.engine_for(None) is replica
+
+
+def test_reads_round_robin_over_replicas(primary, replica, tmp_path):
+    other = create_engine(f"sqlite:///{tmp_path / 'other.db'}")
+    router = ReplicaRouter(primary, [replica, other])
+    router.refresh_lag()
+    assert {router.engine_for(None) for _ in range(4)} == {replica, other}
+
+
+def test_recent_writer_reads_from_primary(primary, replica):
+    router = ReplicaRouter(primary, [replica], sticky_window=0.2)
+    router.refresh_lag()
+    router.note_write(7)
+    assert router.engine_for(7) is primary
+    assert router.engine_for(8) is replica
+
+    time.sleep(0.25)
+    assert router.engine_for(7) is replica
+
+
+def test_tracker_failure_reads_from_primary(primary, replica):
+    router = ReplicaRouter(primary, [replica], writers=BrokenTracker())
+    router.refresh_lag()
+    router.note_write(7)  # Logged, not raised: the write has already committed
+    assert router.engine_for(7) is primary
+
+
+def test_lagging_replica_is_skipped(primary, replica, monkeypatch):
+    router = ReplicaRouter(primary, [replica], max_lag=5.0)
+    monkeypatch.setattr(ReplicaRouter, "_measure_lag", staticmethod(lambda engine: 30.0))
+    router.refresh_lag()
+    assert router.engine_for(None) is primary
+
+
+def test_stale_lag_reading_is_not_trusted(primary, replica):
+    router = ReplicaRouter(primary, [replica], lag_check_interval=0.05)
+    router.refresh_lag()
+    assert router.engine_for(None) is replica
+
+    time.sleep(0.2)
+    assert router.engine_for(None) is primary
+
+
+def test_failed_replica_is_skipped_until_retry(primary, replica):
+    router = ReplicaRouter(primary, [replica], retry_after=0.2)
+    router.refresh_lag()
+    router.mark_failed(replica)
+    router.refresh_lag()
+    assert router.engine_for(None) is primary
+
+    time.sleep(0.25)
+    router.refresh_lag()
+    assert router.engine_for(None) is replica
+
+
+def test_unreachable_replica_is_marked_failed(primary, tmp_path):
+    unreachable = create_engine(f"sqlite:///{tmp_path / 'missing' / 'replica.db'}")
+    router = ReplicaRouter(primary, [unreachable])
+    router.refresh_lag()
+    assert router.engine_for(None) is primary
+
+
+def test_in_memory_tracker_evicts_oldest():
+    tracker = InMemoryWriterTracker(max_writers=2)
+    for user_id in (1, 2, 3):
+        tracker.note_write(user_id, 60)
+    assert not tracker.wrote_recently(1)
+    assert tracker.wrote_recently(2) and tracker.wrote_recently(3)
+
+
+@pytest.mark.skipif(not (TEST_PRIMARY_URL and TEST_REPLICA_URL), reason="TEST_PRIMARY_URL and TEST_REPLICA_URL not set")
+def test_postgres_streaming_replica():
+    primary = create_engine(TEST_PRIMARY_URL)
+    replica = create_engine(TEST_REPLICA_URL)
+    try:
+        with replica.connect() as connection:
+            assert connection.execute(text("SELECT pg_is_in_recovery()")).scalar()
+        router = ReplicaRouter(primary, [replica])
+        router.refresh_lag()
+        assert router.engine_for(None) is replica
+    finally:
+        primary.dispose()
+        replica.dispose()
@@ -0,0 +1,111 @@
+import base64
+import json
+import os
+
+import pytest
+from sqlalchemy import create_engine, insert, text
+from sqlalchemy.orm import Session
+
+from models import oauth  # Registers OAuth, which User.oauth_accounts refers to
+from models.chat import Chat, Message
+from models.user import User
+from services.chat_service import decode_search_cursor, encode_search_cursor, search_messages
+
+# A disposable Postgres database; the search tests create and drop their own tables
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL", "")
+
+
+def raw_cursor(value) -> str:
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode()
+
+
+def test_cursor_round_trip():
+    cursor = encode_search_cursor(0.0607927, 1234)
+    assert decode_search_cursor(cursor) == (pytest.approx(0.0607927), 1234)
+
+
+def test_cursor_is_url_safe():
+    cursor = encode_search_cursor(1 / 3, 2 ** 40)
+    assert set(cursor) <= set("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_=")
+
+
+@pytest.mark.parametrize(
+    "cursor",
+    [
+        "not a cursor",
+        "e30",  # Truncated padding
+        raw_cursor({"rank": 0.1, "id": 1}),
+        raw_cursor([0.1]),
+        raw_cursor([0.1, 2, 3]),
+        raw_cursor(["high", 2]),
+        raw_cursor([0.1, None]),
+        raw_cursor(None),
+        base64.urlsafe_b64encode(b"\xff\xfe").decode(),
+    ],
+)
+def test_invalid_cursor_raises_value_error(cursor):
+    with pytest.raises(ValueError, match="Invalid search cursor"):
+        decode_search_cursor(cursor)
+
+
+@pytest.fixture
+def db():
+    engine = create_engine(TEST_DATABASE_URL)
+    tables = [User.__table__, Chat.__table__, Message.__table__]
+    with engine.begin() as connection:
+        connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    User.metadata.create_all(engine, tables=tables)
+    try:
+        with Session(engine) as session:
+            yield session
+    finally:
+        User.metadata.drop_all(engine, tables=tables)
+        with engine.begin() as connection:
+            connection.execute(text("DROP FUNCTION IF EXISTS bump_chat_version()"))
+        engine.dispose()
+
+
+def add_chat(db, email, messages):
+    user = User(email=email, hashed_password="x")
+    db.add(user)
+    db.flush()
+    chat = Chat(title="Recipes", user_id=user.id)
+    db.add(chat)
+    db.flush()
+    db.execute(insert(Message), [{"chat_id": chat.id, "sender": "user", "message": m} for m in messages])
+    db.commit()
+    return user
+
+
+@pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL not set")
+def test_pages_cover_every_match_once_in_rank_order(db):
+    # Equal texts tie on rank, so pages must break ties on the message id
+    user = add_chat(
+        db,
+        "ada@example.com",
+        ["apple pie"] * 4 + ["apple apple apple"] * 3 + ["an apple tart with apple", "banana bread"],
+    )
+    add_chat(db, "bob@example.com", ["apple pie"])
+
+    everything, cursor = search_messages(db, user, "apple", limit=100)
+    assert cursor is None
+    assert len(everything) == 8
+
+    paged, cursor = [], None
+    while True:
+        page, cursor = search_messages(db, user, "apple", limit=3, cursor=cursor)
+        paged.extend(page)
+        if cursor is None:
+            break
+    assert [row["message_id"] for row in paged] == [row["message_id"] for row in everything]
+    assert [row["rank"] for row in paged] == sorted((row["rank"] for row in paged), reverse=True)
+    assert all("<b>" in row["snippet"] for row in paged)
+
+
+@pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL not set")
+def test_last_full_page_has_no_cursor(db):
+    user = add_chat(db, "ada@example.com", ["apple pie"] * 4)
+    page, cursor = search_messages(db, user, "apple", limit=2)
+    page, cursor = search_messages(db, user, "apple", limit=2, cursor=cursor)
+    assert len(page) == 2
+    assert cursor is None
@@ -0,0 +1,110 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from core.sse import StreamBuffer, StreamDone, _coalesce, format_event, parse_last_event_id
+
+
+def run_coalesce(source, window=10.0, max_chars=1000):
+    async def scenario():
+        buffer = StreamBuffer("s1", user_id=1)
+        await _coalesce(iter(source) if isinstance(source, list) else source, buffer, window, max_chars)
+        return buffer
+
+    return asyncio.run(scenario())
+
+
+def data_of(frame):
+    return "\n".join(line[len("data: "):] for line in frame.splitlines() if line.startswith("data: "))
+
+
+def event_of(frame):
+    return next((line[len("event: "):] for line in frame.splitlines() if line.startswith("event: ")), None)
+
+
+def test_format_event_single_line():
+    assert format_event("hello") == "data: hello\n\n"
+
+
+def test_format_event_with_id_and_event():
+    assert format_event("{}", event="done", event_id="s1:3") == "id: s1:3\nevent: done\ndata: {}\n\n"
+
+
+@pytest.mark.parametrize("text", ["one\ntwo", "one\r\ntwo", "one\rtwo"])
+def test_format_event_splits_lines(text):
+    assert format_event(text) == "data: one\ndata: two\n\n"
+
+
+def test_format_event_keeps_empty_lines():
+    frame = format_event("a\n\nb\n")
+    assert frame == "data: a\ndata: \ndata: b\ndata: \n\n"
+    assert data_of(frame) == "a\n\nb\n"
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [("abc:3", ("abc", 3)), ("a:b:12", ("a:b", 12)), (None, None), ("", None), ("abc", None), (":3", None), ("abc:x", None)],
+)
+def test_parse_last_event_id(value, expected):
+    assert parse_last_event_id(value) == expected
+
+
+def test_coalesce_merges_chunks_up_to_max_chars():
+    buffer = run_coalesce(["ab", "cd", "ef"], max_chars=3)
+    assert [data_of(frame) for frame in buffer.frames] == ["abcd", "ef"]
+    assert buffer.finished
+
+
+def test_coalesce_flushes_when_window_passes():
+    def slow_source():
+        yield "a"
+        time.sleep(0.2)
+        yield "b"
+
+    buffer = run_coalesce(slow_source(), window=0.05)
+    assert [data_of(frame) for frame in buffer.frames] == ["a", "b"]
+
+
+def test_coalesce_skips_empty_chunks():
+    buffer = run_coalesce(["", "a", "", "b"])
+    assert [data_of(frame) for frame in buffer.frames] == ["ab"]
+
+
+def test_coalesce_keeps_newlines_inside_chunks():
+    buffer = run_coalesce(["line one\n", "line two"])
+    assert data_of(buffer.frames[0]) == "line one\nline two"
+
+
+def test_coalesce_flushes_text_before_done_event():
+    buffer = run_coalesce(["partial ", "reply", StreamDone(message_id=42)])
+    assert [data_of(frame) for frame in buffer.frames] == ["partial reply", json.dumps({"message_id": 42})]
+    assert event_of(buffer.frames[-1]) == "done"
+
+
+def test_coalesce_reports_source_errors():
+    def failing_source():
+        yield "text"
+        raise RuntimeError("LLM went away")
+
+    buffer = run_coalesce(failing_source())
+    assert data_of(buffer.frames[0]) == "text"
+    assert event_of(buffer.frames[-1]) == "error"
+    assert buffer.finished
+
+
+def test_frames_are_numbered_for_resume():
+    buffer = run_coalesce(["a", StreamDone(message_id=1)])
+    assert [parse_last_event_id(frame.split("\n")[0][len("id: "):]) for frame in buffer.frames] == [("s1", 1), ("s1", 2)]
+
+
+def test_follow_resumes_after_sequence_number():
+    async def scenario():
+        buffer = StreamBuffer("s1", user_id=1)
+        for text in ("a", "b", "c"):
+            buffer.append(text)
+        buffer.finish()
+        return [data_of(frame) async for frame in buffer.follow(after=1)]
+
+    assert asyncio.run(scenario()) == ["b", "c"]
@@ -1,30 +1,72 @@
-from openai import OpenAI 
 from core.config import settings
 import logging
 import json
-from services.chat_service import user_search_tool
-from core.database import SessionLocal
+import time
+from core.database import get_db_context
+from core.metrics import LLM_DURATION, LLM_TIME_TO_FIRST_TOKEN
+from core.circuit_breaker import llm_breaker
 
 logger = logging.getLogger(__name__)
 
-api_key = settings.OPENAI_API_KEY
-openai = OpenAI(api_key)
+_openai_client = None
+
+def get_openai_client():
+    """
+    Return the shared OpenAI client, importing and constructing it on first use
+    so that importing this module (and starting a worker) stays cheap.
+    """
+    global _openai_client
+    if _openai_client is None:
+        from openai import OpenAI
+        _openai_client = OpenAI(api_key=settings.OPENAI_API_KEY)
+    return _openai_client
 
 user_search_function = {
     "name": "user_search",
-    "description": "Search for users based on a text query using embeddings similarity.",
+    "description": (
+        "Search for users based on a text query using embeddings similarity. "
+        "Pass interests and location whenever the user mentions them; they narrow "
+        "the candidates before the similarity ranking."
+    ),
     "parameters": {
         "type": "object",
         "properties": {
             "query": {
                 "type": "string",
                 "description": "The search query string to find users."
+            },
+            "interests": {
+                "type": "array",
+                "items": {"type": "string"},
+                "description": "Only match users sharing at least one of these interests."
+            },
+            "location": {
+                "type": "string",
+                "description": "Only match users located in or near this place, e.g. a city."
             }
         },
         "required": ["query"]
     }
 }
 
+def run_user_search(chat, arguments):
+    """
+    Run the user_search tool with the model's arguments, holding a
+    connection only for the tool's own queries, not the LLM calls.
+    """
+    # Import here to avoid circular imports
+    from services.chat_service import user_search_tool
+    with get_db_context() as session:
+        tool_msg = user_search_tool(
+            session,
+            chat,
+            arguments.get('query', ''),
+            interests=arguments.get('interests'),
+            location=arguments.get('location'),
+        )
+        session.commit()
+    return tool_msg
+
 def prepare_messages(chat, extra_user_message=None):
     """
     Prepare messages list for OpenAI calls, including system prompt, chat messages, and optional extra user message.
@@ -45,65 +87,82 @@ def prepare_messages(chat, extra_user_message=None):
 
     return messages
 
+# Modules whose exceptions mean the LLM provider itself is failing. Tool and
+# database errors raised during a turn do not count towards opening the breaker.
+_LLM_ERROR_MODULES = ("openai", "httpx", "httpcore", "requests", "urllib3", "aiohttp")
+
+def _is_llm_error(exc: BaseException) -> bool:
+    # Matched by module so that openai does not have to be imported to check
+    return isinstance(exc, (ConnectionError, TimeoutError)) or any(
+        cls.__module__.split(".")[0] in _LLM_ERROR_MODULES for cls in type(exc).__mro__
+    )
+
 def generate_chat_title(text: str) -> str:
+    if not llm_breaker.allow():
+        return "New Chat"
     try:
-        prompt = f"Create a concise and descriptive title for the following conversation text:\n\n{text}\n\nTitle:" 
-        response = openai.ChatCompletion.create(
-            model='gpt-3.5-turbo',
-            messages=[{'role': 'user', 'content': prompt}],
-            max_tokens=15,
-            temperature=0.5,
-            n=1
-        )
-        choice = response['choices'][0]
-        title = choice['message']['content'].strip().strip('"')
-        return title
+        with llm_breaker.guard(_is_llm_error):
+            prompt = f"Create a concise and descriptive title for the following conversation text:\n\n{text}\n\nTitle:" 
+            start = time.perf_counter()
+            response = get_openai_client().chat.completions.create(
+                model='gpt-3.5-turbo',
+                messages=[{'role': 'user', 'content': prompt}],
+                max_tokens=15,
+                temperature=0.5,
+                n=1
+            )
+            LLM_DURATION.labels("title").observe(time.perf_counter() - start)
+            title = response.choices[0].message.content.strip().strip('"')
+            return title
     except Exception as e:
         logger.error(f'Error generating chat title: {str(e)}')
         return "New Chat"
 
 def generate_llm_response(chat):
+    if not llm_breaker.allow():
+        return "I'm sorry, I couldn't generate a response at the moment."
     try:
-        session = SessionLocal()
+        with llm_breaker.guard(_is_llm_error):
+            messages = prepare_messages(chat)
 
-        messages = prepare_messages(chat)
-
-        response = openai.ChatCompletion.create(
-            model='gpt-3.5-turbo',
-            messages=messages,
-            functions=[user_search_function],
-            function_call='auto',
-            max_tokens=150
-        )
+            start = time.perf_counter()
+            response = get_openai_client().chat.completions.create(
+                model='gpt-3.5-turbo',
+                messages=messages,
+                functions=[user_search_function],
+                function_call='auto',
+                max_tokens=150
+            )
+            LLM_DURATION.labels("reply").observe(time.perf_counter() - start)
 
-        choice = response['choices'][0]
-        message = choice['message']
+            message = response.choices[0].message
 
-        if 'function_call' in message:
-            function_name = message['function_call']['name']
-            arguments_json = message['function_call'].get('arguments', '{}')
-            arguments = json.loads(arguments_json)
+            if message.function_call:
+                function_name = message.function_call.name
+                arguments_json = message.function_call.arguments or '{}'
+                arguments = json.loads(arguments_json)
 
-            if function_name == 'user_search':
-                query = arguments.get('query', '')
-                if not query:
-                    raise ValueError('User search query argument missing')
+                if function_name == 'user_search':
+                    query = arguments.get('query', '')
+                    if not query:
+                        raise ValueError('User search query argument missing')
 
-                tool_msg = user_search_tool(session, chat, query)
-                session.commit()
+                    tool_msg = run_user_search(chat, arguments)
 
-                messages.append({'role': 'function', 'name': function_name, 'content': tool_msg.message})
+                    messages.append({'role': 'function', 'name': function_name, 'content': tool_msg.message})
 
-                second_response = openai.ChatCompletion.create(
-                    model='gpt-3.5-turbo',
-                    messages=messages,
-                    max_tokens=150
-                )
-                second_message = second_response['choices'][0]['message']['content'].strip()
+                    start = time.perf_counter()
+                    second_response = get_openai_client().chat.completions.create(
+                        model='gpt-3.5-turbo',
+                        messages=messages,
+                        max_tokens=150
+                    )
+                    LLM_DURATION.labels("reply_tool_followup").observe(time.perf_counter() - start)
+                    second_message = second_response.choices[0].message.content.strip()
 
-                return second_message
+                    return second_message
 
-        return message['content'].strip()
+            return message.content.strip()
 
     except Exception as e:
         logger.error(f'Error while calling OpenAI API: {str(e)}')
@@ -114,74 +173,88 @@ def stream_llm_response(chat, user_message):
     """
     Stream response from OpenAI API with support for function calls.
     """
+    if not llm_breaker.allow():
+        yield ""
+        return
     try:
-        session = SessionLocal()
-
-        messages = prepare_messages(chat, extra_user_message=user_message)
-
-        response = openai.ChatCompletion.create(
-            model='gpt-3.5-turbo',
-            messages=messages,
-            functions=[user_search_function],
-            function_call='auto',
-            max_tokens=150,
-            stream=True
-        )
-
-        function_call = None
-        collecting_function_args = False
-        function_name = None
-        function_args_str = ''
-        collected_content = ''
-
-        for chunk in response:
-            if 'choices' in chunk:
-                choice = chunk['choices'][0]
-                delta = choice.get('delta', {})
-
-                if 'content' in delta:
-                    content_piece = delta['content']
-                    collected_content += content_piece
-                    yield content_piece
-
-                if 'function_call' in delta:
-                    fc = delta['function_call']
-                    if 'name' in fc:
-                        function_name = fc['name']
-                        collecting_function_args = True
-                        function_args_str = ''
-                    if 'arguments' in fc and fc['arguments'] is not None:
-                        function_args_str += fc['arguments']
-
-                elif collecting_function_args and 'arguments' in delta:
-                    function_args_str += delta['arguments']
-
-                if collecting_function_args and function_name and function_args_str:
-                    try:
-                        args_json = json.loads(function_args_str)
-                        if function_name == 'user_search':
-                            query = args_json.get('query', '')
-                            tool_msg = user_search_tool(session, chat, query)
-                            session.commit()
-
-                            messages.append({'role': 'function', 'name': function_name, 'content': tool_msg.message})
-
-                            followup_response = openai.ChatCompletion.create(
-                                model='gpt-3.5-turbo',
-                                messages=messages,
-                                max_tokens=150,
-                                stream=True
-                            )
-
-                            for fchunk in followup_response:
-                                if 'choices' in fchunk:
-                                    fchoice = fchunk['choices'][0]
-                                    fdelta = fchoice.get('delta', {})
-                                    if 'content' in fdelta:
-                                        yield fdelta['content']
-                            break
-                    except json.JSONDecodeError:
-                        pass
+        with llm_breaker.guard(_is_llm_error):
+            messages = prepare_messages(chat, extra_user_message=user_message)
+
+            start = time.perf_counter()
+            first_token_seen = False
+            stream_duration_observed = False
+            response = get_openai_client().chat.completions.create(
+                model='gpt-3.5-turbo',
+                messages=messages,
+                functions=[user_search_function],
+                function_call='auto',
+                max_tokens=150,
+                stream=True
+            )
+
+            function_call = None
+            collecting_function_args = False
+            function_name = None
+            function_args_str = ''
+            collected_content = ''
+
+            for chunk in response:
+                if chunk.choices:
+                    delta = chunk.choices[0].delta
+
+                    if delta.content:
+                        content_piece = delta.content
+                        if not first_token_seen:
+                            first_token_seen = True
+                            LLM_TIME_TO_FIRST_TOKEN.labels("stream").observe(time.perf_counter() - start)
+                        collected_content += content_piece
+                        yield content_piece
+
+                    if delta.function_call:
+                        fc = delta.function_call
+                        if fc.name:
+                            function_name = fc.name
+                            collecting_function_args = True
+                            function_args_str = ''
+                        if fc.arguments is not None:
+                            function_args_str += fc.arguments
+
+                    if collecting_function_args and function_name and function_args_str:
+                        try:
+                            args_json = json.loads(function_args_str)
+                            if function_name == 'user_search':
+                                LLM_DURATION.labels("stream").observe(time.perf_counter() - start)
+                                stream_duration_observed = True
+                                tool_msg = run_user_search(chat, args_json)
+
+                                messages.append({'role': 'function', 'name': function_name, 'content': tool_msg.message})
+
+                                followup_start = time.perf_counter()
+                                followup_token_seen = False
+                                followup_response = get_openai_client().chat.completions.create(
+                                    model='gpt-3.5-turbo',
+                                    messages=messages,
+                                    max_tokens=150,
+                                    stream=True
+                                )
+
+                                for fchunk in followup_response:
+                                    if fchunk.choices:
+                                        fdelta = fchunk.choices[0].delta
+                                        if fdelta.content:
+                                            if not followup_token_seen:
+                                                followup_token_seen = True
+                                                LLM_TIME_TO_FIRST_TOKEN.labels("stream_tool_followup").observe(
+                                                    time.perf_counter() - followup_start
+                                                )
+                                            yield fdelta.content
+                                LLM_DURATION.labels("stream_tool_followup").observe(time.perf_counter() - followup_start)
+                                break
+                        except json.JSONDecodeError:
+                            pass
+
+            if not stream_duration_observed:
+                LLM_DURATION.labels("stream").observe(time.perf_counter() - start)
 
     except Exception as e:
         logger.error(f'Error while streaming OpenAI API: {str(e)}')
@@ -1,42 +1,81 @@
-from fastapi import HTTPException
+from typing import Optional, Tuple
+from sqlalchemy import select, update
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import Session
-from core.security import create_access_token
+from core.security import create_access_token, UNUSABLE_PASSWORD
 from core.config import logger
+from core.database import unit_of_work
+from models.oauth import OAuth
 from models.user import User
 
-def get_or_create_user_with_oauth(email: str, token: dict, user_info: dict, db: Session) -> str:
+def _linked_user(db: Session, provider: str, provider_user_id: str) -> Optional[Tuple[int, str]]:
+    return db.execute(
+        select(OAuth.user_id, User.email)
+        .join(User, User.id == OAuth.user_id)
+        .where(OAuth.provider == provider, OAuth.provider_user_id == provider_user_id)
+    ).first()
+
+def link_oauth_user(db: Session, provider: str, provider_user_id: str, email: str, user_info: dict) -> Optional[str]:
     """
-    Checks if a user exists by email. If not, creates a new user using the provided
-    OAuth data. Then generates a JWT token and updates the user's active token.
-    
+    Finds or creates the user for an OAuth identity, links the identity to
+    it, and issues a JWT that becomes the user's active token.
+
+    Returning logins are one indexed lookup on (provider, provider_user_id).
+    A first login creates a new user and links the identity to it. An
+    existing account with the same email is never linked automatically:
+    that would hand the account to whoever controls the provider identity,
+    so None is returned instead and nothing is written. The user insert uses
+    ON CONFLICT DO NOTHING, so a concurrent first login for the same identity
+    waits for the other transaction and then finds its link. OAuth users get
+    an unusable password rather than a bcrypt hash, so signup does no hashing.
+
+    :param db: SQLAlchemy Session.
+    :param provider: Provider name, e.g. "google".
+    :param provider_user_id: The provider's stable user id ("sub" claim or GitHub id).
     :param email: User email extracted from the OAuth provider.
-    :param token: The token dictionary obtained from the OAuth provider.
     :param user_info: Dictionary containing user info from the provider.
-    :param db: SQLAlchemy Session.
-    :return: A JWT access token.
+    :return: A JWT access token, or None if the email belongs to an account
+             this identity is not linked to.
     """
-    # Check if the user exists
-    user = db.query(User).filter(User.email == email).first()
-    if not user:
-        new_user_data = {
-            "email": email,
-            # Use the provider's access token as password (it's uncrackable)
-            "password": token.get("access_token"),
-            "username": user_info.get("name"),
-            "profile_pic": user_info.get("picture"),  # Might be None for some providers
-            "interests": [],
-            "location": None,
-        }
-        # Import here to avoid circular imports
-        from schemas.user import UserCreate
-        from services.auth_service import create_user
-        user_create = UserCreate(**new_user_data)
-        user = create_user(user_create, db)
-    
-    # Generate a JWT token and update active_token
-    access_token = create_access_token(data={"sub": user.email})
-    user.active_token = access_token
-    db.commit()
-    db.refresh(user)
-    logger.info(f"User {user.email} authenticated via OAuth, token updated.")
+    with unit_of_work(db):
+        row = _linked_user(db, provider, provider_user_id)
+
+        if row is not None:
+            user_id, user_email = row
+        else:
+            user_id = db.execute(
+                insert(User).values(
+                    email=email,
+                    hashed_password=UNUSABLE_PASSWORD,
+                    username=user_info.get("name"),
+                    profile_pic=user_info.get("picture"),  # Might be None for some providers
+                    interests=[],
+                ).on_conflict_do_nothing(index_elements=[User.email]).returning(User.id)
+            ).scalar_one_or_none()
+            if user_id is None:
+                # Either a concurrent first login created the user and its link,
+                # or the email belongs to an account this identity is not linked to
+                row = _linked_user(db, provider, provider_user_id)
+                if row is None:
+                    logger.warning("Refused to link a %s identity to an existing account", provider)
+                    return None
+                user_id, user_email = row
+            else:
+                user_email = email
+                link_insert = insert(OAuth).values(user_id=user_id, provider=provider, provider_user_id=provider_user_id)
+                linked_user_id = db.execute(
+                    link_insert.on_conflict_do_update(
+                        index_elements=[OAuth.provider, OAuth.provider_user_id],
+                        set_={"provider": link_insert.excluded.provider},
+                    ).returning(OAuth.user_id)
+                ).scalar_one()
+                if linked_user_id != user_id:
+                    # The identity was linked to a user with a different email meanwhile
+                    user_id = linked_user_id
+                    user_email = db.execute(select(User.email).where(User.id == user_id)).scalar_one()
+
+        access_token = create_access_token(data={"sub": user_email})
+        db.execute(update(User).where(User.id == user_id).values(active_token=access_token))
+
+    logger.info("User %s authenticated via %s OAuth, token updated.", user_email, provider)
     return access_token